@@ -0,0 +1,202 @@
+'''
+Benchmarks of the shadow, sunshine and facade paths on synthetic cities.
+
+Usage::
+
+    python -m benchmarks.run --sizes 100 1000 10000 --output benchmark.json
+    python -m benchmarks.run --scenarios sunlight sunlight_roof --sizes 100000
+
+Each scenario is timed `--repeat` times, and run once more under `tracemalloc` for the peak memory
+(allocations of numpy, pandas and shapely are traced, those inside GEOS are not).
+Scenarios are skipped for sizes above their `max_size` unless `--force` is given.
+The results are written as JSON together with the versions and the commit, so runs can be compared over time.
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import shapely
+
+import pybdshadow
+
+from .synthetic import synthetic_city
+
+DATE = pd.to_datetime('2022-06-21 03:00:00')
+DAY = '2022-06-21'
+
+
+def _pointlight(buildings):
+    # 点光源位于城市中心上空100米
+    lon, lat = buildings.unary_union.centroid.coords[0]
+    return pybdshadow.bdshadow_pointlight(buildings, lon, lat, 100)
+
+
+def _shadowcoverage(buildings):
+    shadows = pybdshadow.cal_sunshadows(buildings, dates=[DAY], precision=3600)
+    return pybdshadow.cal_shadowcoverage(shadows, buildings, precision=3600, accuracy=5)
+
+
+# 名称：(函数, 默认最大规模)
+SCENARIOS = {
+    'sunlight': (lambda buildings: pybdshadow.bdshadow_sunlight(buildings, DATE), 100000),
+    'sunlight_roof': (lambda buildings: pybdshadow.bdshadow_sunlight(buildings, DATE, roof=True), 100000),
+    'pointlight': (_pointlight, 10000),
+    'sunshadows': (lambda buildings: pybdshadow.cal_sunshadows(buildings, dates=[DAY], precision=3600), 10000),
+    'shadowcoverage': (_shadowcoverage, 1000),
+    'sunshine_grid': (lambda buildings: pybdshadow.cal_sunshine(
+        buildings, day=DAY, accuracy=5, precision=3600), 1000),
+    'sunshine_vector': (lambda buildings: pybdshadow.cal_sunshine(
+        buildings, day=DAY, accuracy='vector', precision=3600), 1000),
+    'sunshine_facade': (lambda buildings: pybdshadow.cal_sunshine_facade(
+        buildings, DAY, precision=3600), 100),
+    'sunshine_facade_samples': (lambda buildings: pybdshadow.cal_sunshine_facade(
+        buildings, DAY, precision=3600, accuracy=1), 1000),
+}
+
+
+def run_scenario(fn, buildings, repeat=3):
+    '''
+    Time a scenario and measure its peak traced memory.
+
+    Returns
+    -------
+    result : dict
+        `times` (s) of each run, `min`/`median` time, `peak_memory` (byte) and `output_rows`.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn(buildings)
+        times.append(time.perf_counter()-start)
+
+    tracemalloc.start()
+    fn(buildings)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'times': times,
+            'min': min(times),
+            'median': float(np.median(times)),
+            'peak_memory': peak,
+            'output_rows': len(output[0]) if isinstance(output, tuple) else len(output)}
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scenarios=None, sizes=(100, 1000), repeat=3, force=False, seed=0, printlog=True, **city_kwargs):
+    '''
+    Run the benchmarks.
+
+    Parameters
+    ----------
+    scenarios : list
+        Names of the scenarios in `SCENARIOS`, default all.
+    sizes : list
+        Numbers of buildings.
+    repeat : int
+        Timed runs of each scenario.
+    force : bool
+        Also run the scenarios for sizes above their `max_size`.
+    seed : int
+        Random seed of the synthetic city.
+    city_kwargs :
+        Other arguments of `synthetic_city`.
+
+    Returns
+    -------
+    report : dict
+        `meta` (versions, commit, time) and `results` (one record per scenario and size).
+    '''
+    scenarios = list(SCENARIOS) if scenarios is None else scenarios
+    results = []
+    for n in sizes:
+        buildings = pybdshadow.bd_preprocess(synthetic_city(n, seed=seed, **city_kwargs))
+        walls = int((shapely.get_num_coordinates(shapely.get_exterior_ring(buildings['geometry'].values))-1).sum())
+        for name in scenarios:
+            fn, max_size = SCENARIOS[name]
+            if n > max_size and not force:
+                continue
+            result = run_scenario(fn, buildings, repeat)
+            result.update({'scenario': name, 'buildings': n, 'walls': walls})
+            results.append(result)
+            if printlog:
+                print('{:<16}{:>8} buildings  {:>9.3f} s  {:>9.1f} MB'.format(
+                    name, n, result['min'], result['peak_memory']/2**20), flush=True)
+
+    meta = {'time': datetime.now().isoformat(timespec='seconds'),
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pybdshadow': pybdshadow.__version__,
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'shapely': shapely.__version__,
+            'geopandas': __import__('geopandas').__version__,
+            'seed': seed,
+            'city': city_kwargs,
+            'repeat': repeat}
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline, report, threshold=0.1):
+    '''
+    Compare a report with a baseline report.
+
+    Parameters
+    ----------
+    baseline, report : dict
+        Reports returned by `run` or loaded from the JSON files.
+    threshold : number
+        Relative change of the minimum time regarded as a regression.
+
+    Returns
+    -------
+    comparison : DataFrame
+        `scenario`, `buildings`, the minimum times and peak memory of both reports,
+        `ratio` of the times and `regression`.
+    '''
+    columns = ['scenario', 'buildings', 'min', 'peak_memory']
+    old = pd.DataFrame(baseline['results'])[columns]
+    new = pd.DataFrame(report['results'])[columns]
+    comparison = pd.merge(old, new, on=['scenario', 'buildings'], suffixes=('_baseline', ''))
+    comparison['ratio'] = comparison['min']/comparison['min_baseline']
+    comparison['regression'] = comparison['ratio'] > 1+threshold
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=None)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--density', type=float, default=0.35)
+    parser.add_argument('--force', action='store_true', help='run the scenarios above their max size')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', default=None, help='baseline JSON file to compare with')
+    args = parser.parse_args(argv)
+
+    report = run(args.scenarios, args.sizes, args.repeat, args.force, args.seed, density=args.density)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to', args.output)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(compare(baseline, report).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
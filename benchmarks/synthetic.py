@@ -0,0 +1,84 @@
+'''
+Deterministic synthetic city for the benchmarks.
+
+The buildings are laid out on a square grid of lots around a center point.
+Each lot holds a rectangular or L-shaped tower, slightly rotated and jittered,
+and the footprint covers `density` of the lot area on average.
+'''
+import numpy as np
+import geopandas as gpd
+import shapely
+from shapely import affinity
+
+from pybdshadow.utils import _local_scale
+
+
+def synthetic_city(n=100, lot_size=50, density=0.35, l_ratio=0.3, height=(10, 120),
+                   height_distribution='lognormal', center=(139.70, 35.53), seed=0):
+    '''
+    Generate a synthetic city of rectangular and L-shaped towers.
+
+    Parameters
+    ----------
+    n : int
+        Number of buildings.
+    lot_size : number
+        Side length of the square lots (meter).
+    density : number
+        Mean ratio of the footprint area to the lot area, between 0 and 0.8.
+    l_ratio : number
+        Ratio of L-shaped buildings.
+    height : tuple
+        (min, max) height of the buildings (meter).
+    height_distribution : str
+        `uniform` or `lognormal` (many low buildings and a few towers), clipped to `height`.
+    center : tuple
+        (lon, lat) of the center of the city.
+    seed : int
+        Random seed, the same arguments always generate the same city.
+
+    Returns
+    -------
+    buildings : GeoDataFrame
+        Buildings with `building_id`, `height` and `geometry` columns, in WGS84.
+    '''
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n)))
+    row, col = np.divmod(np.arange(n), side)
+
+    # 地块中心（米），以城市中心为原点
+    x = (col-(side-1)/2)*lot_size
+    y = (row-(side-1)/2)*lot_size
+    # 建筑边长：面积比例为 density，长宽比在 0.5~2 之间
+    area = density*lot_size**2*rng.uniform(0.6, 1.4, n)
+    aspect = np.exp(rng.uniform(np.log(0.5), np.log(2), n))
+    w = np.minimum(np.sqrt(area*aspect), lot_size*0.9)
+    d = np.minimum(np.sqrt(area/aspect), lot_size*0.9)
+    x += rng.uniform(-0.5, 0.5, n)*(lot_size*0.9-w)
+    y += rng.uniform(-0.5, 0.5, n)*(lot_size*0.9-d)
+    angle = rng.uniform(-15, 15, n)
+    l_shaped = rng.random(n) < l_ratio
+
+    footprints = shapely.box(x-w/2, y-d/2, x+w/2, y+d/2)
+    # L形：去掉一个角
+    notch = shapely.box(x, y, x+w/2, y+d/2)
+    footprints[l_shaped] = shapely.difference(footprints[l_shaped], notch[l_shaped])
+    footprints = np.array([affinity.rotate(footprint, a, origin=(cx, cy))
+                           for footprint, a, cx, cy in zip(footprints, angle, x, y)])
+
+    low, high = height
+    if height_distribution == 'uniform':
+        heights = rng.uniform(low, high, n)
+    elif height_distribution == 'lognormal':
+        heights = low*rng.lognormal(0.8, 0.6, n)
+    else:
+        raise ValueError('height_distribution should be uniform or lognormal')
+    heights = np.clip(heights, low, high).round(1)
+
+    # 米转经纬度
+    kx, ky = _local_scale(center[1])
+    coords = shapely.get_coordinates(footprints)
+    coords = np.c_[center[0]+coords[:, 0]/kx, center[1]+coords[:, 1]/ky]
+    footprints = shapely.set_coordinates(footprints.copy(), coords)
+    return gpd.GeoDataFrame({'building_id': np.arange(n), 'height': heights},
+                            geometry=footprints, crs='EPSG:4326')
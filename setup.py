@@ -17,8 +17,12 @@ setuptools.setup(
         "Bug Tracker": "https://github.com/ni1o1/pybdshadow/issues",
     },
     install_requires=[
-        "numpy", "pandas", "shapely", "geopandas", "matplotlib","suncalc","keplergl","transbigdata","mapbox_vector_tile","vt2geojson","requests","tqdm","retrying"
+        "numpy", "pandas", "shapely>=2.0", "geopandas", "matplotlib","suncalc","keplergl","transbigdata","mapbox_vector_tile","vt2geojson","requests","tqdm","retrying"
     ],
+    extras_require={
+        # ShadowCache 与 GeoParquet 保存阴影
+        "parquet": ["pyarrow", 'geopandas>=1.0; python_version >= "3.9"'],
+    },
     classifiers=[
         "Operating System :: OS Independent",
         "Topic :: Text Processing :: Indexing",
@@ -46,8 +46,12 @@ from .get_buildings import (
 )
 from .pybdshadow import (
     bdshadow_sunlight,
+    bdshadow_sunlight_tiled,
     bdshadow_pointlight
 )
+from .buildingset import (
+    BuildingSet
+)
 from .preprocess import (
     bd_preprocess
 )
@@ -58,9 +62,28 @@ from .visualization import (
 from .analysis import (
     cal_sunshine,
     cal_sunshadows,
+    iter_sunshadows,
     cal_shadowcoverage,
+    ShadowCoverageAccumulator,
     get_timetable
 )
+from .raster import (
+    cal_sunshine_raster,
+    rasterize_shadowcoverage
+)
+from .cache import (
+    ShadowCache
+)
+from .storage import (
+    read_sunshadows
+)
+from .horizon import (
+    cal_sunshine_horizon,
+    cal_horizon
+)
+from .profiling import (
+    StageProfiler
+)
 
 from .facade import (
     cal_sunshine_facade
@@ -71,13 +94,24 @@ from .utils import (
 )
 
 __all__ = ['bdshadow_sunlight',
+           'bdshadow_sunlight_tiled',
            'bdshadow_pointlight',
+           'BuildingSet',
            'bd_preprocess',
            'show_bdshadow',
            'cal_sunshine',
            'cal_sunshadows',
+           'iter_sunshadows',
            'cal_shadowcoverage',
+           'ShadowCoverageAccumulator',
            'get_timetable',
+           'cal_sunshine_raster',
+           'rasterize_shadowcoverage',
+           'cal_sunshine_horizon',
+           'ShadowCache',
+           'read_sunshadows',
+           'cal_horizon',
+           'StageProfiler',
            'get_buildings_by_polygon',
            'get_buildings_by_bounds',
            'cal_sunshine_facade',
@@ -1,31 +1,77 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from suncalc import get_times
-from shapely.geometry import MultiPolygon,Polygon
+import shapely
+from shapely.geometry import Polygon
 import transbigdata as tbd
 import geopandas as gpd
 from .pybdshadow import (
-    bdshadow_sunlight,
+    calSunShadow_batch,
+    _prepare_buildings,
+    _buildings_center,
+    _sunlight_shadows
 )
+from .ephemeris import sun_table, sun_position, day_length
 from .preprocess import bd_preprocess
-from .utils import count_overlapping_features
+from .utils import count_overlapping_features, union_by_group
+from .cache import ShadowCache, buildings_hash
+from .storage import write_sunshadows, sunshadows_saved
+from . import utils
+from .profiling import stage
+
+# number of wall shadows (walls x timesteps) computed in one batch by cal_sunshadows
+SHADOW_BATCH_SIZE = 1000000
+# maximum number of timesteps in one task when cal_sunshadows runs in parallel
+PARALLEL_BATCH_SIZE = 24
+
+# buildings and walls held by each worker process of cal_sunshadows
+_WORKER_STATE = None
+
+
+def _init_sunshadow_worker(state):
+    # 进程初始化时保存建筑与墙面，之后每个任务只传太阳位置
+    global _WORKER_STATE
+    _WORKER_STATE = state
+
+
+def _sunshadow_chunk(task):
+    # 计算一批时刻的阴影，state为None时使用进程初始化时保存的建筑与墙面
+    sunPositions, state = task
+    if state is None:
+        state = _WORKER_STATE
+    return list(_iter_sunshadow_chunk(sunPositions, state))
+
+
+def _iter_sunshadow_chunk(sunPositions, state):
+    # 逐个时刻生成一批时刻的阴影
+    buildings, building, roof, include_building = state
+    with stage('wall_shadows', len(building.walls)*len(sunPositions)):
+        shadowShapes = calSunShadow_batch(
+            building.walls, building.wall_height, sunPositions)
+    for shadowShape, sunPosition in zip(shadowShapes, sunPositions):
+        yield _sunlight_shadows(
+            buildings, building, shadowShape,
+            {'azimuth': sunPosition[0], 'altitude': sunPosition[1]},
+            roof=roof, include_building=include_building)
+
+
+def _ordered_map(executor, fn, tasks, window):
+    # 按顺序返回结果，同时最多提交window个任务，避免结果堆积在内存中
+    futures = deque()
+    for task in tasks:
+        futures.append(executor.submit(fn, task))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
 
 def get_timetable(lon, lat, dates=['2022-01-01'], precision=3600, padding=1800):
     # generate timetable with given interval
-    def get_timeSeries(day, lon, lat, precision=3600, padding=1800):
-        date = pd.to_datetime(day+' 12:45:33.959797119')
-        times = get_times(date, lon, lat)
-        date_sunrise = times['sunrise']
-        data_sunset = times['sunset']
-        timestamp_sunrise = pd.Series(date_sunrise).astype('int')
-        timestamp_sunset = pd.Series(data_sunset).astype('int')
-        times = pd.to_datetime(pd.Series(range(
-            timestamp_sunrise.iloc[0]+padding*1000000000,
-            timestamp_sunset.iloc[0]-padding*1000000000,
-            precision*1000000000)))
-        return times
-    dates = pd.DataFrame(pd.concat(
-        [get_timeSeries(date, lon, lat, precision, padding) for date in dates]), columns=['datetime'])
-    dates['date'] = dates['datetime'].apply(lambda r: str(r)[:19])
+    dates = sun_table(lon, lat, dates, precision, padding)[['datetime']]
+    dates['date'] = dates['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
     return dates
 
 
@@ -58,76 +104,80 @@ def cal_sunshine(buildings, day='2022-01-01', roof=False, grids=gpd.GeoDataFrame
     '''
 
 
-    # calculate day time duration
-    lon, lat = buildings['geometry'].iloc[0].bounds[:2]
-    date = pd.to_datetime(day+' 12:45:33.959797119')
-    times = get_times(date, lon, lat)
-    date_sunrise = times['sunrise']
-    data_sunset = times['sunset']
-    timestamp_sunrise = pd.Series(date_sunrise).astype('int')
-    timestamp_sunset = pd.Series(data_sunset).astype('int')
-    sunlighthour = (
-        timestamp_sunset.iloc[0]-timestamp_sunrise.iloc[0])/(1000000000*3600)
-
-    # Generate shadow every time interval
-    shadows = cal_sunshadows(
-        buildings, dates=[day], precision=precision, padding=padding)
-    if accuracy == 'vector':
-        if roof:
-            shadows = shadows[shadows['type'] == 'roof']
-            if len(shadows)>0:
-                shadows = bd_preprocess(shadows)
-                shadows = shadows.groupby(['date', 'type','height'])['geometry'].apply(
-                    lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
-                shadows = bd_preprocess(shadows)
-
-            # 额外：增加屋顶面
-            shadows = pd.concat([shadows, buildings])
-            #return shadows
-            shadows = shadows.groupby('height').apply(count_overlapping_features).reset_index()
-            shadows['count'] -= 1
-        else:
-            shadows = shadows[shadows['type'] == 'ground']
+    with stage('cal_sunshine', len(buildings)):
+        # calculate day time duration
+        lon, lat = buildings['geometry'].iloc[0].bounds[:2]
+        sunlighthour = day_length(day, lon, lat)
 
-            shadows = bd_preprocess(shadows)
-            shadows = shadows.groupby(['date', 'type'])['geometry'].apply(
-            lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
-            shadows = bd_preprocess(shadows)
+        # Generate shadow every time interval
+        shadows = iter_sunshadows(
+            buildings, dates=[day], precision=precision, padding=padding)
+        if accuracy == 'vector':
+            # 逐个时刻合并阴影，只保留合并后的阴影
+            if roof:
+                with stage('union'):
+                    shadows = _union_sunshadows(shadows, 'roof', ['date', 'type', 'height'])
 
-            # 额外：增加地面面
-            minpos = shadows.bounds[['minx','miny']].min()
-            maxpos = shadows.bounds[['maxx','maxy']].max()
+                # 额外：增加屋顶面
+                with stage('overlap', len(shadows)):
+                    shadows = pd.concat([shadows, buildings])
+                    #return shadows
+                    shadows = shadows.groupby('height').apply(count_overlapping_features).reset_index()
+                    shadows['count'] -= 1
+            else:
+                with stage('union'):
+                    shadows = _union_sunshadows(shadows, 'ground', ['date', 'type'])
+
+                # 额外：增加地面面
+                minpos = shadows.bounds[['minx','miny']].min()
+                maxpos = shadows.bounds[['maxx','maxy']].max()
             
-            ground = gpd.GeoDataFrame(geometry=[
-                Polygon([
-                [minpos['minx'],minpos['miny']],
-                [minpos['minx'],maxpos['maxy']],
-                [maxpos['maxx'],maxpos['maxy']],
-                [maxpos['maxx'],minpos['miny']],
-            ])
-            ])
-            shadows = pd.concat([shadows, 
-                                 ground
-                                 ])
-            shadows = count_overlapping_features(shadows,buffer=False)
-            shadows['count'] -= 1
+                ground = gpd.GeoDataFrame(geometry=[
+                    Polygon([
+                    [minpos['minx'],minpos['miny']],
+                    [minpos['minx'],maxpos['maxy']],
+                    [maxpos['maxx'],maxpos['maxy']],
+                    [maxpos['maxx'],minpos['miny']],
+                ])
+                ])
+                with stage('overlap', len(shadows)):
+                    shadows = pd.concat([shadows, 
+                                         ground
+                                         ])
+                    shadows = count_overlapping_features(shadows,buffer=False)
+                    shadows['count'] -= 1
             
 
-        shadows['time'] = shadows['count']*precision
-        shadows['Hour'] = sunlighthour-shadows['time']/3600
-        #shadows.loc[shadows['Hour'] <= 0, 'Hour'] = 0
-        return shadows
-    else:
-        # Grid analysis of shadow cover duration(ground).
-        grids = cal_shadowcoverage(
-            shadows, buildings, grids=grids, roof=roof, precision=precision, accuracy=accuracy)
+            shadows['time'] = shadows['count']*precision
+            shadows['Hour'] = sunlighthour-shadows['time']/3600
+            #shadows.loc[shadows['Hour'] <= 0, 'Hour'] = 0
+            return shadows
+        else:
+            # Grid analysis of shadow cover duration(ground).
+            grids = cal_shadowcoverage(
+                shadows, buildings, grids=grids, roof=roof, precision=precision, accuracy=accuracy)
 
-        grids['Hour'] = sunlighthour-grids['time']/3600
-        return grids
+            grids['Hour'] = sunlighthour-grids['time']/3600
+            return grids
     
 
+def _union_sunshadows(shadows_stream, shadow_type, by):
+    # 逐个时刻合并指定类型的阴影
+    shadows = []
+    for shadow in shadows_stream:
+        shadow = shadow[shadow['type'] == shadow_type]
+        if len(shadow) > 0:
+            shadow = bd_preprocess(shadow)
+            shadow = union_by_group(shadow, by)
+            shadows.append(bd_preprocess(shadow))
+    if len(shadows) == 0:
+        return gpd.GeoDataFrame(columns=by+['geometry'], geometry='geometry')
+    return pd.concat(shadows)
+
+
 def cal_sunshadows(buildings, cityname='somecity', dates=['2022-01-01'], precision=3600, padding=1800,
-                   roof=True, include_building=True, save_shadows=False, printlog=False):
+                   roof=True, include_building=True, save_shadows=False, printlog=False,
+                   n_jobs=1, executor=None, cache=None, save_format='geojson'):
     '''
     Calculate the sunlight shadow in different date with given time precision.
 
@@ -148,51 +198,200 @@ def cal_sunshadows(buildings, cityname='somecity', dates=['2022-01-01'], precisi
     include_building : bool
         whether the shadow include building outline
     save_shadows : bool
-        whether to save calculated shadows
+        whether to save calculated shadows. The timesteps already saved in `result/cityname` are skipped
     printlog : bool
         whether to print log
+    n_jobs : int
+        Number of processes to calculate the timesteps. The buildings and walls are sent to each process once.
+        None for the number of CPUs, 1 for calculating in this process.
+    executor : concurrent.futures.Executor
+        Executor to run the timesteps on, overrides `n_jobs`. As its workers are not initialized by this function,
+        the buildings and walls are sent with every batch of timesteps.
+    cache : ShadowCache or str
+        Cache (or directory of the cache) of the shadows. The shadows of the cached sun positions are loaded instead of
+        calculated, and the calculated shadows are saved into the cache.
+    save_format : str
+        Format of the saved shadows. `geojson` for two GeoJSON files per timestep,
+        `parquet` for a GeoParquet dataset in `result/cityname/shadows` partitioned by date and type,
+        which can be read back by `read_sunshadows`.
 
     Return
     ----------
     allshadow : GeoDataFrame
-        All building shadows calculated
+        All building shadows calculated, in the order of the timetable
+    '''
+    allshadow = pd.concat(list(iter_sunshadows(
+        buildings, cityname=cityname, dates=dates, precision=precision, padding=padding,
+        roof=roof, include_building=include_building, save_shadows=save_shadows,
+        printlog=printlog, n_jobs=n_jobs, executor=executor, cache=cache,
+        save_format=save_format)))
+    return allshadow
+
+
+def iter_sunshadows(buildings, cityname='somecity', dates=['2022-01-01'], precision=3600, padding=1800,
+                    roof=True, include_building=True, save_shadows=False, printlog=False,
+                    n_jobs=1, executor=None, cache=None, save_format='geojson'):
+    '''
+    Calculate the sunlight shadow in different date with given time precision, and yield the shadows timestep by timestep.
+    Only a bounded number of timesteps are held in memory, so that the shadows of a long period can be
+    consumed incrementally, e.g. by `cal_shadowcoverage`.
+
+    Parameters
+    --------------------
+    buildings : GeoDataFrame
+        Buildings. coordinate system should be WGS84
+    cityname : string
+        Cityname. If save_shadows, this function will create `result/cityname` folder to save the shadows
+    dates : list
+        List of dates
+    precision : number
+        Time precision(s)
+    padding : number
+        Padding time (second) before and after sunrise and sunset. Should be over 1800s to avoid sun altitude under 0
+    roof : bool
+        whether to calculate roof shadow.
+    include_building : bool
+        whether the shadow include building outline
+    save_shadows : bool
+        whether to save calculated shadows. The timesteps already saved in `result/cityname` are skipped
+    printlog : bool
+        whether to print log
+    n_jobs : int
+        Number of processes to calculate the timesteps. The buildings and walls are sent to each process once.
+        None for the number of CPUs, 1 for calculating in this process.
+    executor : concurrent.futures.Executor
+        Executor to run the timesteps on, overrides `n_jobs`. As its workers are not initialized by this function,
+        the buildings and walls are sent with every batch of timesteps.
+    cache : ShadowCache or str
+        Cache (or directory of the cache) of the shadows. The shadows of the cached sun positions are loaded instead of
+        calculated, and the calculated shadows are saved into the cache.
+    save_format : str
+        Format of the saved shadows. `geojson` for two GeoJSON files per timestep,
+        `parquet` for a GeoParquet dataset in `result/cityname/shadows` partitioned by date and type,
+        which can be read back by `read_sunshadows`.
+
+    Yields
+    ----------
+    shadows : GeoDataFrame
+        Building shadows of one timestep, in the order of the timetable
     '''
     if (padding < 1800):
         raise ValueError(
             'Padding time should be over 1800s to avoid sun altitude under 0')  # pragma: no cover
+    if save_format not in ('geojson', 'parquet'):
+        raise ValueError("save_format should be 'geojson' or 'parquet'")
     # obtain city location
     lon, lat = buildings['geometry'].iloc[0].bounds[:2]
     timetable = get_timetable(lon, lat, dates, precision, padding)
-    import os
     if save_shadows:
         if not os.path.exists('result'):             # pragma: no cover
             os.mkdir('result')                       # pragma: no cover
         if not os.path.exists('result/'+cityname):   # pragma: no cover
             os.mkdir('result/'+cityname)             # pragma: no cover
-    allshadow = []
-    for i in range(len(timetable)):
-        date = timetable['datetime'].iloc[i]
-        name = timetable['date'].iloc[i]
-        if not os.path.exists('result/'+cityname+'/roof_'+name+'.json'):
+        # 已保存的时刻不再计算
+        if save_format == 'parquet':
+            exists = timetable['datetime'].apply(
+                lambda date: sunshadows_saved('result/'+cityname+'/shadows', date))
+        else:
+            exists = timetable['date'].apply(
+                lambda name: os.path.exists('result/'+cityname+'/roof_'+name+'.json'))
+        timetable = timetable[~exists.values]
+
+    # 墙面与太阳位置只计算一次，按批次计算所有时刻的墙面阴影
+    with stage('prepare', len(buildings)):
+        building = _prepare_buildings(buildings)
+        center_lon, center_lat = _buildings_center(building)
+        sunPosition = sun_position(timetable['datetime'].values, center_lon, center_lat)
+        sunPositions = np.c_[sunPosition['azimuth'], sunPosition['altitude']]
+        state = (buildings, building, roof, include_building)
+        batch = max(1, SHADOW_BATCH_SIZE//max(len(building.walls), 1))
+
+    # 缓存中已有的时刻不再计算
+    cached = np.zeros(len(sunPositions), dtype=bool)
+    keys = None
+    if cache is not None:
+        if isinstance(cache, str):
+            cache = ShadowCache(cache)
+        digest = buildings_hash(buildings)
+        keys = [cache.key(digest, sunPosition, roof=roof, include_building=include_building,
+                          projection=utils.PROJECTION_BACKEND) for sunPosition in sunPositions]
+        cached = np.array([key in cache for key in keys], dtype=bool)
+    todo = sunPositions[~cached]
+
+    if executor is None and n_jobs == 1:
+        chunks = (_iter_sunshadow_chunk(todo[start:start+batch], state)
+                  for start in range(0, len(todo), batch))
+        yield from _save_sunshadows(
+            _cached_chunks(chunks, cache, keys, cached, sunPositions, state),
+            timetable, cityname, save_shadows, printlog, save_format)
+    else:
+        # 并行时减小批次，使各进程的任务量均衡
+        workers = (executor is None and n_jobs) or os.cpu_count() or 1
+        batch = max(1, min(batch, PARALLEL_BATCH_SIZE, -(-len(todo)//(4*workers))))
+        starts = range(0, len(todo), batch)
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     initializer=_init_sunshadow_worker,
+                                     initargs=(state,)) as pool:
+                chunks = _ordered_map(pool, _sunshadow_chunk, (
+                    (todo[start:start+batch], None) for start in starts), 2*workers)
+                yield from _save_sunshadows(
+                    _cached_chunks(chunks, cache, keys, cached, sunPositions, state),
+                    timetable, cityname, save_shadows, printlog, save_format)
+        else:
+            chunks = _ordered_map(executor, _sunshadow_chunk, (
+                (todo[start:start+batch], state) for start in starts), 2*workers)
+            yield from _save_sunshadows(
+                _cached_chunks(chunks, cache, keys, cached, sunPositions, state),
+                timetable, cityname, save_shadows, printlog, save_format)
+
+
+def _cached_chunks(chunks, cache, keys, cached, sunPositions, state):
+    # 按时刻表顺序合并缓存中读取的阴影与新计算的阴影，并将新计算的阴影写入缓存
+    if cache is None:
+        return chunks
+
+    def merge():
+        computed = (shadows for chunk in chunks for shadows in chunk)
+        for i, key in enumerate(keys):
+            shadows = cache.get(key) if cached[i] else None
+            if shadows is None:
+                if cached[i]:
+                    # 检查之后被淘汰的缓存重新计算
+                    shadows = next(_iter_sunshadow_chunk(sunPositions[i:i+1], state))
+                else:
+                    shadows = next(computed)
+                cache.put(key, shadows)
+            yield shadows
+    return [merge()]
+
+
+def _save_sunshadows(chunks, timetable, cityname, save_shadows, printlog, save_format):
+    # 按时刻表顺序逐个生成各批次的阴影，并保存
+    i = 0
+    for chunk in chunks:
+        for shadows in chunk:
+            date = timetable['datetime'].iloc[i]
+            name = timetable['date'].iloc[i]
+            i += 1
             if printlog:
                 print('Calculating', cityname, ':', name)    # pragma: no cover
-            # Calculate shadows
-            shadows = bdshadow_sunlight(
-                buildings, date, roof=roof, include_building=include_building)
             shadows['date'] = date
             roof_shaodws = shadows[shadows['type'] == 'roof']
             ground_shaodws = shadows[shadows['type'] == 'ground']
 
             if save_shadows:
-                if len(roof_shaodws) > 0:    # pragma: no cover
-                    roof_shaodws.to_file(    # pragma: no cover
-                        'result/'+cityname+'/roof_'+name+'.json', driver='GeoJSON')  # pragma: no cover
-                if len(ground_shaodws) > 0:  # pragma: no cover
-                    ground_shaodws.to_file(  # pragma: no cover
-                        'result/'+cityname+'/ground_'+name+'.json', driver='GeoJSON')  # pragma: no cover
-            allshadow.append(shadows)
-    allshadow = pd.concat(allshadow)
-    return allshadow
+                with stage('save', len(shadows)):
+                    if save_format == 'parquet':
+                        write_sunshadows(shadows, 'result/'+cityname+'/shadows', date)
+                    else:
+                        if len(roof_shaodws) > 0:    # pragma: no cover
+                            roof_shaodws.to_file(    # pragma: no cover
+                                'result/'+cityname+'/roof_'+name+'.json', driver='GeoJSON')  # pragma: no cover
+                        if len(ground_shaodws) > 0:  # pragma: no cover
+                            ground_shaodws.to_file(  # pragma: no cover
+                                'result/'+cityname+'/ground_'+name+'.json', driver='GeoJSON')  # pragma: no cover
+            yield shadows
 
 
 def cal_shadowcoverage(shadows_input, buildings, grids=gpd.GeoDataFrame(), roof=True, precision=3600, accuracy=1):
@@ -201,8 +400,9 @@ def cal_shadowcoverage(shadows_input, buildings, grids=gpd.GeoDataFrame(), roof=
 
     Parameters
     --------------------
-    shadows_input : GeoDataFrame
-        All building shadows calculated
+    shadows_input : GeoDataFrame or iterable of GeoDataFrame
+        All building shadows calculated, or a stream of shadows such as `iter_sunshadows`.
+        The stream is consumed incrementally, each timestep should appear in only one of the GeoDataFrames.
     buildings : GeoDataFrame
         Buildings. coordinate system should be WGS84
     grids : GeoDataFrame
@@ -220,32 +420,106 @@ def cal_shadowcoverage(shadows_input, buildings, grids=gpd.GeoDataFrame(), roof=
         grids generated by TransBigData in study area, each grids have a `time` column store the shadow coverage time
 
     '''
-    shadows = bd_preprocess(shadows_input)
+    with stage('cal_shadowcoverage', len(buildings)):
+        if isinstance(shadows_input, pd.DataFrame):
+            shadows_input = [shadows_input]
 
-    # study area
-    bounds = buildings.unary_union.bounds
-    if len(grids) == 0:
-        grids, params = tbd.area_to_grid(bounds, accuracy)
+        # study area
+        with stage('grids', len(buildings)):
+            bounds = buildings.unary_union.bounds
+            if len(grids) == 0:
+                grids, params = tbd.area_to_grid(bounds, accuracy)
 
-    if roof:
-        ground_shadows = shadows[shadows['type'] == 'roof'].groupby(['date'])['geometry'].apply(
-            lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
+            if roof:
+                shadow_type = 'roof'
+                buildings.crs = None
+                grids = gpd.sjoin(grids, buildings)
+            else:
+                shadow_type = 'ground'
+                buildings.crs = None
+                grids = gpd.sjoin(grids, buildings, how='left')
+                grids = grids[grids['index_right'].isnull()]
 
-        buildings.crs = None
-        grids = gpd.sjoin(grids, buildings)
-    else:
-        ground_shadows = shadows[shadows['type'] == 'ground'].groupby(['date'])['geometry'].apply(
-            lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
+        # 逐批统计栅格被阴影覆盖的时刻数
+        accumulator = ShadowCoverageAccumulator(grids, precision=precision)
+        for shadows in shadows_input:
+            with stage('accumulate', len(shadows)):
+                accumulator.add(shadows[shadows['type'] == shadow_type])
+        grids = accumulator.result()
 
-        buildings.crs = None
-        grids = gpd.sjoin(grids, buildings, how='left')
-        grids = grids[grids['index_right'].isnull()]
+        return grids
 
-    gridcount = gpd.sjoin(grids[['LONCOL', 'LATCOL', 'geometry']], ground_shadows[['geometry', 'date']]).\
-        drop_duplicates(subset=['LONCOL', 'LATCOL', 'date']).groupby(['LONCOL', 'LATCOL'])['geometry'].\
-        count().rename('count').reset_index()
-    grids = pd.merge(grids, gridcount, how='left')
-    grids['time'] = grids['count'].fillna(0)*precision
 
-    return grids
+class ShadowCoverageAccumulator:
+    '''
+    Count the timesteps each grid is covered by shadow, adding the shadows of one or several timesteps at a time.
+    Memory use only depends on the number of grids.
+
+    Parameters
+    --------------------
+    grids : GeoDataFrame
+        grids generated by TransBigData in study area. Rows with the same `LONCOL` and `LATCOL` are counted as one grid.
+    precision : number
+        time precision(s), which is for calculation of coverage time
 
+    Examples
+    --------------------
+    >>> accumulator = ShadowCoverageAccumulator(grids, precision=3600)
+    >>> for shadows in iter_sunshadows(buildings):
+    ...     accumulator.add(shadows[shadows['type'] == 'ground'])
+    >>> grids = accumulator.result()
+    '''
+
+    def __init__(self, grids, precision=3600):
+        self.grids = grids
+        self.precision = precision
+        # 同一栅格可能对应多行（与建筑关联后），按栅格编号计数
+        if {'LONCOL', 'LATCOL'}.issubset(grids.columns):
+            self._cell, cells = pd.MultiIndex.from_frame(
+                grids[['LONCOL', 'LATCOL']]).factorize()
+            first = pd.Series(np.arange(len(grids))).groupby(self._cell).first().values
+        else:
+            self._cell = np.arange(len(grids))
+            first = self._cell
+        self._tree = shapely.STRtree(np.asarray(grids['geometry'].values)[first])
+        self.counts = np.zeros(len(first), dtype=np.int64)
+
+    def add(self, shadows):
+        '''
+        Add shadows to the counter. A grid is counted once for each `date` of the shadows intersecting it.
+
+        Parameters
+        --------------------
+        shadows : GeoDataFrame
+            Shadows with the `date` column
+        '''
+        if len(shadows) == 0:
+            return self
+        geometry = np.asarray(shadows['geometry'].values)
+        invalid = ~shapely.is_valid(geometry)
+        if invalid.any():
+            geometry = geometry.copy()
+            geometry[invalid] = shapely.buffer(geometry[invalid], 0)
+        shadow_index, cell = self._tree.query(geometry, predicate='intersects')
+        # 同一时刻的多个阴影覆盖同一栅格只计一次
+        date = pd.factorize(shadows['date'])[0][shadow_index]
+        pairs = np.unique(np.c_[date, cell], axis=0)
+        self.counts += np.bincount(pairs[:, 1], minlength=len(self.counts))
+        return self
+
+    def result(self):
+        '''
+        Shadow coverage of the grids added so far.
+
+        Returns
+        --------------------
+        grids : GeoDataFrame
+            grids with the `count` column store the number of timesteps covered by shadow (NaN if never covered),
+            and the `time` column store the shadow coverage time
+        '''
+        grids = self.grids.copy()
+        count = self.counts[self._cell].astype(float)
+        count[count == 0] = np.nan
+        grids['count'] = count
+        grids['time'] = grids['count'].fillna(0)*self.precision
+        return grids
@@ -0,0 +1,143 @@
+"""
+BSD 3-Clause License
+
+Copyright (c) 2022, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+import numpy as np
+import shapely
+import geopandas as gpd
+
+
+class BuildingSet:
+    '''
+    Compact array-backed store of buildings for the shadow pipeline.
+
+    The exterior rings of the footprints are kept as one flat coordinate array with ring offsets,
+    together with the heights and ids, so that the shadow functions can use them without copying GeoDataFrames.
+    The walls are derived from the rings once and shared by all the timesteps.
+
+    Parameters
+    ----------
+    geometry : array-like of Polygon
+        Building footprints. coordinate system should be WGS84
+    height : array-like
+        Height of the buildings(meter).
+    building_id : array-like
+        Id of the buildings.
+    crs : pyproj.CRS
+        Coordinate reference system of the footprints.
+    '''
+
+    def __init__(self, geometry, height, building_id, crs=None):
+        self.geometry = np.asarray(geometry, dtype=object)
+        self.height = np.asarray(height, dtype=float)
+        self.building_id = np.asarray(building_id)
+        self.crs = crs
+        rings = shapely.get_exterior_ring(self.geometry)
+        self.coords, index = shapely.get_coordinates(rings, return_index=True)
+        counts = np.bincount(index, minlength=len(self.geometry))
+        self.ring_offsets = np.r_[0, np.cumsum(counts)]
+
+        # 相邻两个点属于同一个多边形时构成一面墙，记录墙起点在坐标数组中的位置
+        self.wall_start = np.flatnonzero(index[:-1] == index[1:])
+        self.wall_building = index[self.wall_start]
+        # 墙面由外环一次生成，所有时刻共用
+        self._walls = np.stack([self.coords[self.wall_start], self.coords[self.wall_start+1]], axis=1)
+
+    @classmethod
+    def from_geodataframe(cls, buildings, height='height', ground=0):
+        '''
+        Build the set from a GeoDataFrame. The ground height is subtracted and the buildings under the ground are removed.
+
+        Parameters
+        ----------
+        buildings : GeoDataFrame
+            Buildings, should contain the `building_id` column.
+        height : string
+            Column name of building height(meter).
+        ground : number
+            Height of the ground(meter).
+        '''
+        building_height = np.asarray(buildings[height].values, dtype=float)-ground
+        keep = building_height > 0
+        return cls(buildings['geometry'].values[keep], building_height[keep],
+                   buildings['building_id'].values[keep], crs=buildings.crs)
+
+    def __len__(self):
+        return len(self.geometry)
+
+    @property
+    def walls(self):
+        '''
+        The walls of the buildings. shape = [n,2,2], where n is the number of walls, 2 is that each wall has two points, and the last dimension is for x and y.
+        '''
+        return self._walls
+
+    @property
+    def wall_height(self):
+        '''
+        Height of the walls. shape = [n]
+        '''
+        return self.height[self.wall_building]
+
+    @property
+    def wall_building_id(self):
+        '''
+        Id of the building each wall belongs to. shape = [n]
+        '''
+        return self.building_id[self.wall_building]
+
+    def take(self, index):
+        '''
+        Subset of the buildings at the given positions.
+        '''
+        return BuildingSet(self.geometry[index], self.height[index], self.building_id[index], crs=self.crs)
+
+    def above(self, ground):
+        '''
+        Subtract the ground height, and remove the buildings under the ground.
+        '''
+        if ground == 0 and (self.height > 0).all():
+            return self
+        keep = self.height-ground > 0
+        return BuildingSet(self.geometry[keep], self.height[keep]-ground, self.building_id[keep], crs=self.crs)
+
+    def center(self):
+        '''
+        Center (lon, lat) of the buildings, the mean of their bounds.
+        '''
+        lon1, lat1, lon2, lat2 = shapely.bounds(self.geometry).mean(axis=0)
+        return (lon1+lon2)/2, (lat1+lat2)/2
+
+    def to_geodataframe(self, height='height'):
+        '''
+        Convert the set into a GeoDataFrame with `building_id`, height and geometry columns.
+        '''
+        return gpd.GeoDataFrame({'building_id': self.building_id, height: self.height},
+                                geometry=self.geometry, crs=self.crs)
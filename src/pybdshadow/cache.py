@@ -0,0 +1,197 @@
+"""
+BSD 3-Clause License
+
+Copyright (c) 2022, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+import os
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import shapely
+
+# 缓存格式版本，阴影算法改变时递增以使旧缓存失效
+CACHE_VERSION = 1
+
+
+def buildings_hash(buildings, height='height'):
+    '''
+    Hash the geometries, heights and ids of the buildings.
+
+    Parameters
+    ----------
+    buildings : GeoDataFrame
+        Buildings
+    height : string
+        Column name of building height(meter).
+
+    Returns
+    -------
+    digest : str
+        SHA-256 hex digest
+    '''
+    h = hashlib.sha256()
+    h.update(b''.join(shapely.to_wkb(np.asarray(buildings['geometry'].values), hex=False)))
+    h.update(np.ascontiguousarray(buildings[height].values, dtype=float).tobytes())
+    if 'building_id' in buildings:
+        h.update(pd.util.hash_pandas_object(buildings['building_id'], index=False).values.tobytes())
+    return h.hexdigest()
+
+
+class ShadowCache:
+    '''
+    Persistent content-addressed cache of building shadows on disk.
+
+    Each entry is the shadows of one sun position, stored as a GeoParquet file named by the hash of
+    the buildings, the rounded sun position and the parameters, so that a changed input never hits a stale entry.
+    When the total size exceeds `max_size`, the least recently used entries are removed.
+    The total size is tracked in memory, the directory is only scanned when it exceeds `max_size`
+    or every `evict_interval` entries, so that the entries written by other processes are counted.
+    GeoParquet requires `pyarrow`.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cache, created if not exists.
+    max_size : int
+        Maximum total size (bytes) of the cache.
+    decimals : int
+        Number of decimals the sun azimuth and altitude (radians) are rounded to in the key.
+    evict_interval : int
+        Number of entries saved between two scans of the directory.
+    '''
+
+    def __init__(self, path='shadow_cache', max_size=2**30, decimals=9, evict_interval=100):
+        self.path = path
+        self.max_size = max_size
+        self.decimals = decimals
+        self.evict_interval = evict_interval
+        self.hits = 0
+        self.misses = 0
+        # 缓存的总大小（字节），None表示尚未扫描目录
+        self._size = None
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, buildings_digest, sunPosition, **params):
+        '''
+        Key of the shadows of the buildings under the sun position (azimuth, altitude) with given parameters.
+        '''
+        azimuth, altitude = np.round(np.asarray(sunPosition, dtype=float), self.decimals)+0.0
+        params = ','.join(str(k)+'='+str(params[k]) for k in sorted(params))
+        text = '%d|%s|%r|%r|%s' % (CACHE_VERSION, buildings_digest, azimuth, altitude, params)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key+'.parquet')
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def get(self, key):
+        '''
+        Load the shadows of the key, None if not cached.
+        '''
+        import geopandas as gpd
+        file = self._file(key)
+        try:
+            shadows = gpd.read_parquet(file)
+            os.utime(file)
+        except (FileNotFoundError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return shadows
+
+    def put(self, key, shadows):
+        '''
+        Save the shadows of the key, then evict the least recently used entries if the cache is over size.
+        '''
+        file = self._file(key)
+        temp = file+'.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+        shadows.to_parquet(temp)
+        size = os.path.getsize(temp)
+        os.replace(temp, file)
+        # 累加写入的大小，超出上限或每隔evict_interval次写入时才扫描目录
+        with self._lock:
+            self._puts += 1
+            if self._size is not None:
+                self._size += size
+            scan = self._size is None or self._size > self.max_size or \
+                self._puts % self.evict_interval == 0
+        if scan:
+            self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the total size is within `max_size`.
+        '''
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.parquet'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:   # pragma: no cover
+                    continue                # pragma: no cover
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(entry[1] for entry in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:       # pragma: no cover
+                pass                        # pragma: no cover
+            total -= size
+        with self._lock:
+            self._size = total
+
+    def info(self):
+        '''
+        Cache statistics, including the number of hits, misses, entries and the total size (bytes).
+        '''
+        sizes = [entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith('.parquet')]
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(sizes),
+                    'bytes': sum(sizes), 'max_size': self.max_size}
+
+    def clear(self):
+        '''
+        Remove all entries and reset the statistics.
+        '''
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.parquet'):
+                os.remove(entry.path)
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self._size = 0
@@ -0,0 +1,171 @@
+"""
+BSD 3-Clause License
+
+Copyright (c) 2022, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+import threading
+import numpy as np
+import pandas as pd
+from suncalc import get_position, get_times
+
+# 日出日落时间缓存，键为 (日期, 经度, 纬度)
+_SUN_TIMES = {}
+_SUN_TIMES_LOCK = threading.Lock()
+SUN_TIMES_CACHE_SIZE = 65536
+
+
+def to_datetime64(times):
+    '''
+    Convert datetimes into naive UTC datetime64[ns]. Time zone aware datetimes are converted to UTC,
+    naive datetimes are regarded as UTC as in `suncalc`.
+    '''
+    times = pd.to_datetime(times)
+    if isinstance(times, pd.Timestamp):
+        if times.tzinfo is not None:
+            times = times.tz_convert('UTC').tz_localize(None)
+        # pandas 2 以后 Timestamp 的精度不一定是 ns
+        return times.to_datetime64().astype('datetime64[ns]')
+    times = pd.DatetimeIndex(times)
+    if times.tz is not None:
+        times = times.tz_convert('UTC').tz_localize(None)
+    return times.values.astype('datetime64[ns]')
+
+
+def sun_position(times, lon, lat):
+    '''
+    Calculate the sun positions of a datetime or an array of datetimes at once.
+
+    Parameters
+    ----------
+    times : datetime or array-like of datetime
+        Datetimes, naive datetimes are regarded as UTC
+    lon, lat : float
+        Location
+
+    Returns
+    -------
+    position : dict
+        `azimuth` and `altitude` (radians) of the sun, floats for a single datetime, otherwise numpy.ndarray.
+        The azimuth is measured from south, positive to the west.
+    '''
+    times = to_datetime64(times)
+    position = get_position(times, lon, lat)
+    if np.ndim(times) == 0:
+        return {'azimuth': float(position['azimuth']), 'altitude': float(position['altitude'])}
+    return {'azimuth': np.asarray(position['azimuth'], dtype=float),
+            'altitude': np.asarray(position['altitude'], dtype=float)}
+
+
+def sun_times(days, lon, lat):
+    '''
+    Get the sunrise and sunset of the days. The results are memoized per (day, lon, lat),
+    and the days not in the cache are calculated in one vectorized call.
+
+    Parameters
+    ----------
+    days : str or list
+        Day, or list of days, in the form of `YYYY-MM-DD`
+    lon, lat : float
+        Location
+
+    Returns
+    -------
+    sunrise, sunset : numpy.ndarray
+        Unix timestamps (ns) of the sunrise and sunset of each day, int64 arrays
+    '''
+    days = [days] if isinstance(days, str) else list(days)
+    keys = [(day, float(lon), float(lat)) for day in days]
+    with _SUN_TIMES_LOCK:
+        cached = {key: _SUN_TIMES[key] for key in keys if key in _SUN_TIMES}
+    missing = [key for key in dict.fromkeys(keys) if key not in cached]
+    if missing:
+        # 与单日计算相同，取当日 12:45:33.959797119 (UTC) 所在的太阳日
+        date = pd.to_datetime([key[0]+' 12:45:33.959797119' for key in missing]).values
+        times = get_times(date, np.full(len(missing), float(lon)), np.full(len(missing), float(lat)))
+        computed = dict(zip(missing, zip(pd.DatetimeIndex(times['sunrise']).asi8,
+                                         pd.DatetimeIndex(times['sunset']).asi8)))
+        cached.update(computed)
+        with _SUN_TIMES_LOCK:
+            if len(_SUN_TIMES)+len(computed) > SUN_TIMES_CACHE_SIZE:
+                _SUN_TIMES.clear()
+            _SUN_TIMES.update(computed)
+    result = [cached[key] for key in keys]
+    result = np.array(result, dtype=np.int64).reshape((-1, 2))
+    return result[:, 0], result[:, 1]
+
+
+def day_length(days, lon, lat):
+    '''
+    Total hours from sunrise to sunset of the day, or list of days.
+    '''
+    sunrise, sunset = sun_times(days, lon, lat)
+    return float((sunset-sunrise).sum())/(1000000000*3600)
+
+
+def sun_table(lon, lat, dates=['2022-01-01'], precision=3600, padding=1800):
+    '''
+    Tabulate the timesteps from sunrise+padding to sunset-padding of each day with given interval,
+    and the sun positions of them, without looping over the timesteps.
+
+    Parameters
+    ----------
+    lon, lat : float
+        Location
+    dates : list
+        List of days
+    precision : number
+        Time precision(s)
+    padding : number
+        Padding time (second) after sunrise and before sunset
+
+    Returns
+    -------
+    table : DataFrame
+        Timesteps with `datetime`, `azimuth` and `altitude` columns
+    '''
+    sunrise, sunset = sun_times(dates, lon, lat)
+    start = sunrise+int(padding*1000000000)
+    stop = sunset-int(padding*1000000000)
+    step = int(precision*1000000000)
+    n = np.maximum(-(-(stop-start)//step), 0)
+    offset = np.arange(n.sum())-np.repeat(np.cumsum(n)-n, n)
+    datetime = (np.repeat(start, n)+offset*step).astype('datetime64[ns]')
+    table = pd.DataFrame({'datetime': datetime})
+    position = sun_position(datetime, lon, lat)
+    table['azimuth'] = position['azimuth']
+    table['altitude'] = position['altitude']
+    return table
+
+
+def clear_cache():
+    '''
+    Clear the memoized sunrise and sunset.
+    '''
+    with _SUN_TIMES_LOCK:
+        _SUN_TIMES.clear()
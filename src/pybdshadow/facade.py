@@ -1,171 +1,172 @@
 from .utils import (
     lonlat2aeqd,
     aeqd2lonlat_3d,
-    has_normal,
     count_overlapping_features,
-    calculate_normal,
-    make_clockwise
+    make_clockwise,
+    select_projection
 )
 from .analysis import get_timetable
-from .pybdshadow import bdshadow_sunlight
+from .walls import get_wall_array
+from .ephemeris import sun_position, day_length
+from .profiling import stage
+import shapely
 from shapely.geometry import Polygon,  MultiPolygon, MultiPolygon, GeometryCollection
+from shapely.geometry.polygon import orient
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-import suncalc
-from suncalc import get_times
-
-def cal_multiple_wall_overlap_count(walls):
-    def to_3d(result_wall):
-        # 2d转3d
-        # 提取并集或交集的坐标
-        if isinstance(result_wall, Polygon):
-            # 如果结果是单一多边形
-            coords = np.array(result_wall.exterior.coords)
-        elif isinstance(result_wall, MultiPolygon):
-            # 如果结果是多边形集合，合并它们的坐标
-            coords = np.concatenate([np.array(poly.exterior.coords)
-                                    for poly in result_wall.geoms])
-        else:
-            return np.array([])
-        # 计算平面方程中的常数 d
-        d = -np.dot(normal_vector, p1)
-
-        # 根据选择的坐标轴，反推缺失的坐标
-        if coords_plane == (1, 2):  # y和z轴，需要反推x坐标
-            if nx == 0:
-                raise ValueError("平面方程无法解出唯一的x值")  # 无法处理垂直于x轴的平面
-            x = -(ny * coords[:, 0] + nz * coords[:, 1] + d) / nx
-            result = np.c_[x, coords]
-
-        elif coords_plane == (0, 2):  # x和z轴，需要反推y坐标
-            if ny == 0:
-                raise ValueError("平面方程无法解出唯一的y值")
-            y = -(nx * coords[:, 0] + nz * coords[:, 1] + d) / ny
-            result = np.c_[coords[:, 0], y, coords[:, 1]]
-        return Polygon(result)
-
-    walls = list(walls['geometry'].apply(lambda x: list(x.exterior.coords)))
-    p1 = walls[0][0]
-    normal_vector = calculate_normal(walls[0])
-    nx, ny, nz = normal_vector
-
-    # 根据法向量的方向选择坐标轴
-    if abs(nx) > abs(ny):
-        # 法向量主要指向x轴，选择y和z轴
-        coords_plane = (1, 2)
-    else:
-        # 法向量主要指向y轴，选择x和z轴
-        coords_plane = (0, 2)
 
-    gdf = gpd.GeoDataFrame(
-        geometry=[Polygon(np.array(wall)[:, coords_plane]) for wall in walls])
+# 每批检验的光线与建筑对数
+FACADE_RAY_CHUNK_SIZE = 65536
 
-    overlap = count_overlapping_features(gdf, buffer=False)
+# 判断墙面顶点在目标墙面背面的相对误差，乘以坐标大小（米）
+FACADE_BACK_TOLERANCE = 1e-9
 
-    overlap['geometry'] = overlap['geometry'].apply(to_3d)
-    return overlap
 
-def cal_multiple_wall_union(walls):
+def wall_local_frames(walls):
     """
-    计算多个墙（平面）的并集。
+    计算竖直墙面的局部坐标系：原点、墙面内的水平轴u与竖直轴v，以及法向量。
 
-    此函数通过接收一个包含多个墙面顶点的列表来计算它们的并集。每个墙面由至少三个顶点在三维空间中定义。
+    原点为墙面的第一个点，u沿墙面水平方向（指向距原点最远的点），v为z轴，法向量为u与v的叉积，
+    对于 get_walls 生成的墙面即为墙面的外法向量。墙面上的点在局部坐标系中为精确的二维坐标。
+
+    输入:
+    walls : ndarray
+        墙面的坐标，形状为 N*M*3。
+
+    输出:
+    frames : ndarray
+        形状为 N*4*3，依次为原点、u、v与法向量。
+    """
+    walls = np.asarray(walls, dtype=float)
+    origin = walls[:, 0]
+    offset = walls[:, :, 0:2]-origin[:, np.newaxis, 0:2]
+    farthest = np.argmax((offset**2).sum(axis=2), axis=1)
+    direction = offset[np.arange(len(walls)), farthest]
+    frames = np.zeros((len(walls), 4, 3))
+    frames[:, 0] = origin
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frames[:, 1, 0:2] = direction/np.linalg.norm(direction, axis=1)[:, np.newaxis]
+    frames[:, 2, 2] = 1
+    frames[:, 3] = np.cross(frames[:, 1], frames[:, 2])
+    return frames
+
+
+def to_wall_local(points, frame):
+    """
+    将墙面上的三维点转换为墙面局部坐标系中的二维坐标(u, v)。
+    """
+    return (np.asarray(points, dtype=float)-frame[0]) @ frame[1:3].T
+
+
+def from_wall_local(coords, frame):
+    """
+    将墙面局部坐标系中的二维坐标(u, v)转换为三维点。
+    """
+    return frame[0]+np.asarray(coords, dtype=float) @ frame[1:3]
+
+
+def _wall_polygons(geometry, frame):
+    """
+    将墙面局部坐标系中的并集或交集按多边形逐个转换为三维多边形（保留内环）。
+    结果由多个多边形组成时不能合并为一个环。
+    """
+    return [Polygon(from_wall_local(part.exterior.coords, frame),
+                    [from_wall_local(ring.coords, frame) for ring in part.interiors])
+            for part in shapely.get_parts(geometry)
+            if isinstance(part, Polygon) and not part.is_empty]
+
+
+def _local_union(walls, frame):
+    # 墙面上多个多边形在局部坐标系中的并集
+    return shapely.union_all([Polygon(to_wall_local(wall, frame)) for wall in walls])
+
+
+def _local_area(geometry, frames):
+    # 多边形外环在各自墙面局部坐标系中的面积，frames形状为 N*4*3
+    rings = shapely.get_exterior_ring(np.asarray(geometry, dtype=object))
+    coords, index = shapely.get_coordinates(rings, include_z=True, return_index=True)
+    local = np.einsum('nj,nkj->nk', coords-frames[index, 0], frames[index, 1:3])
+    same = index[:-1] == index[1:]
+    cross = local[:-1, 0]*local[1:, 1]-local[1:, 0]*local[:-1, 1]
+    return np.abs(np.bincount(index[:-1][same], weights=cross[same], minlength=len(rings)))/2
+
+
+def cal_multiple_wall_overlap_count(walls, frame=None):
+    """
+    计算同一墙面上多个多边形（墙面与其阴影）的重叠次数。
 
     参数:
-    walls: 一个三维数组，其中每个元素是一个墙面的顶点列表。每个墙面是由三个或更多的三维点（x, y, z）组成的列表。
-    例如 walls = [wall1,wall2] 其中，wall1: 第一个墙的坐标点列表，格式为 [[x1, y1, z1], [x2, y2, z2], ...]，wall2: 第二个墙的坐标点列表，格式为 [[x1, y1, z1], [x2, y2, z2], ...]
+    walls: GeoDataFrame，geometry 为墙面上的三维多边形。
+    frame: 墙面的局部坐标系，见 wall_local_frames。默认使用 `local_frame` 列，没有该列时由第一个多边形计算。
 
     返回:
-    result: 并集的坐标点数组
-
+    overlap: 重叠部分的三维多边形及其重叠次数 `count`，由多个多边形组成的部分拆分为多行
     """
+    if frame is None:
+        if 'local_frame' in walls.columns and walls['local_frame'].notna().any():
+            frame = walls['local_frame'].dropna().iloc[0]
+        else:
+            frame = wall_local_frames([walls['geometry'].iloc[0].exterior.coords])[0]
 
-    walls = np.array(walls)
-    p1, p2, p3 = walls[0][:3]
-    normal_vector = calculate_normal(walls[0])
-    nx, ny, nz = normal_vector
+    gdf = gpd.GeoDataFrame(geometry=[
+        Polygon(to_wall_local(geometry.exterior.coords, frame),
+                [to_wall_local(ring.coords, frame) for ring in geometry.interiors])
+        for geometry in walls['geometry']])
 
-    # 根据法向量的方向选择坐标轴
-    if abs(nx) > abs(ny):
-        # 法向量主要指向x轴，选择y和z轴
-        coords_plane = (1, 2)
-    else:
-        # 法向量主要指向y轴，选择x和z轴
-        coords_plane = (0, 2)
+    overlap = pd.DataFrame(count_overlapping_features(gdf, buffer=False))
 
-    result_wall = MultiPolygon([Polygon(wall)
-                               for wall in walls[:, :, coords_plane]]).buffer(0)
+    overlap['geometry'] = [_wall_polygons(geometry, frame) for geometry in overlap['geometry']]
+    overlap = overlap.explode('geometry').dropna(subset=['geometry'])
+    return gpd.GeoDataFrame(overlap, geometry='geometry')
 
-    # 提取并集或交集的坐标
-    if isinstance(result_wall, Polygon):
-        # 如果结果是单一多边形
-        coords = np.array(result_wall.exterior.coords)
-    elif isinstance(result_wall, MultiPolygon):
-        # 如果结果是多边形集合，合并它们的坐标
-        coords = np.concatenate([np.array(poly.exterior.coords)
-                                for poly in result_wall.geoms])
-    else:
-        return np.array([])
-    # 计算平面方程中的常数 d
-    d = -np.dot(normal_vector, p1)
+def cal_multiple_wall_union(walls, frame=None):
+    """
+    计算多个墙（平面）的并集。
 
-    # 根据选择的坐标轴，反推缺失的坐标
-    if coords_plane == (1, 2):  # y和z轴，需要反推x坐标
-        if nx == 0:
-            raise ValueError("平面方程无法解出唯一的x值")  # 无法处理垂直于x轴的平面
-        x = -(ny * coords[:, 0] + nz * coords[:, 1] + d) / nx
-        result = np.c_[x, coords]
+    此函数通过接收一个包含多个墙面顶点的列表来计算它们的并集。每个墙面由至少三个顶点在三维空间中定义。
+    墙面在局部坐标系中转换为二维多边形计算并集，再转换回三维坐标。
 
-    elif coords_plane == (0, 2):  # x和z轴，需要反推y坐标
-        if ny == 0:
-            raise ValueError("平面方程无法解出唯一的y值")
-        y = -(nx * coords[:, 0] + nz * coords[:, 1] + d) / ny
-        result = np.c_[coords[:, 0], y, coords[:, 1]]
+    参数:
+    walls: 一个三维数组，其中每个元素是一个墙面的顶点列表。每个墙面是由三个或更多的三维点（x, y, z）组成的列表。
+    例如 walls = [wall1,wall2] 其中，wall1: 第一个墙的坐标点列表，格式为 [[x1, y1, z1], [x2, y2, z2], ...]，wall2: 第二个墙的坐标点列表，格式为 [[x1, y1, z1], [x2, y2, z2], ...]
+    frame: 墙面所在平面的局部坐标系，见 wall_local_frames，默认由第一个墙面计算。
 
-    return result
+    返回:
+    result: 并集的三维多边形列表，并集由多个不相连的部分组成时每个部分为一个多边形
 
-def cal_wall_overlap(wall1, wall2, method='intersection'):
+    """
+    if frame is None:
+        frame = wall_local_frames(np.array(walls[:1], dtype=float))[0]
+    return _wall_polygons(_local_union(walls, frame), frame)
+
+def cal_wall_overlap(wall1, wall2, method='intersection', frame=None):
     """
     计算两个墙（平面）的并集或交集。
 
     参数:
     wall1: 第一个墙的坐标点列表，格式为 [[x1, y1, z1], [x2, y2, z2], ...]
     wall2: 第二个墙的坐标点列表，格式为 [[x1, y1, z1], [x2, y2, z2], ...]
-    method: 计算方式，'union' 为并集，'intersection' 为交集，默认为 'union'
+    method: 计算方式，'union' 为并集，'intersection' 为交集，默认为 'intersection'
+    frame: 第一个墙的局部坐标系，见 wall_local_frames，默认由第一个墙计算。
 
     返回:
     result: 并集或交集的坐标点数组，格式与输入格式相同
 
     思路：
-    核心思路是根据两个墙面（平面）的法向量来确定它们主要垂直于哪个坐标轴。然后，选择两个与主轴垂直的坐标轴来表征这些平面。
-    例如，如果一个平面主要垂直于 x 轴，那么我们使用 y 和 z 轴。
-    基于这些坐标轴，使用 Shapely 库创建多边形来代表每个墙面。
-    接下来，计算这两个多边形在xz或yz平面的并集或交集。
-    最后，根据先前选择的坐标轴，使用平面方程反推缺失的坐标值，以获取完整的三维坐标点集。
-    这样就能够处理那些垂直于不同坐标轴的墙面，并计算它们的重叠部分。
+    将两个墙面的顶点转换到第一个墙的局部坐标系（原点、水平轴u与竖直轴v）中，
+    使用 Shapely 库创建二维多边形计算并集或交集，再由局部坐标系转换回三维坐标点。
+    局部坐标系为正交坐标系，转换是精确的，不受墙面朝向的影响。
     """
 
-    # 计算法向量
-    plane = wall1
-    p1, p2, p3 = plane[:3]
-
-    normal_vector = calculate_normal(plane)
-    nx, ny, nz = normal_vector
-
-    # 根据法向量的方向选择坐标轴
-    if abs(nx) > abs(ny):
-        # 法向量主要指向x轴，选择y和z轴
-        coords_plane = (1, 2)
-    else:
-        # 法向量主要指向y轴，选择x和z轴
-        coords_plane = (0, 2)
+    if frame is None:
+        frame = wall_local_frames([wall1])[0]
 
     # 将墙的坐标转换为多边形
-    poly1 = Polygon(np.array(wall1)[:, coords_plane])
+    poly1 = Polygon(to_wall_local(wall1, frame))
     if not poly1.is_valid:
         poly1 = poly1.buffer(0)
-    poly2 = Polygon(np.array(wall2)[:, coords_plane])
+    poly2 = Polygon(to_wall_local(wall2, frame))
     if not poly2.is_valid:
         poly2 = poly2.buffer(0)
 
@@ -197,26 +198,8 @@ def cal_wall_overlap(wall1, wall2, method='intersection'):
     else:
         # 如果没有有效的 Polygon，返回空数组
         return np.array([])
-    # 计算平面方程中的常数 d
-    d = -np.dot(normal_vector, p1)
-
-    # 根据选择的坐标轴，反推缺失的坐标
-    if coords_plane == (1, 2):  # y和z轴，需要反推x坐标
-        if nx == 0:
-            raise ValueError("平面方程无法解出唯一的x值")  # 无法处理垂直于x轴的平面
-        x = -(ny * coords[:, 0] + nz * coords[:, 1] + d) / nx
-        result = np.c_[x, coords]
-
-    elif coords_plane == (0, 2):  # x和z轴，需要反推y坐标
-        if ny == 0:
-            raise ValueError("平面方程无法解出唯一的x值", str(wall1), str(wall2))
-            # raise ValueError("平面方程无法解出唯一的y值")  # 无法处理垂直于y轴的平面
-            return None
 
-        y = -(nx * coords[:, 0] + nz * coords[:, 1] + d) / ny
-        result = np.c_[coords[:, 0], y, coords[:, 1]]
-
-    return result
+    return from_wall_local(coords, frame)
 
 def calculate_wall_normal_vector(wall):
     """
@@ -311,6 +294,70 @@ def projection_on_wall_single(plane, sun_vec, wall, wall_normal):
     return intersections
 
 
+def projection_on_walls(planes, sun_vecs, walls, wall_normals):
+    """
+    批量计算墙面在目标墙面平面上由太阳光照射产生的投影，是 `projection_on_wall_single` 的向量化版本。
+    被投影墙面在目标墙面背面的部分不会遮挡目标墙面，先裁剪掉再投影。
+
+    输入:
+    planes : ndarray
+        目标墙面的平面方程系数[A, B, C, D]，形状为 N*4。
+    sun_vecs : ndarray
+        太阳光的方向向量，形状为 N*3 或 3。
+    walls : ndarray
+        被投影墙面的闭合多边形，形状为 N*k*3。
+    wall_normals : ndarray
+        目标墙面的法向量，形状为 N*3。
+
+    输出:
+    intersections : ndarray
+        N*(k+1)*3大小的矩阵，裁剪后的墙面沿太阳光方向在目标平面上的投影，为闭合多边形，顶点不足时重复第一个点。
+    valid : ndarray
+        长度为N的布尔数组，太阳光与平面平行或墙面全部在目标墙面背面的为False。
+    """
+    planes = np.asarray(planes, dtype=float).reshape((-1, 4))
+    walls = np.asarray(walls, dtype=float)
+    sun_vecs = np.broadcast_to(np.asarray(sun_vecs, dtype=float), (len(walls), 3))
+    wall_normals = np.asarray(wall_normals, dtype=float).reshape((-1, 3))
+    normal = planes[:, :3]
+    denominator = np.matmul(normal[:, np.newaxis, :], sun_vecs[:, :, np.newaxis])[:, 0, 0]
+
+    def project(points):
+        # 点沿太阳光方向与目标平面的交点，以及点在目标墙面前方的距离
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = -(np.matmul(points, normal[:, :, np.newaxis])[:, :, 0]+planes[:, 3:])/denominator[:, np.newaxis]
+            projected = points+t[:, :, np.newaxis]*sun_vecs[:, np.newaxis, :]
+            front = -np.matmul(projected-points, wall_normals[:, :, np.newaxis])[:, :, 0]
+        return projected, front
+
+    # 去掉闭合点，逐条边裁剪
+    ring = walls[:, :-1]
+    vertices = ring.shape[1]
+    projected, front = project(ring)
+    # 与目标墙面共用的顶点投影到自身，按坐标大小留出舍入误差
+    tolerance = FACADE_BACK_TOLERANCE*np.maximum(np.abs(walls).max(axis=(1, 2), initial=0), 1)
+    inside = front >= -tolerance[:, np.newaxis]
+
+    # 每条边依次输出在前方的起点，以及跨越目标平面时与平面的交点
+    next_ring, next_front, next_inside = [np.roll(a, -1, axis=1) for a in (ring, front, inside)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.clip(front/(front-next_front), 0, 1)
+    crossing, _ = project(ring+fraction[:, :, np.newaxis]*(next_ring-ring))
+    candidate = np.stack([projected, crossing], axis=2).reshape((len(walls), 2*vertices, 3))
+    keep = np.stack([inside, inside != next_inside], axis=2).reshape((len(walls), 2*vertices))
+
+    # 保留的点移到前面，凸多边形裁剪后最多 vertices+1 个顶点
+    order = np.argsort(~keep, axis=1, kind='stable')[:, :vertices+1]
+    intersections = np.take_along_axis(candidate, order[:, :, np.newaxis], axis=1)
+    count = keep.sum(axis=1)
+    pad = np.arange(vertices+1) >= count[:, np.newaxis]
+    intersections = np.where(pad[:, :, np.newaxis], intersections[:, :1], intersections)
+    intersections = np.concatenate([intersections, intersections[:, :1]], axis=1)
+
+    valid = (denominator != 0) & inside.any(axis=1)
+    return intersections, valid
+
+
 def is_sunlight_reaching_wall(sun_vec, wall_normal):
     # 计算太阳光向量与墙面法线向量之间的夹角
     angle = np.arccos(np.dot(sun_vec, wall_normal) /
@@ -332,12 +379,12 @@ def sun_light_vector(azimuth, altitude):
     # 太阳光的方向是从太阳指向地球，因此需要反转向量
     return np.array([x, y, -z])
 
-def convert_shadows_to_lonlat(all_shadows_coords, center_lon, center_lat):
+def convert_shadows_to_lonlat(all_shadows_coords, center_lon, center_lat, projection=None):
 
-    a = pd.DataFrame(all_shadows_coords).reset_index()
+    a = pd.DataFrame({0: all_shadows_coords}).reset_index()
 
     b = a[a[0].apply(len) > 0].explode(0).reset_index(drop=True)
-    b[0] = list(aeqd2lonlat_3d(np.array([list(b[0])]), center_lon, center_lat)[0])
+    b[0] = list(aeqd2lonlat_3d(np.array([list(b[0])]), center_lon, center_lat, projection)[0])
 
     c = a[a[0].apply(len) == 0]
 
@@ -350,280 +397,529 @@ def projections_from_wall_to_wall(merged_data):
     walls_target_shadow = merged_data[merged_data['face'] == False]
 
     walls_target_shadow = walls_target_shadow[[
-        'building_id_left', 'target_wall_id', 'target_wall', 'date']]
+        'building_id_left', 'target_wall_id', 'target_wall', 'target_wall_frame', 'date']]
     walls_target_shadow['shadow_projections'] = walls_target_shadow['target_wall']
 
     # walls_date_shadow = pd.concat([walls_date_shadow, walls_target_shadow])
 
     merged_data = merged_data[merged_data['face']]
 
-    def calculate_projection(row):
-
-        return projection_on_wall_single(
-            row['target_wall_plane'],
-            row['sun_vector'],
-            row['shadow_wall'],
-            row['target_wall_vector']
-        )
-
-
-# 应用修改后的函数计算投影
-    merged_data['shadow_projections'] = merged_data.apply(
-        calculate_projection, axis=1)
-    merged_data = merged_data.dropna(subset=['shadow_projections'])
-
-# 或者，如果空的 shadow_projections 以空列表或其他形式存在，您可以这样做：
-    merged_data = merged_data[merged_data['shadow_projections'].apply(
-        lambda x: x is not None and len(x) > 0)]
-
-    condition = merged_data.apply(lambda row:
-                                  (max([point[0] for point in row['target_wall']]) > min([point[0] for point in row['shadow_projections']])) and
-                                  (max([point[2] for point in row['target_wall']]) > min(
-                                      [point[2] for point in row['shadow_projections']])),
-                                  axis=1)
-
-    merged_data = merged_data[condition]
+    # 批量计算投影，舍弃无效的投影
+    if len(merged_data) > 0:
+        target_wall = np.array(merged_data['target_wall'].tolist(), dtype=float)
+        intersections, valid = projection_on_walls(
+            np.array(merged_data['target_wall_plane'].tolist()),
+            np.array(merged_data['sun_vector'].tolist()),
+            np.array(merged_data['shadow_wall'].tolist()),
+            np.array(merged_data['target_wall_vector'].tolist()))
+
+        # 投影需与目标墙面在x与z方向上有重叠
+        with np.errstate(invalid='ignore'):
+            condition = valid & (target_wall[:, :, 0].max(axis=1) > intersections[:, :, 0].min(axis=1)) & \
+                (target_wall[:, :, 2].max(axis=1) > intersections[:, :, 2].min(axis=1))
+        merged_data = merged_data[condition].copy()
+        merged_data['shadow_projections'] = list(intersections[condition])
+    else:
+        merged_data = merged_data.assign(shadow_projections=[])
     merged_data = merged_data[[
-        'building_id_left', 'target_wall', 'target_wall_id', 'date', 'shadow_projections']]
+        'building_id_left', 'target_wall', 'target_wall_frame', 'target_wall_id', 'date', 'shadow_projections']]
 
     merged_data = pd.concat([merged_data, walls_target_shadow])
 
     def aggregate_shadows(group):
-        walls = group['shadow_projections'].tolist()
-        aggregated_shadow = cal_multiple_wall_union(walls)
-    # 返回一个包含所有必要数据的 DataFrame
+        # 目标墙面上所有投影的并集与目标墙面的交集，结果可能由多个多边形组成，每个多边形一行
+        frame = group['target_wall_frame'].iloc[0]
+        target = Polygon(to_wall_local(group['target_wall'].iloc[0], frame))
+        shadow = _local_union(group['shadow_projections'], frame).intersection(target)
         return pd.DataFrame({
-            'building_id_left': [group.name[0]],
-            'target_wall_id': [group.name[1]],
-            'date': [group.name[2]],
-            'aggregated_shadows': [aggregated_shadow],
-            'target_wall': [group['target_wall'].iloc[0]]  # 假设仅返回第一个目标墙
+            'building_id_left': group.name[0],
+            'target_wall_id': group.name[1],
+            'date': group.name[2],
+            'intersection_shadow': _wall_polygons(shadow, frame)
         })
 
-# 应用 aggregate_shadows 函数
-    aggregated_shadows = merged_data.groupby(['building_id_left', 'target_wall_id', 'date']).apply(
+    columns = ['building_id_left', 'target_wall_id', 'date', 'intersection_shadow']
+    if len(merged_data) == 0:
+        return pd.DataFrame(columns=columns)
+    result_gdf = merged_data.groupby(['building_id_left', 'target_wall_id', 'date']).apply(
         aggregate_shadows).reset_index(drop=True)
+    return result_gdf.reindex(columns=columns)
 
 
-# 展开 DataFrame，因为 apply 返回的是 DataFrame 的列表
-    if isinstance(aggregated_shadows.columns, pd.MultiIndex):
-        aggregated_shadows.columns = [
-            '_'.join(col).strip() for col in aggregated_shadows.columns.values]
+def occluder_pairs(walls, wall_normals, sun_vec):
+    """
+    找出可能在目标墙面上投下阴影的(目标墙面, 遮挡墙面)对。
 
-# 计算交集并处理结果
-    def calculate_intersection(row):
-        return cal_wall_overlap(row['target_wall'], row['aggregated_shadows'], method='intersection')
+    墙面上的一点被某面墙遮挡时，该点的水平位置必然位于这面墙在地面上的阴影内。
+    因此只保留朝向太阳的目标墙面，并用空间索引筛选地面阴影与目标墙面底边相交的墙面对。
+    遮挡墙面不按朝向筛选，跨越目标墙面所在平面的墙面只有前方部分投下阴影，见 projection_on_walls。
 
-    aggregated_shadows['intersection_shadow'] = aggregated_shadows.apply(
-        calculate_intersection, axis=1)
-    aggregated_shadows = aggregated_shadows.dropna(
-        subset=['intersection_shadow'])
+    输入:
+    walls : ndarray
+        墙面的坐标（米），形状为 N*5*3，前两个点为墙面底边，第三个点的z坐标为墙面高度。
+    wall_normals : ndarray
+        墙面的外法向量，形状为 N*3。
+    sun_vec : ndarray
+        太阳光的方向向量（从太阳指向地面）。
 
-# 删除不需要的列
-    result_gdf = aggregated_shadows.drop(
-        ['aggregated_shadows', 'target_wall'], axis=1)
+    输出:
+    target : ndarray
+        目标墙面的序号。
+    occluder : ndarray
+        遮挡墙面的序号。
+    face : ndarray
+        长度为N的布尔数组，墙面是否朝向太阳。
+    """
+    face = wall_normals @ sun_vec < 0
+    facing_index = np.flatnonzero(face)
+    if len(facing_index) == 0 or sun_vec[2] >= 0:
+        return np.array([], dtype=int), np.array([], dtype=int), face
 
-    result_gdf = result_gdf.dropna(subset=['intersection_shadow'])
+    # 墙面在地面上的阴影
+    base = walls[:, 0:2, 0:2]
+    offset = walls[:, 2, 2][:, np.newaxis]*(sun_vec[:2]/-sun_vec[2])
+    shadows = shapely.polygons(np.stack(
+        [base[:, 0], base[:, 1], base[:, 1]+offset, base[:, 0]+offset], axis=1))
+    segments = shapely.linestrings(walls[facing_index, 0:2, 0:2])
+    target, occluder = shapely.STRtree(shadows).query(segments, predicate='intersects')
+    # 平面墙面不会遮挡自身
+    keep = facing_index[target] != occluder
+    return facing_index[target[keep]], occluder[keep], face
 
-# 或者，如果空的 shadow_projections 以空列表或其他形式存在，您可以这样做：
-    result_gdf = result_gdf[result_gdf['intersection_shadow'].apply(
-        lambda x: x is not None and len(x) > 0)]
 
-    return result_gdf
+def _facade_center(buildings_gdf):
+    # 建筑外包矩形的中心（经纬度），与 BuildingSet.center 一致
+    lon1, lat1, lon2, lat2 = shapely.bounds(np.asarray(buildings_gdf['geometry'].values, dtype=object)).mean(axis=0)
+    return (lon1+lon2)/2, (lat1+lat2)/2
 
 
-def calculate_buildings_shadow_overlap(buildings_gdf, date, precision=3600, padding=1800):
+def calculate_buildings_shadow_overlap(buildings_gdf, date, precision=3600, padding=1800, projection=None):
 
 
     buildings_gdf['geometry'] = buildings_gdf['geometry'].apply(make_clockwise)
-    original_indices = buildings_gdf.index.copy()
 
     # 确保建筑物数据使用正确的CRS
-    center_lon, center_lat = buildings_gdf.unary_union.centroid.x, buildings_gdf.unary_union.centroid.y
+    center_lon, center_lat = _facade_center(buildings_gdf)
     date_times = get_timetable(center_lon, center_lat, dates=[
                                date], precision=precision, padding=padding)
+    projection = select_projection(np.array(buildings_gdf.total_bounds).reshape((2, 2)),
+                                   center_lon, center_lat, projection)
 
     # 转换建筑物坐标为 AEQD 坐标
 
-    buildings_aeqd_gdf = buildings_gdf.copy()
-    buildings_gdf_overlap = buildings_gdf[[
-        'building_id', 'geometry', 'height']]
-
-    for idx, row in buildings_gdf.iterrows():
-        if isinstance(row.geometry, Polygon):
-            lonlat_coords = np.array(
-                row.geometry.exterior.coords).reshape(1, -1, 2)
-        elif isinstance(row.geometry, MultiPolygon):
-            lonlat_coords = np.concatenate([np.array(poly.exterior.coords).reshape(
-                1, -1, 2) for poly in row.geometry.geoms], axis=1)
-        else:
-            continue
-
-        aeqd_coords = lonlat2aeqd(lonlat_coords, center_lon, center_lat)
-        buildings_aeqd_gdf.at[idx, 'geometry'] = Polygon(
-            np.squeeze(aeqd_coords))
-    buildings_aeqd_gdf_walls = get_walls(buildings_aeqd_gdf)
-    buildings_aeqd_gdf_walls = buildings_aeqd_gdf_walls[[
-        'building_id', 'geometry', 'height', 'wall_id']]
-    walls_shadow = buildings_aeqd_gdf_walls.copy()
-
-    walls_shadow.columns = ['building_id_right',
-                            'shadow_wall', 'height', 'shadow_wall_id']
-
-    walls_target = buildings_aeqd_gdf_walls.copy()
-
-    walls_target.columns = ['building_id_left',
-                            'target_wall', 'height', 'target_wall_id']
-
-    def polygon_to_points(polygon):
-        # 提取 Polygon 对象的外部轮廓坐标
-        return list(polygon.exterior.coords)
+    with stage('walls', len(buildings_gdf)):
+        buildings_aeqd_gdf = buildings_gdf.copy()
+
+        for idx, row in buildings_gdf.iterrows():
+            if isinstance(row.geometry, Polygon):
+                lonlat_coords = np.array(
+                    row.geometry.exterior.coords).reshape(1, -1, 2)
+            elif isinstance(row.geometry, MultiPolygon):
+                lonlat_coords = np.concatenate([np.array(poly.exterior.coords).reshape(
+                    1, -1, 2) for poly in row.geometry.geoms], axis=1)
+            else:
+                continue
+
+            aeqd_coords = lonlat2aeqd(lonlat_coords, center_lon, center_lat, projection)
+            buildings_aeqd_gdf.at[idx, 'geometry'] = Polygon(
+                np.squeeze(aeqd_coords))
+        buildings_aeqd_gdf_walls = get_walls(buildings_aeqd_gdf)
+        local_frames = buildings_aeqd_gdf_walls['local_frame'].values
+        buildings_aeqd_gdf_walls = buildings_aeqd_gdf_walls[[
+            'building_id', 'geometry', 'height', 'wall_id']]
+        walls_shadow = buildings_aeqd_gdf_walls.copy()
+
+        walls_shadow.columns = ['building_id_right',
+                                'shadow_wall', 'height', 'shadow_wall_id']
+
+        walls_target = buildings_aeqd_gdf_walls.copy()
+
+        walls_target.columns = ['building_id_left',
+                                'target_wall', 'height', 'target_wall_id']
+
+        def polygon_to_points(polygon):
+            # 提取 Polygon 对象的外部轮廓坐标
+            return list(polygon.exterior.coords)
+
+        # 应用转换函数
+        walls_target['target_wall'] = walls_target['target_wall'].apply(
+            polygon_to_points)
+
+        walls_shadow['shadow_wall'] = walls_shadow['shadow_wall'].apply(
+            polygon_to_points)
+        walls_target['target_wall_vector'] = walls_target['target_wall'].apply(
+            calculate_wall_normal_vector)
+        walls_target['target_wall_plane'] = walls_target['target_wall'].apply(
+            calculate_wall_plane)
+        walls_target['target_wall_frame'] = local_frames
 
-# 应用转换函数
-    walls_target['target_wall'] = walls_target['target_wall'].apply(
-        polygon_to_points)
+    date_times['date'] = pd.to_datetime(date_times['date'])
+    sun_positions = sun_position(date_times['date'].values, center_lon, center_lat)
+    # 每个时刻的墙面对直接计算为墙面阴影，只保留聚合后的结果
+    wall_shadows = []
 
-    walls_shadow['shadow_wall'] = walls_shadow['shadow_wall'].apply(
-        polygon_to_points)
-    walls_target['target_wall_vector'] = walls_target['target_wall'].apply(
-        calculate_wall_normal_vector)
-    walls_target['target_wall_plane'] = walls_target['target_wall'].apply(
-        calculate_wall_plane)
+    # 墙面坐标与法向量，目标墙面与遮挡墙面为同一组墙面
+    wall_coords = np.array(walls_target['target_wall'].tolist(), dtype=float)
+    wall_normals = np.array(walls_target['target_wall_vector'].tolist(), dtype=float)
+    walls_target = walls_target.drop(columns='height')
+    walls_shadow = walls_shadow[['building_id_right', 'shadow_wall', 'shadow_wall_id']]
 
-    date_times['date'] = pd.to_datetime(date_times['date'])
-    merged_data = pd.DataFrame()
+    for date_time, sun_azimuth, sun_altitude in zip(
+            date_times['date'], sun_positions['azimuth'], sun_positions['altitude']):
 
-    for date_time in date_times['date']:
+        sun_vec = sun_light_vector(sun_azimuth, sun_altitude)
+        with stage('prune', len(wall_coords)):
+            target, occluder, face = occluder_pairs(wall_coords, wall_normals, sun_vec)
+
+        with stage('pairs', len(target)):
+            # 背向太阳的墙面整面处于阴影中，只需一行
+            overlapping = pd.concat([
+                walls_target.iloc[np.flatnonzero(~face)].assign(face=False),
+                pd.concat([walls_target.iloc[target].reset_index(drop=True),
+                           walls_shadow.iloc[occluder].reset_index(drop=True)], axis=1).assign(face=True)
+            ], ignore_index=True)
+            overlapping['sun_vector'] = [sun_vec] * len(overlapping)
+            overlapping['date'] = date_time
+
+        with stage('wall_projection', len(overlapping)):
+            wall_shadows.append(projections_from_wall_to_wall(overlapping))
+
+    final_merged_data = pd.concat(wall_shadows, ignore_index=True)
+
+    with stage('lonlat', len(final_merged_data)):
+        # 阴影多边形（含内环）转换为经纬度
+        final_merged_data['intersection_shadow_polygon'] = shapely.transform(
+            np.asarray(final_merged_data['intersection_shadow'].values, dtype=object),
+            lambda coords: aeqd2lonlat_3d(coords[np.newaxis], center_lon, center_lat, projection)[0],
+            include_z=True)
+    final_merged_data = final_merged_data.rename(
+        columns={'building_id_left': 'building_index'})
+    final_merged_data = final_merged_data.drop(['intersection_shadow'], axis=1)
 
-        sun_position = suncalc.get_position(date_time, center_lon, center_lat)
-        sun_azimuth = sun_position['azimuth']
-        sun_altitude = sun_position['altitude']
+    return final_merged_data
 
-        # 计算所有建筑物的阴影
-        shadows_gdf = bdshadow_sunlight(buildings_gdf, date_time)
-        shadows_gdf.index = original_indices
+def cal_sunshine_facade(buildings_gdf, day, precision=3600, padding=1800, projection=None, accuracy='vector'):
+    """
+    计算建筑墙面的日照时长。
 
-        # 确保阴影数据也使用相同的CRS
-        if shadows_gdf.crs is None:
-            shadows_gdf.set_crs(buildings_gdf.crs, inplace=True)
-        shadows_gdf = shadows_gdf[['building_id', 'geometry']]
+    参数:
+    buildings_gdf: GeoDataFrame，建筑，坐标系为WGS84
+    day: 计算日照的日期
+    precision: 时间精度（秒）
+    padding: 日出后与日落前不计算的时间（秒）
+    projection: 投影方式，`pyproj` 或 `local`，见 `utils.set_projection_backend`
+    accuracy: 为 `vector` 时计算墙面上阴影多边形的重叠次数，
+    为数值时在墙面上按该间距（米）布置采样点计算，见 cal_sunshine_facade_samples
 
-        overlapping = gpd.sjoin(buildings_gdf_overlap,
-                                shadows_gdf, how='left', op='intersects')
+    返回:
+    final_shadows_sunshinetime: 墙面上日照时长相同的多边形及其日照时长 `Hour`，
+    accuracy 为数值时为每个采样点的日照时长
+    """
+    if accuracy != 'vector':
+        return cal_sunshine_facade_samples(buildings_gdf, day, accuracy=accuracy, precision=precision,
+                                           padding=padding, projection=projection)
+
+    with stage('cal_sunshine_facade', len(buildings_gdf)):
+        # 计算阴影重叠情况
+        with stage('shadow_overlap', len(buildings_gdf)):
+            final_shadow = calculate_buildings_shadow_overlap(
+                buildings_gdf, day, precision=precision, padding=padding, projection=projection)
+
+        final_shadow['building_id'] = final_shadow['building_index']
+
+        # 求最大光照时长
+        lon, lat = buildings_gdf['geometry'].iloc[0].bounds[:2]
+        sunlighthour = day_length(day, lon, lat)
+
+        # 从阴影重叠情况计算光照时长
+        final_shadows_oneday = final_shadow.copy()
+        buildings_walls = get_walls(buildings_gdf)
+        buildings_walls = buildings_walls.rename(
+            columns={'wall_id': 'target_wall_id'})
+        buildings_walls = buildings_walls[[
+            'building_id', 'target_wall_id', 'geometry', 'local_frame']]
+        final_shadows_oneday = final_shadows_oneday.rename(
+            columns={'intersection_shadow_polygon': 'geometry'})
+        final_shadows_oneday = pd.concat([final_shadows_oneday, buildings_walls])
+        # 去除在墙面局部坐标系中面积为0的退化多边形
+        frames = buildings_walls.set_index(['building_id', 'target_wall_id'])['local_frame'].reindex(
+            pd.MultiIndex.from_frame(final_shadows_oneday[['building_id', 'target_wall_id']]))
+        area = _local_area(final_shadows_oneday['geometry'].values, np.array(frames.tolist()))
+        final_shadows_oneday = final_shadows_oneday[area > 0]
+        with stage('overlap_count', len(final_shadows_oneday)):
+            final_shadows_sunshinetime = final_shadows_oneday.groupby(
+                ['building_id', 'target_wall_id']).apply(cal_multiple_wall_overlap_count)
+
+        final_shadows_sunshinetime = final_shadows_sunshinetime.reset_index()
+
+        final_shadows_sunshinetime['time'] = (
+            final_shadows_sunshinetime['count']-1)*precision
+        final_shadows_sunshinetime['Hour'] = sunlighthour - \
+            final_shadows_sunshinetime['time']/3600
+        final_shadows_sunshinetime.loc[final_shadows_sunshinetime['Hour']
+                                       <= 0, 'Hour'] = 0
+        return final_shadows_sunshinetime
 
-        sun_vec = sun_light_vector(sun_azimuth, sun_altitude)
-        walls_target['sun_vector'] = [sun_vec] * len(walls_target)
 
-        def have_sun(row):
+def get_walls(buildings_gdf):
+    # 把建筑物的墙面拆分成单独的面
+    walls_shape, building_index, wall_id = get_wall_array(
+        buildings_gdf['geometry'])
+    wall_height = buildings_gdf['height'].values[building_index]
 
-            return is_sunlight_reaching_wall(
-                row['sun_vector'],
-                row['target_wall_vector']
-            )
+    # 墙面四个角点：底部两点与顶部两点
+    wall_coords = np.zeros((len(walls_shape), 4, 3))
+    wall_coords[:, 0:2, 0:2] = walls_shape
+    wall_coords[:, 2:4, 0:2] = walls_shape[:, ::-1]
+    wall_coords[:, 2:4, 2] = wall_height[:, np.newaxis]
 
-        walls_target['face'] = walls_target.apply(have_sun, axis=1)
+    buildings_walls = buildings_gdf.iloc[building_index].copy()
+    buildings_walls['wall_id'] = wall_id
+    buildings_walls['geometry'] = shapely.polygons(wall_coords)
+    # 墙面局部坐标系，墙面上的重叠计算均在其中进行
+    buildings_walls['local_frame'] = list(wall_local_frames(wall_coords))
+    return buildings_walls
 
-        walls_target['date'] = date_time
-        overlapping = pd.merge(
-            overlapping,  walls_target, on='building_id_left')
 
-        overlapping = pd.merge(overlapping, walls_shadow,
-                               on='building_id_right')
+def wall_sample_points(walls, frames, spacing):
+    """
+    在墙面上按规则的u/v格网布置采样点。
 
-        overlapping = overlapping[-((overlapping['building_id_left'] == overlapping['building_id_right']) &
-                                    (overlapping['target_wall_id'] == overlapping['shadow_wall_id']))]
+    每面墙沿水平方向u与竖直方向v等分为间距不超过 spacing 的格子，采样点位于格子中心。
 
-        merged_data = pd.concat([merged_data, overlapping])
-        # walls_target = walls_target.drop(['date','face','sun_vector'],axis=1)
+    输入:
+    walls : ndarray
+        墙面的坐标（米），形状为 N*5*3，前两个点为墙面底边，第三个点的z坐标为墙面高度。
+    frames : ndarray
+        墙面的局部坐标系，形状为 N*4*3，见 wall_local_frames。
+    spacing : number
+        采样点的最大间距（米）。
 
-    final_merged_data = projections_from_wall_to_wall(merged_data)
+    输出:
+    points : ndarray
+        采样点的坐标，形状为 M*3。
+    wall_index : ndarray
+        采样点所在墙面的序号。
+    uv : ndarray
+        采样点在墙面局部坐标系中的坐标，形状为 M*2。
+    area : ndarray
+        采样点代表的墙面面积。
+    """
+    walls = np.asarray(walls, dtype=float)
+    length = np.linalg.norm(walls[:, 1, 0:2]-walls[:, 0, 0:2], axis=1)
+    height = walls[:, 2, 2]
+    n_u = np.maximum(np.ceil(length/spacing), 1).astype(np.int64)
+    n_v = np.maximum(np.ceil(height/spacing), 1).astype(np.int64)
+    # 长度或高度为0的墙面不采样
+    n = np.where((length > 0) & (height > 0), n_u*n_v, 0)
+
+    wall_index = np.repeat(np.arange(len(walls)), n)
+    k = np.arange(n.sum())-np.repeat(np.cumsum(n)-n, n)
+    i, j = np.divmod(k, n_v[wall_index])
+    step_u = length[wall_index]/n_u[wall_index]
+    step_v = height[wall_index]/n_v[wall_index]
+    uv = np.c_[(i+0.5)*step_u, (j+0.5)*step_v]
+    frames = frames[wall_index]
+    points = frames[:, 0]+uv[:, 0:1]*frames[:, 1]+uv[:, 1:2]*frames[:, 2]
+    return points, wall_index, uv, step_u*step_v
+
+
+def footprint_edges(footprints):
+    """
+    提取建筑底面（包括内环）的边，按所属建筑排序。
 
-    final_merged_data['intersection_shadow_lonlat'] = convert_shadows_to_lonlat(
-        final_merged_data['intersection_shadow'].tolist(), center_lon, center_lat)
-    final_merged_data = final_merged_data.dropna(
-        subset=['intersection_shadow_lonlat'])
+    输入:
+    footprints : ndarray
+        建筑底面，shapely Polygon 数组。
 
-    def create_polygon_from_coords(coords):
-        # 仅当坐标列表不为空时创建 Polygon
-        # if coords is not None and len(coords) > 2:
-        return Polygon(coords)
-        # return None
+    输出:
+    edges : ndarray
+        边的坐标，形状为 K*2*2。
+    start : ndarray
+        每个建筑第一条边的序号。
+    count : ndarray
+        每个建筑的边数。
+    """
+    rings, building = shapely.get_parts(shapely.boundary(footprints), return_index=True)
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+    # 相邻两个点属于同一个环时构成一条边
+    same = ring[:-1] == ring[1:]
+    edges = np.stack([coords[:-1][same], coords[1:][same]], axis=1)
+    edge_building = building[ring[:-1][same]]
+    order = np.argsort(edge_building, kind='stable')
+    edges, edge_building = edges[order], edge_building[order]
+    start = np.searchsorted(edge_building, np.arange(len(footprints)))
+    count = np.bincount(edge_building, minlength=len(footprints))
+    return edges, start, count
+
+
+def _segments_intersect(a, b, c, d):
+    # 线段ab与cd是否相交（包括端点接触与共线重叠）
+    def orientation(o, p, q):
+        return (p[:, 0]-o[:, 0])*(q[:, 1]-o[:, 1])-(p[:, 1]-o[:, 1])*(q[:, 0]-o[:, 0])
+    d1, d2 = orientation(c, d, a), orientation(c, d, b)
+    d3, d4 = orientation(a, b, c), orientation(a, b, d)
+    straddle = (np.minimum(d1, d2) <= 0) & (np.maximum(d1, d2) >= 0) & \
+        (np.minimum(d3, d4) <= 0) & (np.maximum(d3, d4) >= 0)
+    # 共线时需要外包矩形重叠
+    collinear = (d1 == 0) & (d2 == 0)
+    overlap = (np.minimum(a, b) <= np.maximum(c, d)).all(axis=1) & \
+        (np.minimum(c, d) <= np.maximum(a, b)).all(axis=1)
+    return straddle & (~collinear | overlap)
+
+
+def ray_prism_occlusion(points, direction, footprints, heights, tree=None, edges=None, mask=None):
+    """
+    判断从采样点射向太阳的光线是否被建筑（由底面拉伸的棱柱）遮挡。
 
-# 将 intersection_shadow 转换为 Polygon 对象
-    final_merged_data['intersection_shadow_polygon'] = final_merged_data['intersection_shadow_lonlat'].apply(
-        create_polygon_from_coords)
-    # final_merged_data['target_wall'] = final_merged_data['target_wall'].apply(create_polygon_from_coords)
-    final_merged_data = final_merged_data.rename(
-        columns={'building_id_left': 'building_index'})
-    # final_merged_data = final_merged_data.dropna(subset=['intersection_shadow_polygon'])
-    # all_shadows_gdf = pd.concat([all_shadows_gdf, final_merged_data])
+    每个建筑只可能遮挡其底面沿背离太阳方向平移 高度/太阳方向z分量 倍水平分量范围内的点，
+    先用采样点的空间索引找出这一范围的外包矩形内的点，再对建筑的三维外包盒做向量化的slab测试，
+    最后检验光线在离开外包盒之前的水平投影是否与建筑底面的边相交，或起点是否位于底面内。
 
-    final_merged_data = final_merged_data.drop(
-        ['intersection_shadow', 'intersection_shadow_lonlat'], axis=1)
+    输入:
+    points : ndarray
+        光线起点（米），形状为 M*3。
+    direction : ndarray
+        指向太阳的单位向量，z分量需大于0。
+    footprints : ndarray
+        建筑底面（米），shapely Polygon 数组。
+    heights : ndarray
+        建筑高度。
+    tree : shapely.STRtree
+        光线起点水平位置的空间索引，默认由 points 建立。多个时刻计算同一组点时可复用。
+    edges : tuple
+        footprint_edges 的结果，默认由 footprints 计算。
+    mask : ndarray
+        长度为M的布尔数组，只计算为True的点，其余点视为未被遮挡。
 
-    return final_merged_data
+    输出:
+    blocked : ndarray
+        长度为M的布尔数组，光线是否被遮挡。
+    """
+    points = np.asarray(points, dtype=float)
+    direction = np.asarray(direction, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    blocked = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(footprints) == 0:
+        return blocked
+    if tree is None:
+        tree = shapely.STRtree(shapely.points(points[:, 0:2]))
+    if edges is None:
+        edges = footprint_edges(footprints)
+    edges, start, count = edges
+
+    # 建筑可能遮挡的范围：底面外包矩形沿背离太阳的方向平移
+    bounds = shapely.bounds(footprints)
+    offset = -(heights/direction[2])[:, np.newaxis]*direction[0:2]
+    low = np.minimum(bounds[:, 0:2], bounds[:, 0:2]+offset)
+    high = np.maximum(bounds[:, 2:4], bounds[:, 2:4]+offset)
+    building, point = tree.query(shapely.box(low[:, 0], low[:, 1], high[:, 0], high[:, 1]))
+    if mask is not None:
+        keep = mask[point]
+        building, point = building[keep], point[keep]
+
+    # 分批检验建筑与光线对
+    for chunk_start in range(0, len(point), FACADE_RAY_CHUNK_SIZE):
+        chunk = slice(chunk_start, chunk_start+FACADE_RAY_CHUNK_SIZE)
+        chunk_point, chunk_building = point[chunk], building[chunk]
+
+        # 三维外包盒的slab测试
+        box_min = np.c_[bounds[chunk_building, 0:2], np.zeros(len(chunk_building))]
+        box_max = np.c_[bounds[chunk_building, 2:4], heights[chunk_building]]
+        origin = points[chunk_point]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t1 = (box_min-origin)/direction
+            t2 = (box_max-origin)/direction
+        # 光线与某一坐标轴平行时为nan或inf，fmax/fmin忽略nan
+        t_near = np.fmax(np.fmax.reduce(np.minimum(t1, t2), axis=1), 0)
+        t_far = np.fmin.reduce(np.maximum(t1, t2), axis=1)
+        hit = t_near <= t_far
+        chunk_point, chunk_building, t_far = chunk_point[hit], chunk_building[hit], t_far[hit]
+
+        # 光线在外包盒内的水平投影与建筑底面相交时被遮挡
+        a = points[chunk_point, 0:2]
+        b = a+t_far[:, np.newaxis]*direction[0:2]
+        inside = shapely.contains_xy(footprints[chunk_building], a[:, 0], a[:, 1])
+        n = count[chunk_building]
+        pair = np.repeat(np.arange(len(chunk_point)), n)
+        edge = np.arange(n.sum())-np.repeat(np.cumsum(n)-n, n)+np.repeat(start[chunk_building], n)
+        crossing = _segments_intersect(a[pair], b[pair], edges[edge, 0], edges[edge, 1])
+        inside[pair[crossing]] = True
+        blocked[chunk_point[inside]] = True
+    return blocked
+
+
+def cal_sunshine_facade_samples(buildings_gdf, day, accuracy=1, precision=3600, padding=1800, projection=None):
+    """
+    在墙面的采样点上计算日照时长。
 
-def cal_sunshine_facade(buildings_gdf, day, precision=3600, padding=1800):
-
-    # 计算阴影重叠情况
-    final_shadow = calculate_buildings_shadow_overlap(
-        buildings_gdf, day, precision=precision, padding=padding)
-
-    final_shadow['building_id'] = final_shadow['building_index']
-
-    # 求最大光照时长
-    lon, lat = buildings_gdf['geometry'].iloc[0].bounds[:2]
-    date = pd.to_datetime(day+' 12:45:33.959797119')
-    times = get_times(date, lon, lat)
-    date_sunrise = times['sunrise']
-    data_sunset = times['sunset']
-    timestamp_sunrise = pd.Series(date_sunrise).astype('int')
-    timestamp_sunset = pd.Series(data_sunset).astype('int')
-    sunlighthour = (
-        timestamp_sunset.iloc[0]-timestamp_sunrise.iloc[0])/(1000000000*3600)
-
-    # 从阴影重叠情况计算光照时长
-    final_shadows_oneday = final_shadow.copy()
-    buildings_walls = get_walls(buildings_gdf)
-    buildings_walls = buildings_walls.rename(
-        columns={'wall_id': 'target_wall_id'})
-    buildings_walls = buildings_walls[[
-        'building_id', 'target_wall_id', 'geometry']]
-    final_shadows_oneday = final_shadows_oneday.rename(
-        columns={'intersection_shadow_polygon': 'geometry'})
-    final_shadows_oneday = pd.concat([final_shadows_oneday, buildings_walls])
-    final_shadows_oneday = final_shadows_oneday[final_shadows_oneday['geometry'].apply(
-        lambda x: has_normal(x.exterior.coords))]
-    final_shadows_sunshinetime = final_shadows_oneday.groupby(
-        ['building_id', 'target_wall_id']).apply(cal_multiple_wall_overlap_count)
-
-    final_shadows_sunshinetime = final_shadows_sunshinetime.reset_index()
-
-    final_shadows_sunshinetime['time'] = (
-        final_shadows_sunshinetime['count']-1)*precision
-    final_shadows_sunshinetime['Hour'] = sunlighthour - \
-        final_shadows_sunshinetime['time']/3600
-    final_shadows_sunshinetime.loc[final_shadows_sunshinetime['Hour']
-                                   <= 0, 'Hour'] = 0
-    return final_shadows_sunshinetime
+    每面墙按间距 accuracy 布置采样点，每个时刻从朝向太阳的采样点向太阳发射光线，
+    与建筑棱柱求交判断是否被遮挡。计算量与采样点数和时刻数成正比。
 
+    参数:
+    buildings_gdf: GeoDataFrame，建筑，坐标系为WGS84
+    day: 计算日照的日期
+    accuracy: 采样点的最大间距（米）
+    precision: 时间精度（秒）
+    padding: 日出后与日落前不计算的时间（秒）
+    projection: 投影方式，`pyproj` 或 `local`，见 `utils.set_projection_backend`
 
-def get_walls(buildings_gdf):
-    # 把建筑物的墙面拆分成单独的面
-    def get_wall(r):
-        wall_coords = list(r['geometry'].exterior.coords)
-        walls = []
-        for i in range(len(wall_coords)-1):
-            walls.append([Polygon([list(wall_coords[i])+[0],
-                                   list(wall_coords[i+1])+[0],
-                                   list(wall_coords[i+1])+[r['height']],
-                                   list(wall_coords[i])+[r['height']],
-                                   ]), i])
-        return walls
-    buildings_gdf['walls'] = buildings_gdf.apply(get_wall, axis=1)
-
-    buildings_walls = buildings_gdf.explode('walls')
-    buildings_walls['wall_id'] = buildings_walls['walls'].apply(lambda x: x[1])
-    buildings_walls['geometry'] = buildings_walls['walls'].apply(
-        lambda x: x[0])
-    return buildings_walls.drop('walls', axis=1)
+    返回:
+    samples: GeoDataFrame，每个采样点一行，包括 `building_id`、`target_wall_id`、
+    墙面局部坐标 `u`、`v`（米）、代表的墙面面积 `sample_area`、阴影时长 `time`（秒）与日照时长 `Hour`，
+    geometry 为带高度的点
+    """
+    with stage('cal_sunshine_facade', len(buildings_gdf)):
+        center_lon, center_lat = _facade_center(buildings_gdf)
+        date_times = get_timetable(center_lon, center_lat, dates=[day], precision=precision, padding=padding)
+        sun_positions = sun_position(pd.to_datetime(date_times['date']).values, center_lon, center_lat)
+        lon, lat = buildings_gdf['geometry'].iloc[0].bounds[:2]
+        sunlighthour = day_length(day, lon, lat)
+
+        with stage('samples', len(buildings_gdf)):
+            # 建筑底面转换为 AEQD 坐标
+            # 外环逆时针、内环顺时针，保留内院用于遮挡计算
+            geometry = np.array([orient(polygon) for polygon in buildings_gdf['geometry'].values], dtype=object)
+            coords = shapely.get_coordinates(geometry)
+            projection = select_projection(coords, center_lon, center_lat, projection)
+            coords = lonlat2aeqd(coords.reshape((-1, 1, 2)), center_lon, center_lat, projection).reshape((-1, 2))
+            footprints = shapely.set_coordinates(geometry.copy(), coords)
+            heights = buildings_gdf['height'].values.astype(float)
+
+            buildings_aeqd = gpd.GeoDataFrame({'building_id': buildings_gdf['building_id'].values,
+                                               'height': heights}, geometry=footprints)
+            walls = get_walls(buildings_aeqd)
+            wall_coords = shapely.get_coordinates(walls['geometry'].values, include_z=True).reshape((-1, 5, 3))
+            frames = np.array(walls['local_frame'].tolist())
+            points, wall_index, uv, area = wall_sample_points(wall_coords, frames, accuracy)
+            normals = frames[wall_index, 3]
+            # 采样点沿法向量向外偏移，避免光线与所在墙面相交
+            origins = points+normals*1e-6
+
+            tree = shapely.STRtree(shapely.points(origins[:, 0:2]))
+            edges = footprint_edges(footprints)
+
+        shaded = np.zeros(len(points), dtype=np.int64)
+        for sun_azimuth, sun_altitude in zip(sun_positions['azimuth'], sun_positions['altitude']):
+            with stage('rays', len(points)):
+                # 指向太阳的方向
+                direction = -sun_light_vector(sun_azimuth, sun_altitude)
+                lit = normals @ direction > 0
+                if direction[2] > 0:
+                    lit &= ~ray_prism_occlusion(origins, direction, footprints, heights, tree, edges, mask=lit)
+                shaded += ~lit
+
+        with stage('lonlat', len(points)):
+            lonlat = aeqd2lonlat_3d(points[np.newaxis], center_lon, center_lat, projection)[0]
+
+        samples = gpd.GeoDataFrame({
+            'building_id': walls['building_id'].values[wall_index],
+            'target_wall_id': walls['wall_id'].values[wall_index],
+            'u': uv[:, 0],
+            'v': uv[:, 1],
+            'sample_area': area,
+            'time': shaded*precision},
+            geometry=shapely.points(lonlat), crs=buildings_gdf.crs)
+        samples['Hour'] = sunlighthour-samples['time']/3600
+        samples.loc[samples['Hour'] <= 0, 'Hour'] = 0
+        return samples
@@ -0,0 +1,322 @@
+"""
+BSD 3-Clause License
+
+Copyright (c) 2022, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+from .utils import lonlat2aeqd, select_projection
+from .ephemeris import sun_position, sun_times
+from .raster import raster_params, rasterize_polygons, raster_to_grids
+
+# 每批计算的（点, 墙）组合数以及（点, 墙, 方位角）组合数
+HORIZON_CHUNK_SIZE = 2**20
+
+
+def cal_horizon(points, walls, wall_height, point_height=0, azimuth_bins=720, max_distance=np.inf, bins=None,
+                tree=None):
+    '''
+    Calculate the horizon of the points, i.e. the elevation angle of the highest obstruction in each azimuth.
+    For each point, only the walls higher than the point and within `max_distance` are considered,
+    the elevation angle of a wall in an azimuth is given by the distance to the wall along the ray.
+    The points are processed in chunks of about `HORIZON_CHUNK_SIZE` (point, wall) pairs,
+    so that the memory is bounded however many walls are within `max_distance`.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Projected coordinates (meter) of the points. shape = [m,2]
+    walls : numpy.ndarray
+        Projected coordinates (meter) of the walls. shape = [n,2,2]
+    wall_height : numpy.ndarray
+        Height of the walls, shape = [n]
+    point_height : number or numpy.ndarray
+        Height of the points, shape = [m]
+    azimuth_bins : int
+        Number of azimuth bins. The bin k is centered at the azimuth -pi+(k+0.5)*2*pi/azimuth_bins
+        (radians, in the convention of suncalc: measured from south, positive to the west)
+    max_distance : number
+        Walls farther than this distance (meter) from a point are ignored
+    bins : array-like
+        Indices of the azimuth bins to calculate, e.g. the bins the sun passes through. The other bins are left 0.
+        All the bins if None
+    tree : shapely.STRtree
+        Spatial index of the walls as linestrings, built if None
+
+    Returns
+    -------
+    horizon : numpy.ndarray
+        Elevation angles (radians) of the horizon, 0 for no obstruction. shape = [m, azimuth_bins]
+    '''
+    points = np.asarray(points, dtype=float).reshape((-1, 2))
+    walls = np.asarray(walls, dtype=float).reshape((-1, 2, 2))
+    wall_height = np.asarray(wall_height, dtype=float)
+    point_height = np.broadcast_to(np.asarray(point_height, dtype=float), (len(points),))
+    horizon = np.zeros((len(points), azimuth_bins))
+    selected = np.zeros(azimuth_bins, dtype=bool)
+    selected[np.arange(azimuth_bins) if bins is None else np.asarray(bins, dtype=np.int64)] = True
+    if len(walls) == 0:
+        return horizon
+    if tree is None:
+        tree = shapely.STRtree(shapely.linestrings(walls))
+
+    # 第一批按每个点都与所有墙相邻估计点数，之后按已计算的每点平均组合数调整
+    chunk_size = max(HORIZON_CHUNK_SIZE//len(walls), 1)
+    start = 0
+    while start < len(points):
+        chunk = slice(start, start+chunk_size)
+        point, wall = tree.query(shapely.points(points[chunk]),
+                                 predicate='dwithin', distance=max_distance)
+        n_points = len(points[chunk])
+        start += n_points
+        chunk_size = min(max(int(HORIZON_CHUNK_SIZE*n_points/max(len(point), 1)), 1), 2*chunk_size)
+
+        dz = wall_height[wall]-point_height[chunk][point]
+        point, wall, dz = point[dz > 0], wall[dz > 0], dz[dz > 0]
+
+        # 以点为原点，墙两端的方位角（太阳在该方向时光线沿 -(sin, cos) 方向传播）
+        a = walls[wall, 0]-points[chunk][point]
+        b = walls[wall, 1]-points[chunk][point]
+        azimuth_a = np.arctan2(-a[:, 0], -a[:, 1])
+        span = np.angle(np.exp(1j*(np.arctan2(-b[:, 0], -b[:, 1])-azimuth_a)))
+        lo = np.minimum(azimuth_a, azimuth_a+span)
+        hi = np.maximum(azimuth_a, azimuth_a+span)
+
+        # 墙所张开的方位角范围内的方位角分区
+        k_start = np.ceil((lo+np.pi)/(2*np.pi)*azimuth_bins-0.5).astype(np.int64)
+        k_end = np.floor((hi+np.pi)/(2*np.pi)*azimuth_bins-0.5).astype(np.int64)
+        n = np.maximum(k_end-k_start+1, 0)
+
+        # 按（点, 墙, 方位角）组合数分批展开
+        offsets = np.r_[0, np.cumsum(n)]
+        first = 0
+        while first < len(n):
+            last = max(np.searchsorted(offsets, offsets[first]+HORIZON_CHUNK_SIZE, side='right')-1, first+1)
+            batch = np.arange(first, last)
+            first = last
+            count = n[batch]
+            pair = np.repeat(batch, count)
+            k = k_start[pair]+np.arange(len(pair))-np.repeat(offsets[batch]-offsets[batch[0]], count)
+            keep = selected[k % azimuth_bins]
+            pair, k = pair[keep], k[keep]
+            azimuth = -np.pi+(k+0.5)*2*np.pi/azimuth_bins
+
+            # 沿方位角射线到墙的距离
+            d = b[pair]-a[pair]
+            direction = np.c_[-np.sin(azimuth), -np.cos(azimuth)]
+            distance = (a[pair, 0]*d[:, 1]-a[pair, 1]*d[:, 0]) / \
+                (direction[:, 0]*d[:, 1]-direction[:, 1]*d[:, 0])
+            angle = np.arctan2(dz[pair], np.maximum(distance, 0))
+            np.maximum.at(horizon[chunk], (point[pair], k % azimuth_bins), angle)
+    return horizon
+
+
+def sun_samples(lon, lat, days=['2022-01-01'], precision=60, padding=1800):
+    '''
+    Sample the sun positions between sunrise and sunset of the days.
+    The time between sunrise+padding and sunset-padding of each day is divided into equal steps not longer than
+    `precision`, and the sun position is sampled at the middle of each step.
+
+    Parameters
+    ----------
+    lon, lat : float
+        Location
+    days : list
+        List of days
+    precision : number
+        Maximum time step (s)
+    padding : number
+        padding time before and after sunrise and sunset, not sampled
+
+    Returns
+    -------
+    samples : DataFrame
+        Sun positions with `datetime`, `azimuth`, `altitude` (radians) and `weight` (duration of the step in hours) columns
+    daylength : float
+        Total hours from sunrise to sunset of the days
+    '''
+    sunrise, sunset = sun_times(days, lon, lat)
+    daylength = float((sunset-sunrise).sum())/(1000000000*3600)
+    duration = (sunset-sunrise)/1000000000-2*padding
+    n = np.maximum(np.ceil(duration/precision), 0).astype(np.int64)
+    step = np.where(n > 0, duration/np.maximum(n, 1), 0)
+    offset = np.arange(n.sum())-np.repeat(np.cumsum(n)-n, n)
+    day_start = np.repeat(sunrise, n)
+    second = padding+(offset+0.5)*np.repeat(step, n)
+    samples = pd.DataFrame({
+        'datetime': (day_start+np.round(second*1000000000).astype(np.int64)).astype('datetime64[ns]'),
+        'weight': np.repeat(step, n)/3600})
+    position = sun_position(samples['datetime'].values, lon, lat)
+    samples['azimuth'] = position['azimuth']
+    samples['altitude'] = position['altitude']
+    return samples, daylength
+
+
+def _azimuth_bin(azimuth, azimuth_bins):
+    # 方位角所在的分区
+    return np.floor((np.asarray(azimuth)+np.pi)/(2*np.pi)*azimuth_bins).astype(np.int64) % azimuth_bins
+
+
+def integrate_horizon(horizon, samples):
+    '''
+    Sum the sunlit time of the points over the sun samples. The sun is visible from a point when its altitude is
+    above the horizon in its azimuth bin. The samples are sorted by altitude within each bin once,
+    so the cost is independent of the number of samples.
+
+    Parameters
+    ----------
+    horizon : numpy.ndarray
+        Horizon of the points calculated by `cal_horizon`. shape = [m, azimuth_bins]
+    samples : DataFrame
+        Sun positions with `azimuth`, `altitude` and `weight` columns, see `sun_samples`
+
+    Returns
+    -------
+    sunlit : numpy.ndarray
+        Sum of the weights of the samples where the sun is visible. shape = [m]
+    '''
+    azimuth_bins = horizon.shape[1]
+    k = _azimuth_bin(samples['azimuth'].values, azimuth_bins)
+    # 高度角限制在 [0, pi/2]，按 分区*4+高度角 排序即可在各分区内按高度角排序。
+    # 地平线以下的太阳与高度角为0的太阳一样不可见
+    altitude = np.clip(samples['altitude'].values, 0, np.pi/2)
+    key = k*4+altitude
+    order = np.argsort(key)
+    key = key[order]
+    weight = np.r_[0, np.cumsum(samples['weight'].values[order])]
+    bins = np.unique(k)
+    end = weight[np.searchsorted(key, bins*4+4)]
+    sunlit = np.zeros(len(horizon))
+    chunk_size = max(HORIZON_CHUNK_SIZE//max(len(bins), 1), 1)
+    for start in range(0, len(horizon), chunk_size):
+        chunk = slice(start, start+chunk_size)
+        position = np.searchsorted(key, bins*4+horizon[chunk][:, bins], side='right')
+        sunlit[chunk] = (end-weight[position]).sum(axis=1)
+    return sunlit
+
+
+def cal_sunshine_horizon(buildings, day='2022-01-01', roof=False, accuracy=1, precision=60, padding=1800,
+                         azimuth_bins=720, min_altitude=np.radians(5), as_grids=False, projection=None):
+    '''
+    Calculate the sunshine time on a raster from the horizon of each cell.
+    Instead of generating the shadows of every timestep, the horizon (elevation angle of the obstructions in each
+    azimuth) of each cell center is calculated once from the surrounding walls, then the sun path is sampled densely
+    and compared with the horizon. The cost of a long period is therefore one obstruction pass per cell.
+
+    Parameters
+    ----------
+    buildings : GeoDataFrame
+        Buildings. coordinate system should be WGS84
+    day : str or list
+        the day, or list of days to calculate the sunshine. The sunshine time is summed over the days
+    roof : bool
+        If true calculate the sunshine on the roofs, false then on the ground
+    accuracy : number
+        size of raster cells (meter)
+    precision : number
+        time precision(s) of the sun path sampling
+    padding : number
+        padding time before and after sunrise and sunset, regarded as sunlit as in `cal_sunshine`
+    azimuth_bins : int
+        Number of azimuth bins of the horizon
+    min_altitude : number
+        Lower bound (radians) of the sun altitude used to limit the search distance of the walls.
+        Walls farther than `wall height/tan(min_altitude)` are ignored, so that they only obstruct the sun
+        when it is lower than `min_altitude`
+    as_grids : bool
+        whether to convert the result into grids of TransBigData
+    projection : str
+        Projection backend, `pyproj` or `local`, see `utils.set_projection_backend`.
+
+    Returns
+    -------
+    sunshine : numpy.ndarray
+        Sunshine hours of each cell, NaN for the cells not analysed (outside the roofs if roof is True,
+        inside the buildings otherwise). Only returned if as_grids is False
+    transform : tuple
+        Affine transform (a, b, c, d, e, f) of the raster. Only returned if as_grids is False
+    grids : GeoDataFrame
+        grids with `time` (shadow time, s) and `Hour` columns. Only returned if as_grids is True
+    '''
+    from .pybdshadow import _prepare_buildings, _buildings_center
+    days = [day] if isinstance(day, str) else list(day)
+    building = _prepare_buildings(buildings)
+    center_lon, center_lat = _buildings_center(building)
+
+    # 太阳路径，与 cal_sunshine 相同，日出日落前后 padding 时间内视为有日照
+    samples, daylength = sun_samples(center_lon, center_lat, days, precision, padding)
+    sunlighthour = daylength-samples['weight'].sum()
+
+    shape, transform, params = raster_params(
+        shapely.total_bounds(np.asarray(buildings['geometry'].values)), accuracy)
+    inside = rasterize_polygons(buildings['geometry'], shape, transform)
+    mask = inside if roof else ~inside
+    row, col = np.nonzero(mask)
+    a, _, c, _, e, f = transform
+    points = np.c_[c+(col+0.5)*a, f+(row+0.5)*e]
+
+    # 点的高度为所在建筑中最高者的高度
+    point_height = np.zeros(len(points))
+    if roof:
+        point, index = shapely.STRtree(building.geometry).query(
+            shapely.points(points), predicate='intersects')
+        np.maximum.at(point_height, point, building.height[index])
+
+    walls = building.walls
+    wall_height = building.wall_height
+    lonlat = np.r_[walls.reshape((-1, 2)), points]
+    projection = select_projection(lonlat, center_lon, center_lat, projection)
+    lonlat = lonlat2aeqd(lonlat.reshape((-1, 1, 2)), center_lon, center_lat, projection).reshape((-1, 2))
+
+    # 只有仰角高于最低太阳高度角的墙才会遮挡，太阳高度角很低时搜索距离过大，以 min_altitude 为下限
+    altitude = samples['altitude'][samples['altitude'] > 0]
+    max_distance = wall_height.max()/np.tan(max(altitude.min(), min_altitude)) if len(altitude) > 0 else 0
+    # 只计算太阳经过的方位角分区
+    bins = np.unique(_azimuth_bin(samples['azimuth'].values, azimuth_bins))
+    points = lonlat[len(walls)*2:]
+    walls = lonlat[:len(walls)*2].reshape((-1, 2, 2))
+    tree = shapely.STRtree(shapely.linestrings(walls))
+    # 分批计算地平线并积分，不保存所有点的地平线
+    hours = np.full(len(points), sunlighthour)
+    chunk_size = max(HORIZON_CHUNK_SIZE//len(bins), 1) if len(bins) > 0 else max(len(points), 1)
+    for start in range(0, len(points), chunk_size):
+        chunk = slice(start, start+chunk_size)
+        horizon = cal_horizon(points[chunk], walls, wall_height, point_height[chunk], azimuth_bins,
+                              max_distance, bins, tree)
+        hours[chunk] += integrate_horizon(horizon, samples)
+
+    if as_grids:
+        grids = raster_to_grids(np.zeros(shape), params, name='Hour', mask=mask)
+        grids['Hour'] = hours
+        grids['time'] = (daylength-hours)*3600
+        return grids[['LONCOL', 'LATCOL', 'time', 'Hour', 'geometry']]
+    sunshine = np.full(shape, np.nan)
+    sunshine[row, col] = hours
+    return sunshine, transform
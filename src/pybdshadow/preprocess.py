@@ -32,7 +32,7 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import shapely
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import  MultiPolygon
+from .utils import union_by_group
 
 def bd_preprocess(buildings, height=''):
     '''
@@ -87,13 +87,11 @@ def gdf_difference(gdf_a,gdf_b,col = 'building_id'):
     difference gdf_b from gdf_a
     '''
     gdfa = gdf_a.copy()
-    gdfb = gdf_b.copy()
-    gdfb = gdfb[['geometry']]
+    gdfb = gdf_b[['geometry']]
     #判断重叠
 
     gdfa.crs = gdfb.crs
-    gdfb = gpd.sjoin(gdfb,gdfa).groupby([col])['geometry'].apply(
-            lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
+    gdfb = union_by_group(gpd.sjoin(gdfb,gdfa), [col])
     #分割有重叠和无重叠的
     gdfb['tmp'] = 1
     gdfa_1 = pd.merge(gdfa,gdfb[[col,'tmp']],how = 'left')
@@ -114,12 +112,10 @@ def gdf_intersect(gdf_a,gdf_b,col = 'building_id'):
     intersect gdf_b from gdf_a
     '''
     gdfa = gdf_a.copy()
-    gdfb = gdf_b.copy()
-    gdfb = gdfb[['geometry']]
+    gdfb = gdf_b[['geometry']]
     #判断重叠
     gdfa.crs = gdfb.crs
-    gdfb = gpd.sjoin(gdfb,gdfa).groupby([col])['geometry'].apply(
-            lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
+    gdfb = union_by_group(gpd.sjoin(gdfb,gdfa), [col])
     #分割有重叠和无重叠的
     gdfb['tmp'] = 1
     gdfa_1 = pd.merge(gdfa,gdfb[[col,'tmp']],how = 'left')
@@ -0,0 +1,223 @@
+"""
+BSD 3-Clause License
+
+Copyright (c) 2022, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+import pandas as pd
+
+# 当前启用的 StageProfiler，未启用时为 None
+_PROFILER = None
+_NULL_STAGE = nullcontext()
+
+
+def stage(name, count=None):
+    '''
+    Context manager recording a named stage of the pipeline into the active `StageProfiler`.
+    Returns a shared no-op context when no profiler is active.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage. Stages entered inside it are recorded as `name/child`.
+    count : int
+        Number of items (buildings, walls, timesteps...) processed in the stage.
+    '''
+    if _PROFILER is None:
+        return _NULL_STAGE
+    return _PROFILER._stage(name, count)
+
+
+class _Stage:
+    def __init__(self, profiler, name, count):
+        self.profiler = profiler
+        self.name = name
+        self.count = count
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._exit(self)
+        return False
+
+
+class StageProfiler:
+    '''
+    Record the wall-clock time, item counts and peak memory of the named stages of the shadow pipelines
+    (`bdshadow_sunlight`, `bdshadow_pointlight`, `iter_sunshadows`, `cal_sunshine`, `cal_sunshine_facade`...).
+
+    Use it as a context manager, the stages run inside are recorded. Nested stages are named by their path,
+    e.g. `bdshadow_sunlight/roof/occluders` or `cal_sunshine_facade/shadow_overlap/walls`.
+    Stages run in worker processes (`n_jobs` other than 1) are not recorded.
+
+    Parameters
+    ----------
+    memory : bool
+        Whether to record the peak memory of each stage with `tracemalloc`, which slows down the pipeline.
+        Only allocations traced by Python (numpy, pandas and the shapely arrays, not GEOS internals) are counted.
+        On Python 3.8, which lacks `tracemalloc.reset_peak`, the peak of a stage is an upper bound
+        that includes the peak reached before the stage.
+    callback : callable
+        Called with the record (dict) of each stage when it exits.
+
+    Examples
+    --------
+    >>> with pybdshadow.StageProfiler() as profiler:
+    ...     shadows = pybdshadow.bdshadow_sunlight(buildings, date, roof=True)
+    >>> profiler.to_dataframe()
+    '''
+
+    def __init__(self, memory=False, callback=None):
+        self.memory = memory
+        self.callback = callback
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._previous = None
+        self._tracing = False
+
+    def __enter__(self):
+        global _PROFILER
+        self._previous = _PROFILER
+        _PROFILER = self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        return self
+
+    def __exit__(self, *exc):
+        global _PROFILER
+        _PROFILER = self._previous
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        return False
+
+    def _stage(self, name, count):
+        return _Stage(self, name, count)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, entry):
+        stack = self._stack()
+        entry.path = stack[-1].path+'/'+entry.name if stack else entry.name
+        if self.memory:
+            # 外层阶段的峰值先记下，再重置峰值统计本阶段
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            # Python 3.8 没有 reset_peak，峰值从开始追踪时算起
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            entry.start_memory = current
+            entry.peak = current
+        stack.append(entry)
+        entry.start = time.perf_counter()
+
+    def _exit(self, entry):
+        elapsed = time.perf_counter()-entry.start
+        stack = self._stack()
+        stack.pop()
+        record = {'stage': entry.path, 'start': entry.start, 'time': elapsed, 'count': entry.count}
+        if self.memory:
+            entry.peak = max(entry.peak, tracemalloc.get_traced_memory()[1])
+            record['peak_memory'] = entry.peak-entry.start_memory
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, entry.peak)
+        with self._lock:
+            self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def to_dict(self):
+        '''
+        Summary of the stages, keyed by stage path in order of the first call.
+
+        Returns
+        -------
+        report : dict
+            {stage: {'calls', 'time', 'self_time', 'count', ('peak_memory')}}. `time` is the total wall-clock time (s),
+            `self_time` excludes the nested stages, `count` is the total number of items
+            and `peak_memory` (byte) the maximum over the calls.
+        '''
+        report = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            summary = report.setdefault(record['stage'], {'calls': 0, 'time': 0., 'self_time': 0., 'count': None,
+                                                          'start': record['start']})
+            summary['start'] = min(summary['start'], record['start'])
+            summary['calls'] += 1
+            summary['time'] += record['time']
+            summary['self_time'] += record['time']
+            if record['count'] is not None:
+                summary['count'] = (summary['count'] or 0)+record['count']
+            if 'peak_memory' in record:
+                summary['peak_memory'] = max(summary.get('peak_memory', 0), record['peak_memory'])
+        for path, summary in report.items():
+            parent = path.rsplit('/', 1)[0]
+            if parent != path and parent in report:
+                report[parent]['self_time'] -= summary['time']
+
+        # 父阶段在子阶段之后结束，按开始时间排序使父阶段在前
+        report = dict(sorted(report.items(), key=lambda item: item[1]['start']))
+        for summary in report.values():
+            del summary['start']
+        return report
+
+    def to_dataframe(self):
+        '''
+        Summary of the stages as a DataFrame, see `to_dict`.
+
+        Returns
+        -------
+        report : DataFrame
+            One row per stage with `stage`, `calls`, `time`, `self_time`, `count` (and `peak_memory`) columns.
+        '''
+        report = self.to_dict()
+        return pd.DataFrame([{'stage': path, **summary} for path, summary in report.items()],
+                            columns=['stage', 'calls', 'time', 'self_time', 'count']
+                            + (['peak_memory'] if self.memory else []))
+
+    def reset(self):
+        '''
+        Clear the records.
+        '''
+        with self._lock:
+            self.records = []
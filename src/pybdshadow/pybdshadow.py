@@ -29,20 +29,25 @@ CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
 OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import geopandas as gpd
-from suncalc import get_position
-from shapely.geometry import Polygon, MultiPolygon
-import math
+import shapely
 import numpy as np
 from .utils import (
     lonlat2aeqd,
-    aeqd2lonlat
+    aeqd2lonlat,
+    select_projection,
+    union_by_group,
+    _local_scale
 )
-from .preprocess import gdf_difference,gdf_intersect
+from .walls import silhouette_walls
+from .buildingset import BuildingSet
+from .ephemeris import sun_position
+from .profiling import stage
 
 
-def calSunShadow_vector(shape, shapeHeight, sunPosition):
+def calSunShadow_vector(shape, shapeHeight, sunPosition, projection=None):
     '''
     Calculate the shadow of a building on the ground.
 
@@ -54,49 +59,90 @@ def calSunShadow_vector(shape, shapeHeight, sunPosition):
         The height of the building.
     sunPosition : dict
         The position of the sun. The keys are 'azimuth' and 'altitude'.
+    projection : str
+        Projection backend, `pyproj` or `local`, see `utils.set_projection_backend`.
 
     Returns
     -------
     shadow : numpy.ndarray
         The shadow of the building on the ground. shape = [n,5,2]
     '''
+    sunPositions = [[sunPosition['azimuth'], sunPosition['altitude']]]
+    return calSunShadow_batch(shape, shapeHeight, sunPositions, projection)[0]
+
+
+def calSunShadow_batch(shape, shapeHeight, sunPositions, projection=None):
+    '''
+    Calculate the shadow of the walls on the ground for a series of sun positions at once.
+    The walls are projected only once, the offsets of all sun positions are computed by broadcasting.
+
+    Parameters
+    ----------
+    shape : numpy.ndarray
+        The shape of the walls. The shape of the array is (n,2,2), where n the number of walls, 2 is that each wall has two points, and the last dimension is for longitude and latitude.
+    shapeHeight : float or numpy.ndarray
+        The height of the walls, shape = [n]
+    sunPositions : numpy.ndarray
+        The positions of the sun, shape = [T,2], each row is the azimuth and altitude (radians) of the sun.
+    projection : str
+        Projection backend, `pyproj` or `local`, see `utils.set_projection_backend`.
+
+    Returns
+    -------
+    shadow : numpy.ndarray
+        The shadow of the walls on the ground for each sun position. shape = [T,n,5,2]
+    '''
+    n = np.shape(shape)[0]
+    sunPositions = np.asarray(sunPositions, dtype=float).reshape((-1, 2))
+    T = len(sunPositions)
+
     # transform coordinate system
     meanlon = shape[:,:,0].mean()
     meanlat = shape[:,:,1].mean()
-    shape = lonlat2aeqd(shape,meanlon,meanlat)
-
-    azimuth = sunPosition['azimuth']
-    altitude = sunPosition['altitude']
+    projection = select_projection(shape,meanlon,meanlat,projection)
+    shape_aeqd = lonlat2aeqd(shape,meanlon,meanlat,projection)
 
-    n = np.shape(shape)[0]
-    distance = shapeHeight/math.tan(altitude)
+    azimuth = sunPositions[:, 0].reshape((T, 1, 1))
+    altitude = sunPositions[:, 1].reshape((T, 1, 1))
+    shapeHeight = np.broadcast_to(np.asarray(shapeHeight, dtype=float), (n,))
+    distance = shapeHeight.reshape((1, n, 1))/np.tan(altitude) # T,n,1
 
     # calculate the offset of the projection position
-    lonDistance = distance*math.sin(azimuth) 
-    lonDistance = lonDistance.reshape((n, 1))
-    latDistance = distance*math.cos(azimuth)
-    latDistance = latDistance.reshape((n, 1))
+    lonDistance = distance*np.sin(azimuth)
+    latDistance = distance*np.cos(azimuth)
+
+    # the far side of the shadow, in reversed order of the wall points
+    farShape = np.zeros((T, n, 2, 2))
+    farShape[:, :, :, 0] = shape_aeqd[np.newaxis, :, ::-1, 0] + lonDistance
+    farShape[:, :, :, 1] = shape_aeqd[np.newaxis, :, ::-1, 1] + latDistance
+    farShape = aeqd2lonlat(farShape.reshape((T*n, 2, 2)),meanlon,meanlat,projection)
+
+    shadowShape = np.zeros((T, n, 5, 2)) # T sun positions, n walls, each wall has 5 points, each point has 2 dimensions
+    shadowShape[:, :, 0:2, :] = shape
+    shadowShape[:, :, 2:4, :] = farShape.reshape((T, n, 2, 2))
+    shadowShape[:, :, 4, :] = shadowShape[:, :, 0, :]
+    return shadowShape
 
-    shadowShape = np.zeros((n, 5, 2)) # n buildings, each building has 5 points, each point has 2 dimensions
 
-    shadowShape[:, 0:2, :] += shape  
-    shadowShape[:, 2:4, 0] = shape[:, :, 0] + lonDistance
-    shadowShape[:, 2:4, 1] = shape[:, :, 1] + latDistance
+def _prepare_buildings(buildings, height='height', ground=0):
+    # 减去地面高度，去除地面以下的建筑
+    if isinstance(buildings, BuildingSet):
+        return buildings.above(ground)
+    return BuildingSet.from_geodataframe(buildings, height, ground)
 
-    shadowShape[:, [2, 3], :] = shadowShape[:, [3, 2], :]
-    shadowShape[:, 4, :] = shadowShape[:, 0, :]
 
-    shadowShape = aeqd2lonlat(shadowShape,meanlon,meanlat)
-    return shadowShape
+def _buildings_center(building):
+    # calculate position
+    return building.center()
 
 
-def bdshadow_sunlight(buildings, date,  height='height', roof=False,include_building = True,ground=0):
+def bdshadow_sunlight(buildings, date,  height='height', roof=False,include_building = True,ground=0,projection=None):
     '''
     Calculate the sunlight shadow of the buildings.
 
     Parameters
     ----------
-    buildings : GeoDataFrame
+    buildings : GeoDataFrame or BuildingSet
         Buildings. coordinate system should be WGS84
     date : datetime
         Datetime
@@ -108,6 +154,8 @@ def bdshadow_sunlight(buildings, date,  height='height', roof=False,include_buil
         Whether the shadow include building outline.
     ground : number
         Height of the ground(meter).
+    projection : str
+        Projection backend, `pyproj` or `local`, see `utils.set_projection_backend`.
 
     Returns
     ----------
@@ -115,132 +163,283 @@ def bdshadow_sunlight(buildings, date,  height='height', roof=False,include_buil
         Building shadow
     '''
 
-    building = buildings.copy()
+    with stage('bdshadow_sunlight', len(buildings)):
+        with stage('prepare', len(buildings)):
+            building = _prepare_buildings(buildings, height, ground)
+            lon, lat = _buildings_center(building)
 
-    building[height] -= ground
-    building = building[building[height] > 0]
+        # obtain sun position
+        sunPosition = sun_position(date, lon, lat)
+        if ( sunPosition['altitude']<0):
+            raise ValueError("Given time before sunrise or after sunset")   # pragma: no cover
+        return _bdshadow_sunlight(buildings, building, sunPosition, roof=roof,
+                                  include_building=include_building, projection=projection)
 
-    # calculate position
-    lon1, lat1, lon2, lat2 = list(building.bounds.mean())
-    lon = (lon1+lon2)/2
-    lat = (lat1+lat2)/2
 
-    # obtain sun position
-    sunPosition = get_position(date, lon, lat)
+def _bdshadow_sunlight(buildings, building, sunPosition, roof=False,
+                       include_building=True, projection=None):
+    # calculate shadow for walls
+    with stage('wall_shadows', len(building.walls)):
+        shadowShape = calSunShadow_vector(
+            building.walls, building.wall_height, sunPosition, projection)
+
+    return _sunlight_shadows(buildings, building, shadowShape, sunPosition,
+                             roof=roof, include_building=include_building,
+                             projection=projection)
+
+
+def bdshadow_sunlight_tiled(buildings, date, height='height', roof=False, include_building=True, ground=0,
+                            projection=None, tile_size=2000, n_jobs=None):
+    '''
+    Calculate the sunlight shadow of the buildings tile by tile on a process pool.
+
+    The buildings are partitioned into square tiles by their representative points.
+    Each tile is calculated together with the buildings in a halo around the bounds of its buildings,
+    the width of the halo is the longest shadow (maximum height / tan(sun altitude)),
+    so that the occluders of roofs and the buildings covered by the shadows are included.
+    The shadows of the buildings in each tile are then stitched by `building_id`.
+    Each tile is projected around its own center, so the result may differ slightly from `bdshadow_sunlight`
+    (relative area difference around 1e-4 for tiles 1 km away from the center of the study area).
+
+    On platforms starting processes by spawn (Windows, macOS), call this function under `if __name__ == '__main__':`.
+
+    Parameters
+    ----------
+    buildings : GeoDataFrame or BuildingSet
+        Buildings. coordinate system should be WGS84, `building_id` should be unique.
+    date : datetime
+        Datetime
+    height : string
+        Column name of building height(meter).
+    roof : bool
+        Whether to calculate the roof shadows.
+    include_building : bool
+        Whether the shadow include building outline.
+    ground : number
+        Height of the ground(meter).
+    projection : str
+        Projection backend, `pyproj` or `local`, see `utils.set_projection_backend`.
+    tile_size : number
+        Size of the tiles(meter).
+    n_jobs : int
+        Number of processes, default is the number of CPUs. Tiles are calculated in this process if n_jobs is 1.
+
+    Returns
+    ----------
+    shadows : GeoDataFrame
+        Building shadow
+    '''
+    if not isinstance(buildings, BuildingSet):
+        # 地面以下的建筑在各个分块中去除，但仍用于裁剪建筑轮廓
+        buildings = BuildingSet(buildings['geometry'].values, buildings[height].values,
+                                buildings['building_id'].values, crs=buildings.crs)
+    building = buildings.above(ground)
+    lon, lat = _buildings_center(building)
+
+    # 太阳位置由整个研究区域确定，各个分块使用相同的太阳位置
+    sunPosition = sun_position(date, lon, lat)
     if ( sunPosition['altitude']<0):
         raise ValueError("Given time before sunrise or after sunset")   # pragma: no cover
-    buildingshadow = building.copy()
-
-    a = buildingshadow['geometry'].apply(lambda r: list(r.exterior.coords))
-    buildingshadow['wall'] = a
-    buildingshadow = buildingshadow.set_index(['building_id'])
-    a = buildingshadow.apply(lambda x: pd.Series(x['wall']), axis=1).unstack()
-    walls = a[- a.isnull()].reset_index().sort_values(
-        by=['building_id', 'level_0'])
-    walls = pd.merge(walls, buildingshadow['height'].reset_index())
-    walls['x1'] = walls[0].apply(lambda r: r[0])
-    walls['y1'] = walls[0].apply(lambda r: r[1])
-    walls['x2'] = walls['x1'].shift(-1)
-    walls['y2'] = walls['y1'].shift(-1)
-    walls = walls[walls['building_id'] == walls['building_id'].shift(-1)]
-    walls = walls[['x1', 'y1', 'x2', 'y2', 'building_id', 'height']]
-    walls['wall'] = walls.apply(lambda r: [[r['x1'], r['y1']],
-                                           [r['x2'], r['y2']]], axis=1)
-
-    ground_shadow = walls.copy()
-    walls_shape = np.array(list(ground_shadow['wall']))
 
-    # calculate shadow for walls
-    shadowShape = calSunShadow_vector(
-        walls_shape, ground_shadow['height'].values, sunPosition)
+    # 分块与缓冲区大小（度）
+    kx, ky = _local_scale(lat)
+    halo = building.height.max()/np.tan(sunPosition['altitude'])
+    geometry = buildings.geometry
+    minx, miny, _, _ = shapely.total_bounds(geometry)
+    point = shapely.get_coordinates(shapely.point_on_surface(geometry))
+    tile = np.c_[(point[:, 0]-minx)*kx//tile_size, (point[:, 1]-miny)*ky//tile_size]
+    _, tile_index = np.unique(tile, axis=0, return_inverse=True)
+    tile_index = tile_index.ravel()
+    cores = np.split(np.argsort(tile_index, kind='stable'),
+                     np.cumsum(np.bincount(tile_index))[:-1])
+
+    tree = shapely.STRtree(geometry)
+    tasks = []
+    for core in cores:
+        # 缓冲区围绕分块内建筑的范围，分块内的建筑可以超出分块
+        core_minx, core_miny, core_maxx, core_maxy = shapely.total_bounds(geometry[core])
+        halo_box = shapely.box(core_minx-halo/kx, core_miny-halo/ky, core_maxx+halo/kx, core_maxy+halo/ky)
+        member = np.union1d(tree.query(halo_box, predicate='intersects'), core)
+        tasks.append((buildings.take(member), buildings.building_id[core],
+                      sunPosition, roof, include_building, ground, projection))
+
+    with stage('bdshadow_sunlight_tiled', len(tasks)):
+        if n_jobs == 1:
+            shadows = [_sunlight_tile(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                shadows = list(executor.map(_sunlight_tile, tasks))
+
+    shadows = pd.concat(shadows)
+    if roof:
+        shadows = pd.concat([shadows[shadows['type'] == 'roof'].sort_values(by=['height', 'building_id']),
+                             shadows[shadows['type'] == 'ground'].sort_values(by='building_id')])
+    else:
+        shadows = shadows.sort_values(by='building_id')
+    return shadows.reset_index(drop=True)
 
-    ground_shadow['geometry'] = list(shadowShape)
-    ground_shadow['geometry'] = ground_shadow['geometry'].apply(
-        lambda r: Polygon(r))
-    ground_shadow = gpd.GeoDataFrame(ground_shadow)
 
+def _sunlight_tile(task):
+    # 计算一个分块（含缓冲区）的阴影，只保留分块内建筑的阴影
+    buildings, core, sunPosition, roof, include_building, ground, projection = task
+    building = buildings.above(ground)
+    shadows = _bdshadow_sunlight(buildings, building, sunPosition, roof=roof,
+                                 include_building=include_building, projection=projection)
+    return shadows[shadows['building_id'].isin(core)]
 
 
-    ground_shadow = pd.concat([ground_shadow, building])
-    ground_shadow = ground_shadow.groupby(['building_id'])['geometry'].apply(
-        lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
-    
+def sweep_shadows(building, shadowShape, sunPosition):
+    '''
+    Generate the ground shadows of the buildings by sweeping the footprints along the shadow direction.
+
+    The shadow of a prism is its footprint swept along the shadow vector.
+    For convex footprints it is the convex hull of the footprint and the translated footprint,
+    i.e. of all the points of the wall shadows, which needs no union.
+    Concave footprints are decomposed into the footprint and the shadows of the walls facing away from the sun,
+    which are then unioned.
+
+    Parameters
+    ----------
+    building : BuildingSet
+        Buildings.
+    shadowShape : numpy.ndarray
+        The shadow of the walls of the buildings on the ground. shape = [n,5,2]
+    sunPosition : dict
+        The position of the sun. The keys are 'azimuth' and 'altitude'.
+
+    Returns
+    -------
+    shadows : GeoDataFrame
+        `building_id` and the shadow geometry of each building, sorted by `building_id`
+    '''
+    footprint = building.geometry
+    area = shapely.area(footprint)
+    convex = shapely.area(shapely.convex_hull(footprint)) <= area*(1+1e-9)
+    convex_wall = convex[building.wall_building]
+
+    # 凸多边形：墙面阴影所有点的凸包
+    codes, convex_id = pd.factorize(building.wall_building_id[convex_wall])
+    points = shadowShape[convex_wall, :4].reshape((-1, 2))
+    hull = shapely.convex_hull(shapely.multipoints(points, indices=np.repeat(codes, 4)))
+    hull = gpd.GeoDataFrame({'building_id': convex_id}, geometry=shapely.normalize(hull))
+
+    # 凹多边形：建筑轮廓与背向太阳的墙面阴影的并集
+    concave_wall = ~convex_wall & silhouette_walls(building.walls, building.wall_building, sunPosition)
+    union = gpd.GeoDataFrame(
+        {'building_id': np.r_[building.wall_building_id[concave_wall], building.building_id[~convex]]},
+        geometry=np.r_[shapely.polygons(shadowShape[concave_wall]), footprint[~convex]])
+    union = union_by_group(union, ['building_id'])
+
+    shadows = pd.concat([hull, union]).sort_values(by='building_id')
+    return shadows.reset_index(drop=True)
+
+
+def _sunlight_shadows(buildings, building, shadowShape, sunPosition,
+                      roof=False, include_building=True, projection=None):
+    # 由墙面阴影生成建筑阴影（以及屋顶阴影）
+    with stage('sweep', len(building)):
+        ground_shadow = sweep_shadows(building, shadowShape, sunPosition)
     ground_shadow['height'] = 0
     ground_shadow['type'] = 'ground'
 
     if not roof:
         if not include_building:
             #从地面阴影裁剪建筑轮廓
-            ground_shadow = gdf_difference(ground_shadow,buildings)
+            with stage('difference', len(ground_shadow)):
+                ground_shadow = _difference_footprints(ground_shadow, buildings.geometry)
         return ground_shadow
     else:
-        def calwall_shadow(walldata, building):
-            walls = walldata.copy()
-            walls_shape = np.array(list(walls['wall']))
-            # calculate shadow for walls
-            shadowShape = calSunShadow_vector(
-                walls_shape, walls['height'].values, sunPosition)
-            walls['geometry'] = list(shadowShape)
-            walls['geometry'] = walls['geometry'].apply(lambda r: Polygon(r))
-            walls = gpd.GeoDataFrame(walls)
-            walls = pd.concat([walls, building])
-
-            walls = walls.groupby(['building_id'])['geometry'].apply(
-                lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
-            return walls
-
-        # 计算屋顶阴影
-        roof_shadows = []
-        for roof_height in walls[height].drop_duplicates():
-            # 高于给定高度的墙
-            walls_high = walls[walls[height] > roof_height].copy()
-            if len(walls_high) == 0:
-                continue
-            walls_high[height] -= roof_height
-            # 高于给定高度的建筑
-            building_high = building[building[height] > roof_height].copy()
-            if len(building_high) == 0:
-                continue
-            building_high[height] -= roof_height
-            # 所有建筑在此高度的阴影
-            building_shadow_height = calwall_shadow(walls_high, building_high)
-            # 在此高度的建筑屋顶
-            building_roof = building[building[height] == roof_height].copy()
-            building_shadow_height.crs = building_roof.crs
-            # 取有遮挡的阴影
-            building_shadow_height = gpd.sjoin(
-                gpd.GeoDataFrame(building_shadow_height), gpd.GeoDataFrame(building_roof))
-            if len(building_shadow_height) == 0:
-                continue
-            # 与屋顶做交集
-            building_roof = gdf_intersect(building_roof,building_shadow_height)
-
-            # 再减去这个高度以上的建筑
-            building_higher = building[building[height] > roof_height].copy()
-            building_roof = gdf_difference(building_roof,building_higher)
-            
-            #给出高度信息
-            building_roof['height'] = roof_height
-            building_roof = building_roof[-building_roof['geometry'].is_empty]
-
-            roof_shadows.append(building_roof)
-        if len(roof_shadows) == 0:
-            roof_shadow = gpd.GeoDataFrame()
-        else:
-            roof_shadow = pd.concat(roof_shadows)[
-                ['height', 'building_id', 'geometry']]
-            roof_shadow['type'] = 'roof'
+        with stage('roof', len(building)):
+            roof_shadow = _roof_shadows(building, ground_shadow, sunPosition, projection=projection)
 
         if not include_building:
             #从地面阴影裁剪建筑轮廓
-            ground_shadow = gdf_difference(ground_shadow,buildings)
+            with stage('difference', len(ground_shadow)):
+                ground_shadow = _difference_footprints(ground_shadow, buildings.geometry)
         
-        shadows = pd.concat([roof_shadow, ground_shadow])
-        shadows.crs = None
-        shadows['geometry'] = shadows.buffer(0.000001).buffer(-0.000001)
+        with stage('clean', len(roof_shadow)+len(ground_shadow)):
+            shadows = pd.concat([roof_shadow, ground_shadow])
+            shadows.crs = None
+            shadows['geometry'] = shadows.buffer(0.000001).buffer(-0.000001)
         return shadows
 
 
+def _difference_footprints(shadows, footprint):
+    # 从阴影中裁剪与其相交的建筑轮廓，与gdf_difference的结果一致但保持阴影的顺序
+    footprint = np.asarray(footprint, dtype=object)
+    geometry = np.array(shadows['geometry'].values, dtype=object)
+    shadow_index, footprint_index = shapely.STRtree(footprint).query(geometry, predicate='intersects')
+    clip = union_by_group(gpd.GeoDataFrame({'shadow': shadow_index}, geometry=footprint[footprint_index]), 'shadow')
+    index = clip['shadow'].values
+    geometry[index] = shapely.buffer(shapely.difference(geometry[index], clip['geometry'].values), 0)
+    shadows = shadows.copy()
+    shadows['geometry'] = geometry
+    return shadows
+
+
+def _roof_shadows(building, ground_shadow, sunPosition, projection=None):
+    # 计算屋顶阴影：只对比屋顶高、且地面阴影到达屋顶的建筑计算其在屋顶高度上的阴影
+    building_id = building.building_id
+    building_height = building.height
+    footprint = building.geometry
+    roof_tree = shapely.STRtree(footprint)
+
+    # 建筑的地面阴影即为其阴影所能到达的范围，用空间索引找出遮挡建筑与被遮挡屋顶
+    with stage('occluders', len(building)):
+        reach = ground_shadow.set_index('building_id')['geometry'].reindex(building_id).values
+        occluder, roof = roof_tree.query(reach, predicate='intersects')
+        higher = building_height[occluder] > building_height[roof]
+        occluder, roof = occluder[higher], roof[higher]
+    if len(occluder) == 0:
+        return gpd.GeoDataFrame()
+
+    # 遮挡建筑的每面背向太阳的墙在屋顶高度上的阴影
+    silhouette = np.flatnonzero(silhouette_walls(building.walls, building.wall_building, sunPosition))
+    wall_building = building.wall_building[silhouette]
+    wall_order = np.argsort(wall_building, kind='stable')
+    wall_count = np.bincount(wall_building, minlength=len(building))
+    wall_start = np.cumsum(wall_count)-wall_count
+    pair_wall_count = wall_count[occluder]
+    pair = np.repeat(np.arange(len(occluder)), pair_wall_count)
+    offset = np.arange(len(pair))-np.repeat(np.cumsum(pair_wall_count)-pair_wall_count, pair_wall_count)
+    wall = silhouette[wall_order[np.repeat(wall_start[occluder], pair_wall_count)+offset]]
+    walls_shape = building.walls[wall]
+    wall_height = building_height[occluder[pair]]-building_height[roof[pair]]
+    with stage('wall_shadows', len(walls_shape)):
+        shadowShape = calSunShadow_vector(
+            walls_shape, wall_height, sunPosition, projection)
+
+    # 每个屋顶上所有遮挡建筑阴影（含遮挡建筑轮廓）的并集
+    with stage('union', len(occluder)):
+        shadow_height = gpd.GeoDataFrame({'roof': np.r_[roof[pair], roof]},
+                                         geometry=np.r_[shapely.polygons(shadowShape), footprint[occluder]])
+        shadow_height = union_by_group(shadow_height, 'roof')
+
+    # 与屋顶做交集
+    with stage('clip', len(shadow_height)):
+        roof_index = shadow_height['roof'].values
+        roof_shadow = shapely.intersection(footprint[roof_index], shadow_height['geometry'].values)
+
+        # 再减去这个高度以上的建筑
+        shadow_index, higher_index = roof_tree.query(roof_shadow, predicate='intersects')
+        higher = building_height[higher_index] > building_height[roof_index[shadow_index]]
+        if higher.any():
+            building_higher = union_by_group(gpd.GeoDataFrame(
+                {'shadow': shadow_index[higher]}, geometry=footprint[higher_index[higher]]), 'shadow')
+            building_higher_index = building_higher['shadow'].values
+            roof_shadow[building_higher_index] = shapely.difference(
+                roof_shadow[building_higher_index], building_higher['geometry'].values)
+
+    #给出高度信息
+    roof_shadow = gpd.GeoDataFrame({'height': building_height[roof_index],
+                                    'building_id': building_id[roof_index]},
+                                   geometry=roof_shadow)
+    roof_shadow = roof_shadow[~roof_shadow['geometry'].is_empty]
+    roof_shadow = roof_shadow.sort_values(by=['height', 'building_id'])
+    roof_shadow['type'] = 'roof'
+    return roof_shadow
+
+
 def calPointLightShadow_vector(shape, shapeHeight, pointLight):
     '''
     calculate shadow for a point light
@@ -298,7 +497,7 @@ def bdshadow_pointlight(buildings,
 
     Parameters
     --------------------
-    buildings : GeoDataFrame
+    buildings : GeoDataFrame or BuildingSet
         Buildings. coordinate system should be WGS84
     pointlon,pointlat,pointheight : float
         Point light coordinates and height(meter).
@@ -317,52 +516,34 @@ def bdshadow_pointlight(buildings,
         Building shadow
     '''
 
-    building = buildings.copy()
-
-    building[height] -= ground
-    building = building[building[height] > 0]
-
-    if len(building) == 0:
-        walls = gpd.GeoDataFrame()
-        walls['geometry'] = []
-        walls['building_id'] = []
-        return walls
-    # building to walls
-    buildingshadow = building.copy()
-
-    a = buildingshadow['geometry'].apply(lambda r: list(r.exterior.coords))  #裸格式的几何
-    buildingshadow['wall'] = a  #
-    #print(a[0])
-    buildingshadow = buildingshadow.set_index(['building_id']) #设置阴影所对应的id
-    a = buildingshadow.apply(lambda x: pd.Series(x['wall']), axis=1).unstack()  #压缩为一个数组
-    walls = a[- a.isnull()].reset_index().sort_values(
-        by=['building_id', 'level_0'])  #重新排序
-    walls = pd.merge(walls, buildingshadow['height'].reset_index())#与高度融合
-    
-    walls['x1'] = walls[0].apply(lambda r: r[0])  #
-    walls['y1'] = walls[0].apply(lambda r: r[1])
-    walls['x2'] = walls['x1'].shift(-1)  #向量中的序号全部向前提了一个
-    walls['y2'] = walls['y1'].shift(-1)
-    walls = walls[walls['building_id'] == walls['building_id'].shift(-1)]
-    walls = walls[['x1', 'y1', 'x2', 'y2', 'building_id', 'height']]
-    walls['wall'] = walls.apply(lambda r: [[r['x1'], r['y1']],
-                                           [r['x2'], r['y2']]], axis=1)
-    walls_shape = np.array(list(walls['wall']))
-
-    # Create point light
-    pointLightPosition = {'position': [pointlon, pointlat, pointheight]}
-    # calculate shadow for walls
-    shadowShape = calPointLightShadow_vector(
-        walls_shape, walls['height'].values, pointLightPosition)
-
-    walls['geometry'] = list(shadowShape)  #阴影存储
-    walls['geometry'] = walls['geometry'].apply(lambda r: Polygon(r))  #将numpy转换成polygon形式
-    walls = gpd.GeoDataFrame(walls)  #8列 x1 ， y1 ，x2 ， y2 ， building_id ， height ，  wall ，shadow 
-    wallsBuilding = pd.concat([walls, building]) #
-    #print(wallsBuilding)
-    if merge:
-        wallsBuilding = wallsBuilding.groupby(['building_id'])['geometry'].apply(
-            lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()
-        #print(wallsBuilding)
-    shadows=wallsBuilding
-    return shadows
+    with stage('bdshadow_pointlight', len(buildings)):
+        with stage('prepare', len(buildings)):
+            building = _prepare_buildings(buildings, height, ground)
+
+        if len(building) == 0:
+            walls = gpd.GeoDataFrame()
+            walls['geometry'] = []
+            walls['building_id'] = []
+            return walls
+
+        # Create point light
+        pointLightPosition = {'position': [pointlon, pointlat, pointheight]}
+        # calculate shadow for walls
+        walls_shape = building.walls
+        with stage('wall_shadows', len(walls_shape)):
+            shadowShape = calPointLightShadow_vector(
+                walls_shape, building.wall_height, pointLightPosition)
+
+        walls = gpd.GeoDataFrame({
+            'x1': walls_shape[:, 0, 0],
+            'y1': walls_shape[:, 0, 1],
+            'x2': walls_shape[:, 1, 0],
+            'y2': walls_shape[:, 1, 1],
+            'building_id': building.wall_building_id,
+            height: building.wall_height}, geometry=shapely.polygons(shadowShape), crs=building.crs)
+        wallsBuilding = pd.concat([walls, building.to_geodataframe(height)])
+        if merge:
+            with stage('union', len(wallsBuilding)):
+                wallsBuilding = union_by_group(wallsBuilding, ['building_id'])
+        shadows=wallsBuilding
+        return shadows
@@ -0,0 +1,250 @@
+"""
+BSD 3-Clause License
+
+Copyright (c) 2022, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+from .ephemeris import day_length
+
+
+def raster_params(bounds, accuracy=1):
+    '''
+    Generate the raster covering the bounds, aligned with the grids generated by TransBigData.
+
+    Parameters
+    ----------
+    bounds : list
+        [lon1, lat1, lon2, lat2] of the study area
+    accuracy : number
+        Size of the raster cells (meter)
+
+    Returns
+    -------
+    shape : tuple
+        (height, width) of the raster
+    transform : tuple
+        Affine transform (a, b, c, d, e, f) of the raster, the cell at (row, col) has its upper-left corner at
+        x = a*col + b*row + c, y = d*col + e*row + f
+    params : dict
+        Gridding parameters of TransBigData. The cell at (row, col) is the grid with
+        LONCOL = col and LATCOL = height-1-row
+    '''
+    import transbigdata as tbd
+    params = tbd.area_to_params(list(bounds), accuracy)
+    lon1, lat1, lon2, lat2 = bounds
+    deltalon, deltalat = params['deltalon'], params['deltalat']
+    width = int(np.floor((lon2-params['slon'])/deltalon+0.5))+1
+    height = int(np.floor((lat2-params['slat'])/deltalat+0.5))+1
+    transform = (deltalon, 0, params['slon']-deltalon/2,
+                 0, -deltalat, params['slat']+(height-0.5)*deltalat)
+    return (height, width), transform, params
+
+
+def rasterize_polygons(geometry, shape, transform):
+    '''
+    Rasterize polygons with a scanline algorithm. A cell is covered if its center is inside any of the polygons.
+
+    Parameters
+    ----------
+    geometry : GeoSeries or array-like of Polygon/MultiPolygon
+        Polygons to rasterize
+    shape : tuple
+        (height, width) of the raster
+    transform : tuple
+        Affine transform (a, b, c, d, e, f) of the raster, should be north-up (b = d = 0)
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        Boolean array of the given shape, True for the covered cells
+    '''
+    height, width = shape
+    a, b, c, d, e, f = transform
+    if b != 0 or d != 0:
+        raise ValueError('Only north-up transforms (b = d = 0) are supported')
+    parts = shapely.get_parts(np.asarray(geometry, dtype=object))
+    parts = parts[shapely.get_type_id(parts) == 3]
+    rings, polygon_index = shapely.get_rings(parts, return_index=True)
+    coords, ring_index = shapely.get_coordinates(rings, return_index=True)
+
+    # 转换到栅格坐标，整数位置为栅格中心
+    px = (coords[:, 0]-c)/a-0.5
+    py = (coords[:, 1]-f)/e-0.5
+    same = ring_index[:-1] == ring_index[1:]
+    x0, x1 = px[:-1][same], px[1:][same]
+    y0, y1 = py[:-1][same], py[1:][same]
+    edge_polygon = polygon_index[ring_index[:-1][same]]
+
+    # 每条边与行中心线的交点，行号取左闭右开区间避免顶点重复计数
+    lo = np.clip(np.ceil(np.minimum(y0, y1)), 0, height).astype(np.int64)
+    hi = np.clip(np.ceil(np.maximum(y0, y1)), 0, height).astype(np.int64)
+    n = hi-lo
+    edge = np.repeat(np.arange(len(n)), n)
+    row = lo[edge]+np.arange(len(edge))-np.repeat(np.cumsum(n)-n, n)
+    x = x0[edge]+(row-y0[edge])/(y1[edge]-y0[edge])*(x1[edge]-x0[edge])
+
+    # 同一多边形同一行的交点两两配对（奇偶规则），得到被覆盖的列区间
+    order = np.lexsort((x, row, edge_polygon[edge]))
+    x, row = x[order], row[order]
+    start = np.clip(np.ceil(x[0::2]), 0, width).astype(np.int64)
+    end = np.clip(np.ceil(x[1::2]), 0, width).astype(np.int64)
+    row = row[0::2]
+
+    # 差分数组累加得到覆盖情况
+    diff = np.bincount(row*(width+1)+start, minlength=height*(width+1)) - \
+        np.bincount(row*(width+1)+end, minlength=height*(width+1))
+    return np.cumsum(diff.reshape(height, width+1)[:, :width], axis=1) > 0
+
+
+def rasterize_shadowcoverage(shadows_input, shape, transform, shadow_type='ground'):
+    '''
+    Count the timesteps each raster cell is covered by shadow.
+
+    Parameters
+    ----------
+    shadows_input : GeoDataFrame or iterable of GeoDataFrame
+        Shadows with the `date` and `type` columns, or a stream of shadows such as `iter_sunshadows`
+    shape : tuple
+        (height, width) of the raster
+    transform : tuple
+        Affine transform (a, b, c, d, e, f) of the raster
+    shadow_type : str
+        `ground` or `roof`
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        Array of the given shape, the number of timesteps each cell is covered by shadow.
+        The counter is uint16, and becomes uint32 once there are more than 65535 timesteps
+        (e.g. a year at 5-minute precision), so that it never wraps around.
+    '''
+    if isinstance(shadows_input, pd.DataFrame):
+        shadows_input = [shadows_input]
+    counts = np.zeros(shape, dtype=np.uint16)
+    steps = 0
+    for shadows in shadows_input:
+        shadows = shadows[shadows['type'] == shadow_type]
+        for _, shadow in shadows.groupby('date'):
+            # 时刻数超过计数器上限前改用uint32，避免溢出
+            steps += 1
+            if steps > np.iinfo(counts.dtype).max:
+                counts = counts.astype(np.uint32)
+            counts += rasterize_polygons(shadow['geometry'], shape, transform)
+    return counts
+
+
+def raster_to_grids(array, params, name='count', mask=None):
+    '''
+    Convert the raster into grids of TransBigData.
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        Raster generated on the cells of `raster_params`
+    params : dict
+        Gridding parameters returned by `raster_params`
+    name : str
+        Column name to store the raster value
+    mask : numpy.ndarray
+        Boolean array, only the cells where mask is True are converted. All cells are converted if None.
+
+    Returns
+    -------
+    grids : GeoDataFrame
+        Grids with `LONCOL`, `LATCOL`, `geometry` and the raster value columns
+    '''
+    import transbigdata as tbd
+    if mask is None:
+        mask = np.ones(array.shape, dtype=bool)
+    row, col = np.nonzero(mask)
+    grids = pd.DataFrame({'LONCOL': col, 'LATCOL': array.shape[0]-1-row,
+                          name: array[row, col]})
+    grids = gpd.GeoDataFrame(grids, geometry=tbd.grid_to_polygon(
+        [grids['LONCOL'], grids['LATCOL']], params))
+    return grids
+
+
+def cal_sunshine_raster(buildings, day='2022-01-01', roof=False, accuracy=1, precision=3600, padding=1800,
+                        as_grids=False):
+    '''
+    Calculate the sunshine time in given date on a raster.
+    Shadows of each timestep are rasterized onto an integer counter, which is much faster and lighter than
+    joining the shadows with grid polygons in `cal_sunshine`. A cell is analysed by its center point.
+
+    Parameters
+    ----------
+    buildings : GeoDataFrame
+        Buildings. coordinate system should be WGS84
+    day : str
+        the day to calculate the sunshine
+    roof : bool
+        If true calculate the sunshine on the roofs, false then on the ground
+    accuracy : number
+        size of raster cells (meter)
+    precision : number
+        time precision(s)
+    padding : number
+        padding time before and after sunrise and sunset
+    as_grids : bool
+        whether to convert the result into grids of TransBigData
+
+    Returns
+    -------
+    sunshine : numpy.ndarray
+        Sunshine hours of each cell, NaN for the cells not analysed (outside the roofs if roof is True,
+        inside the buildings otherwise). Only returned if as_grids is False
+    transform : tuple
+        Affine transform (a, b, c, d, e, f) of the raster. Only returned if as_grids is False
+    grids : GeoDataFrame
+        grids with `count`, `time` and `Hour` columns. Only returned if as_grids is True
+    '''
+    from .analysis import iter_sunshadows
+    lon, lat = buildings['geometry'].iloc[0].bounds[:2]
+    sunlighthour = day_length(day, lon, lat)
+
+    shape, transform, params = raster_params(
+        shapely.total_bounds(np.asarray(buildings['geometry'].values)), accuracy)
+    inside = rasterize_polygons(buildings['geometry'], shape, transform)
+    mask = inside if roof else ~inside
+
+    shadows = iter_sunshadows(
+        buildings, dates=[day], precision=precision, padding=padding, roof=roof)
+    counts = rasterize_shadowcoverage(
+        shadows, shape, transform, 'roof' if roof else 'ground')
+    if as_grids:
+        grids = raster_to_grids(counts, params, mask=mask)
+        grids['time'] = grids['count'].astype(float)*precision
+        grids['Hour'] = sunlighthour-grids['time']/3600
+        return grids
+    sunshine = sunlighthour-counts.astype(float)*precision/3600
+    sunshine[~mask] = np.nan
+    return sunshine, transform
@@ -0,0 +1,141 @@
+"""
+BSD 3-Clause License
+
+Copyright (c) 2022, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+import os
+import pandas as pd
+
+# 按日期分区，每个时刻在分区内保存为一个文件，文件名为时刻
+PARTITION_DATE_FORMAT = '%Y-%m-%d'
+PARTITION_TIME_FORMAT = '%H%M%S%f'
+
+
+def _partition_date(date):
+    return pd.Timestamp(date).strftime(PARTITION_DATE_FORMAT)
+
+
+def _partition_file(path, date, shadow_type):
+    date = pd.Timestamp(date)
+    return os.path.join(path, 'date='+date.strftime(PARTITION_DATE_FORMAT), 'type='+shadow_type,
+                        date.strftime(PARTITION_TIME_FORMAT)+'.parquet')
+
+
+def _check_geopandas():
+    import geopandas as gpd
+    if int(gpd.__version__.split('.')[0]) < 1:
+        raise ImportError(
+            "Saving shadows as GeoParquet requires geopandas>=1.0, run "
+            "the following code in cmd: pip install -U geopandas")
+
+
+def sunshadows_saved(path, date):
+    '''
+    Whether the shadows of the timestep are saved in the GeoParquet dataset.
+    The ground shadows are written last, so the timestep is complete if they exist.
+    '''
+    return os.path.exists(_partition_file(path, date, 'ground'))
+
+
+def write_sunshadows(shadows, path, date):
+    '''
+    Append the shadows of one timestep to a GeoParquet dataset partitioned by calendar `date` and `type`.
+    Each timestep is one file in its partitions with the timestamp in the `datetime` column.
+    The file is written to a temporary file and renamed, so that a timestep is either complete or absent.
+    Requires `pyarrow` and geopandas>=1.0.
+
+    Parameters
+    ----------
+    shadows : GeoDataFrame
+        Shadows of the timestep with the `type` column
+    path : str
+        Directory of the dataset
+    date : datetime
+        Datetime of the timestep
+    '''
+    _check_geopandas()
+    for shadow_type in ['roof', 'ground']:
+        shadow = shadows[shadows['type'] == shadow_type]
+        if len(shadow) == 0:
+            continue
+        file = _partition_file(path, date, shadow_type)
+        folder, name = os.path.split(file)
+        os.makedirs(folder, exist_ok=True)
+        # 分区只到日期，完整的时刻保存在 datetime 列
+        shadow = shadow.drop(columns=[col for col in ['date', 'type'] if col in shadow])
+        shadow['datetime'] = pd.Timestamp(date)
+        # 以.开头的临时文件读取时会被忽略
+        temp = os.path.join(folder, '.'+name+'.tmp')
+        shadow.reset_index(drop=True).to_parquet(temp, write_covering_bbox=True)
+        os.replace(temp, file)
+
+
+def read_sunshadows(path, start=None, end=None, bounds=None, shadow_type=None):
+    '''
+    Read the shadows saved by `cal_sunshadows(save_shadows=True, save_format='parquet')`.
+    Only the partitions in the time range and the row groups intersecting the bounds are read.
+    Requires `pyarrow` and geopandas>=1.0.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the dataset, `result/cityname/shadows`
+    start, end : datetime
+        Time range (inclusive) of the timesteps to read
+    bounds : list
+        [lon1, lat1, lon2, lat2], only read the shadows intersecting the bounding box
+    shadow_type : str
+        `roof` or `ground`, read both if None
+
+    Returns
+    -------
+    shadows : GeoDataFrame
+        Shadows with the `date` and `type` columns, in the order of the timesteps
+    '''
+    import geopandas as gpd
+    _check_geopandas()
+    filters = []
+    if start is not None:
+        filters.append(('date', '>=', _partition_date(start)))
+    if end is not None:
+        filters.append(('date', '<=', _partition_date(end)))
+    if shadow_type is not None:
+        filters.append(('type', '=', shadow_type))
+    shadows = gpd.read_parquet(path, filters=filters or None,
+                               bbox=None if bounds is None else tuple(bounds))
+    shadows['date'] = shadows['datetime']
+    shadows['type'] = shadows['type'].astype(str)
+    # 分区只到日期，再按完整的时刻筛选
+    if start is not None:
+        shadows = shadows[shadows['date'] >= pd.Timestamp(start)]
+    if end is not None:
+        shadows = shadows[shadows['date'] <= pd.Timestamp(end)]
+    shadows = shadows.drop(columns=[col for col in ['datetime', 'bbox'] if col in shadows])
+    shadows = shadows.sort_values(by=['date', 'type'], ascending=[True, False], kind='stable')
+    return shadows.reset_index(drop=True)
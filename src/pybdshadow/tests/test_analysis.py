@@ -1,40 +1,196 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import pytest
 import pybdshadow
 import geopandas as gpd
 from shapely.geometry import Polygon
 
 
+def get_buildings():
+    buildings = gpd.GeoDataFrame({
+        'height': [42, 9],
+        'geometry': [
+            Polygon([(139.698311, 35.533796),
+                    (139.698311,
+                        35.533642),
+                    (139.699075,
+                        35.533637),
+                    (139.699079,
+                        35.53417),
+                    (139.698891,
+                        35.53417),
+                    (139.698888,
+                        35.533794),
+                    (139.698311, 35.533796)]),
+            Polygon([(139.69799, 35.534175),
+                    (139.697988, 35.53389),
+                    (139.698814, 35.533885),
+                    (139.698816, 35.534171),
+                    (139.69799, 35.534175)])]})
+    return pybdshadow.bd_preprocess(buildings)
+
+
 class Testanalysis:
     def test_analysis(self):
-        buildings = gpd.GeoDataFrame({
-            'height': [42, 9],
-            'geometry': [
-                Polygon([(139.698311, 35.533796),
-                        (139.698311,
-                            35.533642),
-                        (139.699075,
-                            35.533637),
-                        (139.699079,
-                            35.53417),
-                        (139.698891,
-                            35.53417),
-                        (139.698888,
-                            35.533794),
-                        (139.698311, 35.533796)]),
-                Polygon([(139.69799, 35.534175),
-                        (139.697988, 35.53389),
-                        (139.698814, 35.533885),
-                        (139.698816, 35.534171),
-                        (139.69799, 35.534175)])]})
-
-        buildings = pybdshadow.bd_preprocess(buildings)
+        buildings = get_buildings()
         #分析
         date = '2022-01-01'
         shadows = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600)
         bdgrids = pybdshadow.cal_shadowcoverage(shadows,buildings,precision = 3600,accuracy=2)
         assert len(bdgrids)==1185
-        
+
         grids = pybdshadow.cal_sunshine(buildings)
         assert len(grids)==1882
-                                 
+
         sunshine = pybdshadow.cal_sunshine(buildings,accuracy='vector')
-        sunshine = pybdshadow.cal_sunshine(buildings,accuracy='vector',roof = True)
\ No newline at end of file
+        sunshine = pybdshadow.cal_sunshine(buildings,accuracy='vector',roof = True)
+
+    def test_sunshadows_n_jobs(self):
+        buildings = get_buildings()
+        date = '2022-01-01'
+        shadows = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(2) as executor:
+            shadows_parallel = pybdshadow.cal_sunshadows(
+                buildings,dates = [date],precision=3600,executor=executor)
+        assert list(shadows_parallel['date']) == list(shadows['date'])
+        assert np.allclose(shadows_parallel.area, shadows.area)
+
+        # 进程池，建筑与墙面在进程初始化时传入
+        shadows_parallel = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600,n_jobs=2)
+        assert list(shadows_parallel['date']) == list(shadows['date'])
+        assert list(shadows_parallel['type']) == list(shadows['type'])
+        assert np.allclose(shadows_parallel.area, shadows.area)
+
+    def test_iter_sunshadows(self):
+        buildings = get_buildings()
+        date = '2022-01-01'
+        shadows = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600)
+        bdgrids = pybdshadow.cal_shadowcoverage(shadows,buildings,precision = 3600,accuracy=2)
+        bdgrids_stream = pybdshadow.cal_shadowcoverage(
+            pybdshadow.iter_sunshadows(buildings,dates = [date],precision=3600),
+            buildings,precision = 3600,accuracy=2)
+        assert bdgrids_stream['time'].sum() == bdgrids['time'].sum()
+
+    def test_coverage_accumulator(self):
+        buildings = get_buildings()
+        date = '2022-01-01'
+        shadows = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600)
+        bdgrids = pybdshadow.cal_shadowcoverage(shadows,buildings,precision = 3600,accuracy=2)
+        accumulator = pybdshadow.ShadowCoverageAccumulator(bdgrids, precision=3600)
+        for date, shadow in shadows[shadows['type'] == 'roof'].groupby('date'):
+            accumulator.add(shadow)
+            accumulator.add(shadow)
+        assert accumulator.result()['time'].sum() == 2*bdgrids['time'].sum()
+
+    def test_raster(self):
+        buildings = get_buildings()
+        shadows = pybdshadow.cal_sunshadows(buildings,dates = ['2022-01-01'],precision=3600)
+        bdgrids = pybdshadow.cal_shadowcoverage(shadows,buildings,precision = 3600,accuracy=2)
+        sunshine, transform = pybdshadow.cal_sunshine_raster(buildings,accuracy=2,roof=True)
+        raster_grids = pybdshadow.cal_sunshine_raster(buildings,accuracy=2,roof=True,as_grids=True)
+        assert (~np.isnan(sunshine)).sum() == len(raster_grids)
+        assert np.allclose(np.nansum(sunshine), raster_grids['Hour'].sum())
+        assert set(zip(raster_grids['LONCOL'],raster_grids['LATCOL'])) <= \
+            set(zip(bdgrids['LONCOL'],bdgrids['LATCOL']))
+
+    def test_shadow_cache(self):
+        pytest.importorskip('pyarrow')
+        buildings = get_buildings()
+        date = '2022-01-01'
+        shadows = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600)
+        with tempfile.TemporaryDirectory() as path:
+            cache = pybdshadow.ShadowCache(path)
+            shadows_cached = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600,cache=cache)
+            assert cache.info()['size'] == shadows['date'].nunique()
+            shadows_cached = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600,cache=cache)
+            assert cache.info()['hits'] == shadows['date'].nunique()
+            assert list(shadows_cached['date']) == list(shadows['date'])
+            assert np.allclose(shadows_cached.area, shadows.area)
+            moved = pybdshadow.bd_preprocess(buildings.assign(height=buildings['height']+1))
+            pybdshadow.cal_sunshadows(moved,dates = [date],precision=3600,cache=cache)
+            assert cache.info()['size'] == 2*shadows['date'].nunique()
+            cache.max_size = 0
+            cache.evict()
+            assert cache.info()['size'] == 0
+
+            # 只在第一次写入与超出上限时扫描目录
+            cache = pybdshadow.ShadowCache(os.path.join(path, 'evict'))
+            scans = []
+            evict = cache.evict
+            cache.evict = lambda: scans.append(1) or evict()
+            for key in ['a', 'b', 'c']:
+                cache.put(key, shadows)
+            assert len(scans) == 1
+            cache.max_size = cache.info()['bytes']
+            cache.put('d', shadows)
+            assert len(scans) == 2
+            assert cache.info()['size'] == 3
+            assert 'a' not in cache
+
+    def test_parquet_storage(self):
+        pytest.importorskip('pyarrow')
+        pytest.importorskip('geopandas', minversion='1.0')
+        buildings = get_buildings()
+        date = '2022-01-01'
+        shadows = pybdshadow.cal_sunshadows(buildings,dates = [date],precision=3600)
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as path:
+            os.chdir(path)
+            try:
+                pybdshadow.cal_sunshadows(buildings,cityname='test',dates = [date],precision=3600,
+                                          save_shadows=True,save_format='parquet')
+                # 按日期分区，每个时刻一个文件
+                assert sorted(os.listdir('result/test/shadows')) == \
+                    ['date='+day for day in sorted(shadows['date'].dt.strftime('%Y-%m-%d').unique())]
+                saved = pybdshadow.read_sunshadows('result/test/shadows')
+                assert list(saved['date']) == list(shadows['date'])
+                assert np.allclose(saved.area, shadows.area)
+                start = shadows['date'].iloc[-1]
+                assert len(pybdshadow.read_sunshadows('result/test/shadows', start=start)) == \
+                    (shadows['date'] == start).sum()
+                end = shadows['date'].iloc[0]
+                assert len(pybdshadow.read_sunshadows('result/test/shadows', end=end)) == \
+                    (shadows['date'] == end).sum()
+                roof_saved = pybdshadow.read_sunshadows('result/test/shadows', shadow_type='roof',
+                                                        bounds=buildings.total_bounds)
+                assert set(roof_saved['type']) == {'roof'}
+            finally:
+                os.chdir(cwd)
+
+    def test_horizon(self):
+        buildings = get_buildings()
+        sunshine, transform = pybdshadow.cal_sunshine_raster(buildings,accuracy=2,precision=300)
+        sunshine_horizon, transform = pybdshadow.cal_sunshine_horizon(buildings,accuracy=2,precision=300)
+        assert np.array_equal(np.isnan(sunshine), np.isnan(sunshine_horizon))
+        assert np.nanmax(np.abs(sunshine-sunshine_horizon)) < 0.25
+
+        # 南侧10米处高10米的墙，正南方向仰角45度
+        walls = np.array([[[-5, -10], [5, -10]]])
+        horizon = pybdshadow.cal_horizon([[0, 0], [0, -20]], walls, [10], azimuth_bins=3)
+        assert np.isclose(horizon[0, 1], np.pi/4)
+        assert np.allclose(np.delete(horizon[0], 1), 0)
+        assert np.allclose(horizon[1], 0)
+
+        # 分批计算与只计算部分方位角分区
+        from pybdshadow import horizon as horizon_module
+        rng = np.random.default_rng(0)
+        points = rng.uniform(0, 100, (50, 2))
+        walls = rng.uniform(0, 100, (30, 2, 2))
+        wall_height = rng.uniform(5, 30, 30)
+        horizon = pybdshadow.cal_horizon(points, walls, wall_height, azimuth_bins=36)
+        chunk_size = horizon_module.HORIZON_CHUNK_SIZE
+        horizon_module.HORIZON_CHUNK_SIZE = 40
+        try:
+            horizon_chunked = pybdshadow.cal_horizon(points, walls, wall_height, azimuth_bins=36, bins=[3, 4, 20])
+        finally:
+            horizon_module.HORIZON_CHUNK_SIZE = chunk_size
+        assert np.array_equal(horizon_chunked[:, [3, 4, 20]], horizon[:, [3, 4, 20]])
+        assert np.allclose(np.delete(horizon_chunked, [3, 4, 20], axis=1), 0)
+
+        # 地平线以下的太阳不计入相邻分区
+        samples = pd.DataFrame({'azimuth': [-2.5, -1], 'altitude': [0.5, -0.1], 'weight': [2, 1]})
+        sunlit = horizon_module.integrate_horizon(np.array([[0.6, 0, 0, 0], [0, 0, 0, 0]]), samples)
+        assert np.allclose(sunlit, [0, 2])
@@ -0,0 +1,156 @@
+import numpy as np
+from shapely.geometry import Polygon
+from pybdshadow import facade
+
+
+class Testfacade:
+    def test_projection_on_walls(self):
+        # 目标墙面位于 x=0 平面，法向量朝 -x，太阳在西侧
+        target = np.array([[0, 0, 0], [0, 0, 10], [0, 10, 10], [0, 10, 0], [0, 0, 0]], dtype=float)
+        plane = np.array(facade.calculate_wall_plane(target))
+        normal = facade.calculate_wall_normal_vector(target)
+        sun_vec = facade.sun_light_vector(np.pi/2, np.pi/6)
+        # 墙面前方、背面与跨越平面的遮挡墙面
+        front = target+[-5, 0, 0]
+        behind = target+[5, 0, 0]
+        across = target+[[-5, 0, 0], [-5, 0, 0], [5, 0, 0], [5, 0, 0], [-5, 0, 0]]
+        walls = np.array([front, behind, across])
+        intersections, valid = facade.projection_on_walls(
+            np.tile(plane, (3, 1)), sun_vec, walls, np.tile(normal, (3, 1)))
+        assert list(valid) == [True, False, True]
+        single = facade.projection_on_wall_single(plane, sun_vec, front, normal)
+        assert np.allclose(intersections[0][:5], single)
+        assert np.allclose(intersections[0][5], single[0])
+        # 跨越平面的墙面裁剪掉背面部分后投影
+        drop = 5*np.tan(np.pi/6)
+        assert np.allclose(intersections[2][:4], [[0, 0, -drop], [0, 0, 10-drop], [0, 5, 10], [0, 5, 0]])
+        assert np.allclose(intersections[2][4:], intersections[2][0])
+
+        # 与目标墙面共用顶点的墙面，顶点的舍入误差不影响投影
+        side = np.array([[0, 10, 0], [-5, 10, 0], [-5, 10, 10], [0, 10, 10], [0, 10, 0]], dtype=float)
+        shifted = side+[1e-12, 0, 0]
+        intersections, valid = facade.projection_on_walls(
+            np.tile(plane, (2, 1)), sun_vec, np.array([side, shifted]), np.tile(normal, (2, 1)))
+        assert valid.all()
+        assert np.allclose(intersections[0], intersections[1])
+
+        # 太阳光与平面平行
+        _, valid = facade.projection_on_walls(plane, [0, 1, 0], front[np.newaxis], normal)
+        assert not valid[0]
+
+    def test_occluder_pairs(self):
+        # 墙面坐标与 get_walls 一致：前两个点为底边，后两个点为顶边，法向量朝 -x
+        target = np.array([[0, 10, 0], [0, 0, 0], [0, 0, 10], [0, 10, 10], [0, 10, 0]], dtype=float)
+        walls = np.array([target, target+[-5, 0, 0], target+[5, 0, 0], target+[0, 100, 0]])
+        normals = np.array([facade.calculate_wall_normal_vector(wall) for wall in walls])
+        sun_vec = facade.sun_light_vector(np.pi/2, np.pi/6)
+        target_index, occluder_index, face = facade.occluder_pairs(walls, normals, sun_vec)
+        assert face.all()
+        assert set(zip(target_index, occluder_index)) == {(0, 1), (2, 0), (2, 1)}
+
+        # 太阳在地平线以下
+        target_index, occluder_index, _ = facade.occluder_pairs(walls, normals, -sun_vec)
+        assert len(target_index) == len(occluder_index) == 0
+
+    def test_wall_local_frames(self):
+        # 与x轴成45度的墙面，法向量在x与y方向上分量相等
+        wall = np.array([[0, 0, 0], [10, 10, 0], [10, 10, 10], [0, 0, 10], [0, 0, 0]], dtype=float)
+        frame = facade.wall_local_frames([wall])[0]
+        assert np.allclose(frame[3], facade.calculate_wall_normal_vector(wall))
+        assert np.allclose(facade.from_wall_local(facade.to_wall_local(wall, frame), frame), wall)
+
+        # 墙面右上角被遮挡
+        shadow = np.array([[5, 5, 5], [15, 15, 5], [15, 15, 15], [5, 5, 15], [5, 5, 5]], dtype=float)
+        overlap = facade.cal_wall_overlap(wall, shadow, frame=frame)
+        assert np.allclose(overlap[:, 0], overlap[:, 1])
+        assert np.isclose(Polygon(facade.to_wall_local(overlap, frame)).area, 25*np.sqrt(2))
+        union = facade.cal_multiple_wall_union([wall, shadow])
+        assert len(union) == 1
+        assert np.isclose(Polygon(facade.to_wall_local(union[0].exterior.coords, frame)).area, 175*np.sqrt(2))
+        # 不相连的并集按多边形分别返回
+        apart = wall+[20, 20, 0]
+        union = facade.cal_multiple_wall_union([wall, apart], frame)
+        assert len(union) == 2
+        assert np.allclose([Polygon(facade.to_wall_local(part.exterior.coords, frame)).area for part in union],
+                           100*np.sqrt(2))
+
+        # 局部坐标系中的面积，退化为线段的多边形面积为0
+        line = Polygon([[0, 0, 0], [5, 5, 0], [10, 10, 0], [0, 0, 0]])
+        area = facade._local_area([Polygon(wall), Polygon(shadow), line], np.array([frame]*3))
+        assert np.allclose(area, [100*np.sqrt(2), 100*np.sqrt(2), 0])
+
+    def test_ray_prism_occlusion(self):
+        # 10米见方、高20米的建筑，太阳在正西方向，高度角45度
+        footprints = np.array([Polygon([(0, 0), (10, 0), (10, 10), (0, 10)])])
+        heights = np.array([20.])
+        direction = -facade.sun_light_vector(np.pi/2, np.pi/4)
+        points = np.array([[15, 5, 0], [15, 5, 30], [35, 5, 0], [15, 20, 0], [29.9, 5, 0], [30.1, 5, 0]])
+        blocked = facade.ray_prism_occlusion(points, direction, footprints, heights)
+        assert list(blocked) == [True, False, False, False, True, False]
+        # 带内环的建筑，内院中的点可以被对面的墙遮挡
+        courtyard = np.array([Polygon([(0, 0), (30, 0), (30, 30), (0, 30)], [[(10, 10), (20, 10), (20, 20), (10, 20)]])])
+        blocked = facade.ray_prism_occlusion(np.array([[15, 15, 0], [15, 15, 25]]), direction, courtyard, heights)
+        assert list(blocked) == [True, False]
+        blocked = facade.ray_prism_occlusion(points, direction, footprints, heights, mask=np.zeros(6, dtype=bool))
+        assert not blocked.any()
+
+    def test_cal_sunshine_facade_samples(self):
+        import geopandas as gpd
+        import pybdshadow
+        buildings = gpd.GeoDataFrame({'building_id': [0, 1], 'height': [10., 40.]}, geometry=[
+            Polygon([(139.6990, 35.5300), (139.6992, 35.5300), (139.6992, 35.5302), (139.6990, 35.5302)]),
+            Polygon([(139.6994, 35.5300), (139.6996, 35.5300), (139.6996, 35.5302), (139.6994, 35.5302)])],
+            crs='EPSG:4326')
+        samples = pybdshadow.cal_sunshine_facade(buildings, '2022-06-21', accuracy=2)
+        walls = facade.get_walls(buildings)
+        assert set(zip(samples['building_id'], samples['target_wall_id'])) == \
+            set(zip(walls['building_id'], walls['wall_id']))
+        assert (samples['Hour'] >= 0).all()
+        # 采样点位于格子中心，面积之和为墙面面积
+        for _, wall in samples.groupby(['building_id', 'target_wall_id']):
+            assert np.isclose(wall['sample_area'].sum(),
+                              (wall['u'].min()+wall['u'].max())*(wall['v'].min()+wall['v'].max()))
+        # 低矮建筑朝东的墙面被高层建筑遮挡
+        hours = samples.groupby(['building_id', 'target_wall_id'])['Hour'].mean()
+        assert hours[0].min() < hours[1].min()
+
+        # 外环顺时针的内院建筑，内院中的矮建筑不被内院的底面遮挡
+        from pybdshadow.utils import _local_scale
+        kx, ky = _local_scale(35.53)
+        outer = [(139.7+x/kx, 35.53+y/ky) for x, y in [(0, 0), (0, 60), (60, 60), (60, 0)]]
+        inner = [(139.7+x/kx, 35.53+y/ky) for x, y in [(20, 20), (40, 20), (40, 40), (20, 40)]]
+        small = [(139.7+x/kx, 35.53+y/ky) for x, y in [(28, 28), (32, 28), (32, 32), (28, 32)]]
+        buildings = gpd.GeoDataFrame({'building_id': [0, 1], 'height': [10., 3.]},
+                                     geometry=[Polygon(outer, [inner]), Polygon(small)], crs='EPSG:4326')
+        samples = pybdshadow.cal_sunshine_facade(buildings, '2022-06-21', accuracy=1)
+        solid = pybdshadow.cal_sunshine_facade(buildings.assign(geometry=[Polygon(outer), Polygon(small)]),
+                                               '2022-06-21', accuracy=1)
+        assert samples.loc[samples['building_id'] == 1, 'Hour'].sum() > \
+            solid.loc[solid['building_id'] == 1, 'Hour'].sum()
+
+    def test_cal_sunshine_facade_vector_samples(self):
+        import geopandas as gpd
+        import pybdshadow
+        from pybdshadow.utils import _local_scale
+        kx, ky = _local_scale(35.53)
+
+        def box(x0, y0, x1, y1):
+            return Polygon([(139.7+x0/kx, 35.53+y0/ky), (139.7+x1/kx, 35.53+y0/ky),
+                            (139.7+x1/kx, 35.53+y1/ky), (139.7+x0/kx, 35.53+y1/ky)])
+
+        def area(polygon):
+            coords = np.array(polygon.exterior.coords)
+            return np.linalg.norm(np.cross(coords[:-1], coords[1:]).sum(axis=0))/2
+        # 高层建筑跨越低矮建筑北墙所在的平面
+        buildings = gpd.GeoDataFrame({'building_id': [0, 1], 'height': [10., 40.]},
+                                     geometry=[box(0, 0, 20, 20), box(30, 10, 50, 40)], crs='EPSG:4326')
+        vector = pybdshadow.cal_sunshine_facade(buildings, '2022-06-21')
+        vector['area'] = vector['geometry'].apply(area)
+        vector['weighted'] = vector['area']*vector['Hour']
+        vector = vector.groupby(['building_id', 'target_wall_id'])[['weighted', 'area']].sum()
+        samples = pybdshadow.cal_sunshine_facade(buildings, '2022-06-21', accuracy=0.5)
+        samples['weighted'] = samples['sample_area']*samples['Hour']
+        samples = samples.groupby(['building_id', 'target_wall_id'])[['weighted', 'sample_area']].sum()
+        # 两种方法每面墙的平均日照时长一致
+        assert np.allclose(vector['weighted']/vector['area'],
+                           samples['weighted']/samples['sample_area'], atol=0.05)
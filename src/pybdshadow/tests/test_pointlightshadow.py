@@ -43,4 +43,12 @@ class Testpointlightshadow:
         (139.69986068965517, 35.533247413793106),
         (139.69854344827584, 35.53325603448276),
         (139.698311, 35.533642)]
-        assert np.allclose(result,truth)
\ No newline at end of file
+        assert np.allclose(result,truth)
+
+        building_set = pybdshadow.BuildingSet.from_geodataframe(buildings)
+        shadows_set = pybdshadow.bdshadow_pointlight(building_set,pointlon,pointlat,pointheight)
+        assert list(shadows_set['building_id']) == list(shadows['building_id'])
+        assert np.allclose(shadows_set.area, shadows.area)
+        walls = pybdshadow.bdshadow_pointlight(buildings,pointlon,pointlat,pointheight,merge=False,ground=10)
+        assert set(walls['building_id']) == {buildings['building_id'].iloc[0]}
+        assert walls['height'].max() == 32
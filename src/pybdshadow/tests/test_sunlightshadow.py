@@ -54,3 +54,102 @@ class Testsunlightshadow:
 
         pybdshadow.show_bdshadow(buildings=buildings,
                                  shadows=buildingshadow)
+
+    def test_calSunShadow_batch(self):
+        from pybdshadow.pybdshadow import calSunShadow_vector, calSunShadow_batch
+        shape = np.array([[[139.698311, 35.533796], [139.698311, 35.533642]],
+                          [[139.698311, 35.533642], [139.699075, 35.533637]]])
+        sunPositions = np.array([[0.07, 0.54], [0.34, 0.50], [-0.8, 0.33]])
+        shadows = calSunShadow_batch(shape, np.array([42, 9]), sunPositions)
+        assert shadows.shape == (3, 2, 5, 2)
+        for i, (azimuth, altitude) in enumerate(sunPositions):
+            shadow = calSunShadow_vector(
+                shape, np.array([42, 9]), {'azimuth': azimuth, 'altitude': altitude})
+            assert np.allclose(shadows[i], shadow)
+        assert np.allclose(shadows[:, :, 0:2], shape)
+
+    def test_bdshadow_sunlight_tiled(self):
+        buildings = gpd.GeoDataFrame({
+            'height': [42, 9],
+            'geometry': [
+                Polygon([(139.698311, 35.533796), (139.698311, 35.533642), (139.699075, 35.533637),
+                         (139.699079, 35.53417), (139.698891, 35.53417), (139.698888, 35.533794),
+                         (139.698311, 35.533796)]),
+                Polygon([(139.69799, 35.534175), (139.697988, 35.53389), (139.698814, 35.533885),
+                         (139.698816, 35.534171), (139.69799, 35.534175)])]})
+        buildings = pybdshadow.bd_preprocess(buildings)
+        date = pd.to_datetime('2015-01-01 03:45:33.959797119')
+
+        shadows = pybdshadow.bdshadow_sunlight(buildings, date, roof=True)
+        tiled = pybdshadow.bdshadow_sunlight_tiled(
+            buildings, date, roof=True, tile_size=20, n_jobs=1)
+        assert list(tiled['type']) == list(shadows['type'])
+        assert list(tiled['building_id']) == list(shadows['building_id'])
+        assert np.allclose(tiled.area, shadows.area, rtol=1e-4)
+        shadows = pybdshadow.bdshadow_sunlight(buildings, date, include_building=False)
+        tiled = pybdshadow.bdshadow_sunlight_tiled(
+            pybdshadow.BuildingSet.from_geodataframe(buildings), date, include_building=False,
+            tile_size=20, n_jobs=1)
+        assert list(tiled['building_id']) == list(shadows['building_id'])
+        assert np.allclose(tiled.area, shadows.area, rtol=1e-4)
+
+        # 长条建筑超出所在分块，其东端南侧的高层建筑在缓冲区之外仍需遮挡其屋顶
+        from pybdshadow.utils import _local_scale
+        kx, ky = _local_scale(35.53)
+        def box(x0, y0, x1, y1):
+            return Polygon([(139.7+x0/kx, 35.53+y0/ky), (139.7+x1/kx, 35.53+y0/ky),
+                            (139.7+x1/kx, 35.53+y1/ky), (139.7+x0/kx, 35.53+y1/ky)])
+        buildings = pybdshadow.bd_preprocess(gpd.GeoDataFrame({
+            'height': [5, 60], 'geometry': [box(0, 0, 400, 20), box(380, -30, 400, -10)]}))
+        date = pd.to_datetime('2022-01-01 03:00:00')
+        shadows = pybdshadow.bdshadow_sunlight(buildings, date, roof=True)
+        tiled = pybdshadow.bdshadow_sunlight_tiled(
+            buildings, date, roof=True, tile_size=50, n_jobs=1)
+        assert (shadows['type'] == 'roof').any()
+        assert list(tiled['type']) == list(shadows['type'])
+        assert np.allclose(tiled.area, shadows.area, rtol=1e-4)
+
+    def test_sweep_shadows(self):
+        from pybdshadow.pybdshadow import sweep_shadows
+        from pybdshadow.utils import union_by_group
+        # 凸的矩形与凹的L形建筑
+        building = gpd.GeoDataFrame({'building_id': [0, 1], 'height': [20, 30]}, geometry=[
+            Polygon([(139.6980, 35.5330), (139.6983, 35.5330), (139.6983, 35.5332), (139.6980, 35.5332)]),
+            Polygon([(139.6990, 35.5330), (139.6990, 35.5334), (139.6991, 35.5334),
+                     (139.6991, 35.5331), (139.6994, 35.5331), (139.6994, 35.5330)])])
+        building_set = pybdshadow.BuildingSet.from_geodataframe(building)
+        sunPosition = {'azimuth': 0.8, 'altitude': 0.4}
+        shadowShape = pybdshadow.calSunShadow_vector(
+            building_set.walls, building_set.wall_height, sunPosition)
+        swept = sweep_shadows(building_set, shadowShape, sunPosition)
+        union = union_by_group(pd.concat([gpd.GeoDataFrame(
+            {'building_id': building_set.wall_building_id}, geometry=[Polygon(shape) for shape in shadowShape]),
+            building]), 'building_id')
+        assert list(swept['building_id']) == [0, 1]
+        assert np.allclose(swept.area, union.area)
+        assert np.allclose(swept.symmetric_difference(union).area, 0, atol=1e-14)
+
+    def test_buildingset(self):
+        from pybdshadow.walls import get_wall_array
+        buildings = gpd.GeoDataFrame({'building_id': [0, 1, 2], 'height': [20, 30, 5]}, geometry=[
+            Polygon([(139.6980, 35.5330), (139.6983, 35.5330), (139.6983, 35.5332), (139.6980, 35.5332)]),
+            Polygon([(139.6990, 35.5330), (139.6990, 35.5334), (139.6991, 35.5334),
+                     (139.6991, 35.5331), (139.6994, 35.5331), (139.6994, 35.5330)]),
+            Polygon([(139.6985, 35.5336), (139.6987, 35.5336), (139.6987, 35.5338), (139.6985, 35.5338)])])
+        building_set = pybdshadow.BuildingSet.from_geodataframe(buildings, ground=10)
+        assert len(building_set) == 2
+        assert list(building_set.height) == [10, 20]
+        above = buildings[buildings['height'] > 10]
+        walls, building_index, _ = get_wall_array(above['geometry'])
+        assert np.allclose(building_set.walls, walls)
+        assert list(building_set.wall_building_id) == list(above['building_id'].values[building_index])
+        # 外环坐标按建筑连续存放
+        assert list(building_set.ring_offsets) == [0, 5, 12]
+        assert np.allclose(building_set.coords[5:12], buildings['geometry'].iloc[1].exterior.coords)
+
+        date = pd.to_datetime('2022-01-01 03:00:00')
+        shadows = pybdshadow.bdshadow_sunlight(buildings, date, roof=True, ground=10)
+        shadows_set = pybdshadow.bdshadow_sunlight(
+            pybdshadow.BuildingSet.from_geodataframe(buildings), date, roof=True, ground=10)
+        assert list(shadows_set['building_id']) == list(shadows['building_id'])
+        assert np.allclose(shadows_set.area, shadows.area)
@@ -0,0 +1,98 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pybdshadow import utils
+
+
+class Testutils:
+    def test_transformer_cache(self):
+        cache = utils.TransformerCache(maxsize=2)
+        forward, inverse = cache.get(120.5, 30.5)
+        assert cache.get(120.5000000001, 30.5) == (forward, inverse)
+        cache.get(121, 31)
+        cache.get(122, 32)
+        assert cache.info() == {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2}
+
+        lonlat = np.array([[[120, 30], [121, 31]], [[120, 30], [121, 31]]])
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(
+                lambda i: utils.aeqd2lonlat(utils.lonlat2aeqd(lonlat, 120.5, 30.5), 120.5, 30.5), range(8)))
+        for result in results:
+            assert np.allclose(result, lonlat)
+
+    def test_local_projection(self):
+        lonlat = np.array([[[139.698311, 35.533796], [139.699079, 35.53417]]])
+        local = utils.lonlat2aeqd(lonlat, 139.6987, 35.5339, backend='local')
+        aeqd = utils.lonlat2aeqd(lonlat, 139.6987, 35.5339, backend='pyproj')
+        assert np.abs(local-aeqd).max() < 0.01
+        assert np.allclose(utils.aeqd2lonlat(local, 139.6987, 35.5339, backend='local'),
+                           lonlat, rtol=0, atol=1e-12)
+
+        assert utils.select_projection(lonlat, 139.6987, 35.5339, 'local') == 'local'
+        far = np.array([[[139.8, 35.6]]])
+        assert utils.select_projection(far, 139.6987, 35.5339, 'local') == 'pyproj'
+        # 全局设置为局部投影时，超出范围的坐标仍使用pyproj
+        far_aeqd = utils.lonlat2aeqd(far, 139.6987, 35.5339, backend='pyproj')
+        backend = utils.PROJECTION_BACKEND
+        utils.set_projection_backend('local')
+        try:
+            assert np.allclose(utils.lonlat2aeqd(far, 139.6987, 35.5339), far_aeqd)
+            assert np.allclose(utils.aeqd2lonlat(far_aeqd, 139.6987, 35.5339), far)
+            assert np.allclose(utils.lonlat2aeqd(lonlat, 139.6987, 35.5339), local)
+        finally:
+            utils.set_projection_backend(backend)
+
+    def test_union_by_group(self):
+        import geopandas as gpd
+        from shapely.geometry import box
+        gdf = gpd.GeoDataFrame({'id': [2, 1, 2, 2, 3]},
+                               geometry=[box(0, 0, 1, 1), box(5, 5, 6, 6), box(0.5, 0, 2, 1),
+                                         box(1.5, 0, 3, 1), box(9, 9, 10, 10)])
+        union = utils.union_by_group(gdf, 'id')
+        assert list(union['id']) == [1, 2, 3]
+        assert np.allclose(union.area, [1, 3, 1])
+        assert union.geometry.iloc[1].equals(box(0, 0, 3, 1))
+
+    def test_ephemeris(self):
+        import pandas as pd
+        from suncalc import get_position
+        from pybdshadow import ephemeris
+        days = ['2022-01-01', '2022-06-21']
+        sunrise, sunset = ephemeris.sun_times(days, 139.7, 35.5)
+        assert np.array_equal(ephemeris.sun_times(days[::-1], 139.7, 35.5)[0], sunrise[::-1])
+        assert 9 < ephemeris.day_length(days[0], 139.7, 35.5) < 10
+        table = ephemeris.sun_table(139.7, 35.5, days, precision=600)
+        assert len(table) == np.sum(-(-(sunset-sunrise-3600*10**9)//(600*10**9)))
+        position = get_position(table['datetime'].iloc[10], 139.7, 35.5)
+        assert np.isclose(table['altitude'].iloc[10], position['altitude'])
+        date = pd.Timestamp('2022-01-01 12:00').tz_localize('Asia/Tokyo')
+        assert np.isclose(ephemeris.sun_position(date, 139.7, 35.5)['azimuth'],
+                          ephemeris.sun_position('2022-01-01 03:00', 139.7, 35.5)['azimuth'])
+        assert np.isclose(ephemeris.sun_position('2022-01-01 03:00', 139.7, 35.5)['altitude'],
+                          ephemeris.sun_position(['2022-01-01 03:00'], 139.7, 35.5)['altitude'][0])
+
+    def test_stage_profiler(self):
+        import pandas as pd
+        import geopandas as gpd
+        from shapely.geometry import Polygon
+        import pybdshadow
+        from pybdshadow.profiling import stage
+        buildings = gpd.GeoDataFrame({'building_id': [0, 1], 'height': [20, 30]}, geometry=[
+            Polygon([(139.6980, 35.5330), (139.6983, 35.5330), (139.6983, 35.5332), (139.6980, 35.5332)]),
+            Polygon([(139.6985, 35.5330), (139.6988, 35.5330), (139.6988, 35.5332), (139.6985, 35.5332)])])
+        date = pd.to_datetime('2022-01-01 03:00:00')
+        records = []
+        with pybdshadow.StageProfiler(memory=True, callback=records.append) as profiler:
+            pybdshadow.bdshadow_sunlight(buildings, date, roof=True)
+        report = profiler.to_dict()
+        assert list(report)[0] == 'bdshadow_sunlight'
+        assert report['bdshadow_sunlight/wall_shadows']['count'] == 8
+        assert report['bdshadow_sunlight/roof/occluders']['calls'] == 1
+        assert report['bdshadow_sunlight']['self_time'] <= report['bdshadow_sunlight']['time']
+        assert len(records) == len(profiler.records)
+        frame = profiler.to_dataframe()
+        assert list(frame.columns) == ['stage', 'calls', 'time', 'self_time', 'count', 'peak_memory']
+        assert (frame['peak_memory'] >= 0).all()
+        # 未启用时不记录
+        assert stage('anything').__class__.__name__ == 'nullcontext'
+        pybdshadow.bdshadow_sunlight(buildings, date)
+        assert len(profiler.records) == len(records)
@@ -0,0 +1,25 @@
+import numpy as np
+from shapely.geometry import Polygon
+from pybdshadow.walls import get_wall_array, silhouette_walls
+
+
+class Testwalls:
+    def test_get_wall_array(self):
+        geometry = [Polygon([(0, 0), (1, 0), (1, 1), (0, 0)]),
+                    Polygon([(2, 2), (3, 2), (3, 3), (2, 3), (2, 2)])]
+        walls, building_index, wall_id = get_wall_array(geometry)
+        assert walls.shape == (7, 2, 2)
+        assert list(building_index) == [0, 0, 0, 1, 1, 1, 1]
+        assert list(wall_id) == [0, 1, 2, 0, 1, 2, 3]
+        assert np.allclose(walls[3], [[2, 2], [3, 2]])
+        assert np.allclose(walls[:, 1][:-1][building_index[:-1] == building_index[1:]],
+                           walls[:, 0][1:][building_index[:-1] == building_index[1:]])
+
+    def test_silhouette_walls(self):
+        # 逆时针与顺时针的正方形，太阳在正南，阴影朝北
+        geometry = [Polygon([(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]),
+                    Polygon([(2, 0), (2, 1), (3, 1), (3, 0), (2, 0)])]
+        walls, building_index, _ = get_wall_array(geometry)
+        mask = silhouette_walls(walls, building_index, {'azimuth': 0, 'altitude': 0.5})
+        assert mask.sum() == 2
+        assert np.allclose(walls[mask][:, :, 1], 1)
@@ -30,6 +30,8 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import threading
+from collections import OrderedDict
 import numpy as np
 import shapely
 import geopandas as gpd
@@ -48,7 +50,152 @@ def make_clockwise(polygon):
     else:
         return Polygon(list(polygon.exterior.coords)[::-1])
 
-def lonlat2aeqd(lonlat, center_lon, center_lat):
+class TransformerCache:
+    '''
+    Thread-safe LRU cache of the transformers between WGS84 and azimuthal equidistant projections.
+
+    The projection center is rounded to `decimals` digits, and the rounded center is used to build the projection,
+    so that the forward and inverse transformers of a cache entry always match.
+    pyproj transformers are thread-safe (pyproj>=3.1), so cached entries are shared between threads.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of projection centers kept in the cache.
+    decimals : int
+        Number of decimals the projection center is rounded to.
+    '''
+
+    def __init__(self, maxsize=128, decimals=6):
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, center_lon, center_lat):
+        '''
+        Get the (forward, inverse) transformers of the projection centered at the given point.
+        '''
+        key = (round(float(center_lon), self.decimals),
+               round(float(center_lat), self.decimals))
+        with self._lock:
+            transformers = self._cache.get(key)
+            if transformers is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return transformers
+            self.misses += 1
+
+        epsg = CRS.from_proj4("+proj=aeqd +lat_0="+str(key[1]) +
+                              " +lon_0="+str(key[0])+" +datum=WGS84")
+        transformers = (Transformer.from_crs("EPSG:4326", epsg, always_xy=True),
+                        Transformer.from_crs(epsg, "EPSG:4326", always_xy=True))
+        with self._lock:
+            transformers = self._cache.setdefault(key, transformers)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return transformers
+
+    def info(self):
+        '''
+        Cache statistics, including the number of hits, misses and cached projection centers.
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._cache), 'maxsize': self.maxsize}
+
+    def clear(self):
+        '''
+        Remove all cached transformers and reset the statistics.
+        '''
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+aeqd_transformers = TransformerCache()
+
+# projection backend used when no backend is given, see `set_projection_backend`
+PROJECTION_BACKEND = 'pyproj'
+# maximum distance (meter) from the projection center allowed for the local backend
+LOCAL_PROJECTION_MAX_DISTANCE = 5000
+
+
+def set_projection_backend(backend):
+    '''
+    Set the default projection backend of `lonlat2aeqd` and `aeqd2lonlat`.
+
+    Parameters
+    ----------
+    backend : str
+        `pyproj` for the azimuthal equidistant projection of pyproj,
+        or `local` for the local equirectangular (east-north) projection computed with NumPy.
+
+        The local backend scales longitude and latitude differences with the WGS84 radii of curvature at the center.
+        It is exactly invertible, and compared with the azimuthal equidistant projection,
+        the relative error of a shadow offset at distance d from the center is about d*|tan(lat0)|/R (R = 6371 km),
+        e.g. 6 cm for a 100 m shadow 5 km away from the center at 35°N.
+        Coordinates farther than `LOCAL_PROJECTION_MAX_DISTANCE` from the center fall back to pyproj
+        in `lonlat2aeqd`, `aeqd2lonlat` and `select_projection`.
+    '''
+    global PROJECTION_BACKEND
+    if backend not in ('pyproj', 'local'):
+        raise ValueError("Projection backend should be 'pyproj' or 'local'")
+    PROJECTION_BACKEND = backend
+
+
+def _local_scale(center_lat):
+    # 中心点处经度、纬度每度对应的距离（米），WGS84椭球
+    a = 6378137.0
+    e2 = 0.00669437999014
+    sinlat = np.sin(np.radians(center_lat))
+    w = 1-e2*sinlat**2
+    kx = a/np.sqrt(w)*np.cos(np.radians(center_lat))*np.pi/180
+    ky = a*(1-e2)/w**1.5*np.pi/180
+    return kx, ky
+
+
+def select_projection(lonlat, center_lon, center_lat, backend=None):
+    '''
+    Decide the projection backend for the given coordinates.
+
+    The `local` backend falls back to `pyproj` when any coordinate is farther than
+    `LOCAL_PROJECTION_MAX_DISTANCE` from the center.
+    The returned backend should be used for both the forward and the inverse projection.
+
+    Parameters
+    ----------
+    lonlat : numpy.ndarray
+        Longitude and latitude in degrees, the last dimension is for longitude and latitude.
+    center_lon, center_lat : float
+        Center of the projection.
+    backend : str
+        `pyproj` or `local`, default is the backend set by `set_projection_backend`.
+
+    Returns
+    -------
+    backend : str
+        `pyproj` or `local`
+    '''
+    if backend is None:
+        backend = PROJECTION_BACKEND
+    if backend not in ('pyproj', 'local'):
+        raise ValueError("Projection backend should be 'pyproj' or 'local'")
+    if backend == 'local':
+        lonlat = np.asarray(lonlat).reshape((-1, 2))
+        kx, ky = _local_scale(center_lat)
+        distance = np.hypot((lonlat[:, 0]-center_lon)*kx,
+                            (lonlat[:, 1]-center_lat)*ky)
+        if len(distance) > 0 and distance.max() > LOCAL_PROJECTION_MAX_DISTANCE:
+            backend = 'pyproj'
+    return backend
+
+
+def lonlat2aeqd(lonlat, center_lon, center_lat, backend=None):
     '''
     Convert longitude and latitude to azimuthal equidistant projection coordinates.
 
@@ -56,6 +203,11 @@ def lonlat2aeqd(lonlat, center_lon, center_lat):
     ----------
     lonlat : numpy.ndarray
         Longitude and latitude in degrees. The shape of the array is (n,m,2), where n and m are the number of pixels in the first and second dimension, respectively. The last dimension is for longitude and latitude.
+    center_lon, center_lat : float
+        Center of the projection.
+    backend : str
+        `pyproj` or `local`, default is the backend set by `set_projection_backend`.
+        `local` falls back to `pyproj` when any coordinate is farther than `LOCAL_PROJECTION_MAX_DISTANCE` from the center.
 
     Returns
     -------
@@ -74,33 +226,30 @@ def lonlat2aeqd(lonlat, center_lon, center_lat):
            [[-48243.5939812 , -55322.02388971],
             [ 47752.57582735,  55538.86412435]]])
     '''
-    epsg = CRS.from_proj4("+proj=aeqd +lat_0="+str(center_lat) +
-                          " +lon_0="+str(center_lon)+" +datum=WGS84")
-    transformer = Transformer.from_crs("EPSG:4326", epsg, always_xy=True)
+    if select_projection(lonlat, center_lon, center_lat, backend) == 'local':
+        kx, ky = _local_scale(center_lat)
+        return np.stack([(lonlat[:, :, 0]-center_lon)*kx,
+                         (lonlat[:, :, 1]-center_lat)*ky], axis=-1)
+    transformer, _ = aeqd_transformers.get(center_lon, center_lat)
     proj_coords = transformer.transform(lonlat[:, :, 0], lonlat[:, :, 1])
     proj_coords = np.array(proj_coords).transpose([1, 2, 0])
     return proj_coords
 
-def aeqd2lonlat_3d(proj_coords, meanlon, meanlat):
+def aeqd2lonlat_3d(proj_coords, meanlon, meanlat, backend=None):
 
     # 提取 xy 坐标和 z 坐标
     xy_coords = proj_coords[:, :, :2]
     z_coords = proj_coords[:, :, 2] if proj_coords.shape[2] > 2 else np.zeros(
         xy_coords.shape[:2])
 
-    # 定义转换器
-    epsg = CRS.from_proj4("+proj=aeqd +lat_0=" + str(meanlat) +
-                          " +lon_0=" + str(meanlon) + " +datum=WGS84")
-    transformer = Transformer.from_crs(epsg, "EPSG:4326", always_xy=True)
-
     # 转换 xy 坐标
-    lon, lat = transformer.transform(xy_coords[:, :, 0], xy_coords[:, :, 1])
+    lon, lat = np.moveaxis(aeqd2lonlat(xy_coords, meanlon, meanlat, backend), -1, 0)
 
     # 将转换后的坐标和原始 z 坐标组合
     lonlat = np.dstack([lon, lat, z_coords])
     return lonlat
 
-def aeqd2lonlat(proj_coords,meanlon,meanlat):
+def aeqd2lonlat(proj_coords,meanlon,meanlat,backend=None):
     '''
     Convert azimuthal equidistant projection coordinates to longitude and latitude.
 
@@ -112,6 +261,9 @@ def aeqd2lonlat(proj_coords,meanlon,meanlat):
         Longitude of the center of the azimuthal equidistant projection in degrees.
     meanlat : float
         Latitude of the center of the azimuthal equidistant projection in degrees.
+    backend : str
+        `pyproj` or `local`, default is the backend set by `set_projection_backend`.
+        `local` falls back to `pyproj` when any coordinate is farther than `LOCAL_PROJECTION_MAX_DISTANCE` from the center.
 
     Returns
     -------
@@ -134,13 +286,72 @@ def aeqd2lonlat(proj_coords,meanlon,meanlat):
            [[120.,  30.],
             [121.,  31.]]])
     '''
-
-    epsg = CRS.from_proj4("+proj=aeqd +lat_0="+str(meanlat)+" +lon_0="+str(meanlon)+" +datum=WGS84")
-    transformer = Transformer.from_crs( epsg,"EPSG:4326",always_xy = True)
+    # 超出局部投影范围的坐标改用pyproj
+    if (backend or PROJECTION_BACKEND) == 'local' and \
+            np.hypot(proj_coords[:, :, 0], proj_coords[:, :, 1]).max(initial=0) <= LOCAL_PROJECTION_MAX_DISTANCE:
+        kx, ky = _local_scale(meanlat)
+        return np.stack([proj_coords[:, :, 0]/kx+meanlon,
+                         proj_coords[:, :, 1]/ky+meanlat], axis=-1)
+    _, transformer = aeqd_transformers.get(meanlon, meanlat)
     lonlat = transformer.transform(proj_coords[:,:,0], proj_coords[:,:,1])
     lonlat = np.array(lonlat).transpose([1,2,0])
     return lonlat
 
+def union_by_group(gdf, by, geometry='geometry'):
+    '''
+    Union the geometries of each group with vectorized shapely operations.
+
+    Equivalent to ``gdf.groupby(by)[geometry].apply(lambda df: MultiPolygon(list(df)).buffer(0)).reset_index()``,
+    but the groups are unioned by `shapely.union_all` in batches instead of one Python call per group.
+
+    Parameters
+    ----------
+    gdf : GeoDataFrame
+        Geometries to union.
+    by : str or list
+        Column name(s) of the groups.
+    geometry : str
+        Column name of the geometries.
+
+    Returns
+    -------
+    union : GeoDataFrame
+        The group columns and the unioned geometry of each group, sorted by the group columns.
+    '''
+    by = [by] if isinstance(by, str) else list(by)
+    grouped = gdf.groupby(by, sort=True)
+    codes = grouped.ngroup().values
+    keys = grouped.size().reset_index()[by]
+    n = len(keys)
+
+    # 去除分组为空值的几何
+    valid = codes >= 0
+    geoms = np.asarray(gdf[geometry].values, dtype=object)[valid]
+    codes = codes[valid]
+
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    geoms = geoms[order]
+    counts = np.bincount(codes, minlength=n)
+    starts = np.cumsum(counts)-counts
+    position = np.arange(len(codes))-starts[codes]
+
+    # 按组大小（2的幂）分批，每批补齐为矩阵后按行求并集
+    width = 2**np.ceil(np.log2(np.maximum(counts, 1))).astype(int)
+    union = np.empty(n, dtype=object)
+    rows = np.zeros(n, dtype=int)
+    for w in np.unique(width):
+        groups = np.flatnonzero(width == w)
+        rows[groups] = np.arange(len(groups))
+        member = width[codes] == w
+        matrix = np.full((len(groups), w), None, dtype=object)
+        matrix[rows[codes[member]], position[member]] = geoms[member]
+        union[groups] = shapely.union_all(matrix, axis=1)
+
+    # 与buffer(0)的输出一致：外环顺时针，从最左下角的点开始
+    keys[geometry] = shapely.normalize(union)
+    return gpd.GeoDataFrame(keys, geometry=geometry)
+
 def calculate_normal(points):
     points = np.array(points)
     if points.shape[0] < 3:
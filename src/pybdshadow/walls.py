@@ -0,0 +1,104 @@
+"""
+BSD 3-Clause License
+
+Copyright (c) 2022, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+from .utils import _local_scale
+
+
+def get_wall_array(geometry):
+    '''
+    Split the exterior rings of polygons into walls in one vectorized pass.
+
+    Parameters
+    ----------
+    geometry : GeoSeries or array-like of Polygon
+        Building footprints.
+
+    Returns
+    -------
+    walls : numpy.ndarray
+        The walls of the buildings. shape = [n,2,2], where n is the number of walls, 2 is that each wall has two points, and the last dimension is for x and y.
+    building_index : numpy.ndarray
+        Positional index of the polygon each wall belongs to. shape = [n]
+    wall_id : numpy.ndarray
+        Order of the wall in the exterior ring of its polygon, starting from 0. shape = [n]
+    '''
+    rings = shapely.get_exterior_ring(np.asarray(geometry, dtype=object))
+    coords, index = shapely.get_coordinates(rings, return_index=True)
+
+    # 相邻两个点属于同一个多边形时构成一面墙
+    same = index[:-1] == index[1:]
+    walls = np.stack([coords[:-1][same], coords[1:][same]], axis=1)
+    building_index = index[:-1][same]
+
+    # 墙在所属多边形中的序号
+    starts = np.flatnonzero(np.r_[True, building_index[1:] != building_index[:-1]])
+    counts = np.diff(np.r_[starts, len(building_index)])
+    wall_id = np.arange(len(building_index)) - np.repeat(starts, counts)
+    return walls, building_index, wall_id
+
+
+def silhouette_walls(walls, building_index, sunPosition):
+    '''
+    Find the walls facing away from the sun, i.e. the walls whose outward normal points to the direction of the shadow.
+    The shadow of a building is the union of its footprint and the shadows of these walls,
+    the shadows of the other walls are covered by them.
+
+    Parameters
+    ----------
+    walls : numpy.ndarray
+        The walls of the buildings. shape = [n,2,2]
+    building_index : numpy.ndarray
+        The building each wall belongs to. The outward normal of each wall is given by the orientation of
+        the exterior ring, which is computed from the walls of the same building. shape = [n]
+    sunPosition : dict
+        The position of the sun. The keys are 'azimuth' and 'altitude'.
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        Boolean array, True for the walls facing away from the sun. shape = [n]
+    '''
+    center = walls.reshape((-1, 2)).mean(axis=0)
+    shape = walls-center
+    # 外环的方向：同一建筑墙面的有向面积之和
+    cross = shape[:, 0, 0]*shape[:, 1, 1]-shape[:, 1, 0]*shape[:, 0, 1]
+    codes = pd.factorize(building_index)[0]
+    ccw = np.bincount(codes, weights=cross)[codes] > 0
+
+    # 外法向（逆时针外环为 (dy, -dx)），以米为单位与阴影方向比较
+    d = shape[:, 1]-shape[:, 0]
+    kx, ky = _local_scale(center[1])
+    normal = np.where(ccw, 1, -1)[:, np.newaxis]*np.c_[ky*d[:, 1], -kx*d[:, 0]]
+    direction = np.array([np.sin(sunPosition['azimuth']), np.cos(sunPosition['azimuth'])])
+    return normal@direction > 0